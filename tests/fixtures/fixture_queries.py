@@ -0,0 +1,153 @@
+import json
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+import pytest
+from django.db import connections
+from django.template.base import Node
+
+PROJECT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'yatube',
+)
+# Обёртки, через которые проходит любой запрос: место в них ничего не говорит.
+WRAPPER_FILES = {
+    os.path.join(PROJECT_DIR, 'core', 'middleware.py'),
+    os.path.join(PROJECT_DIR, 'core', 'template.py'),
+}
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAMS_RE = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+# Число запросов каждого адреса при каждом размере данных,
+# для --query-snapshot.
+SNAPSHOTS = {}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--query-snapshot', metavar='PATH',
+        help='Сохранить число и вид SQL-запросов каждого адреса в JSON',
+    )
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    path = config.getoption('query_snapshot')
+    if not path or not SNAPSHOTS:
+        return
+    terminalreporter.section('SQL-запросы по адресам')
+    for name, sizes in sorted(SNAPSHOTS.items()):
+        counts = ', '.join(
+            f'{size}: {len(queries)}' for size, queries in sizes.items()
+        )
+        terminalreporter.write_line(f'{name} — {counts}')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(SNAPSHOTS, file, ensure_ascii=False, indent=2)
+
+
+def query_shape(sql):
+    """SQL без значений: строки и числа — `?`, списки параметров — `(...)`."""
+    shape = STRING_RE.sub('?', sql.replace('%s', '?'))
+    shape = NUMBER_RE.sub('?', shape)
+    shape = PARAMS_RE.sub('(...)', shape)
+    return ' '.join(shape.split())
+
+
+def query_origin():
+    """Строка шаблона и строка кода проекта, откуда пришёл запрос."""
+    template = code = None
+    frame = sys._getframe(2)
+    while frame is not None and (template is None or code is None):
+        node = frame.f_locals.get('self')
+        # type(), а не isinstance: ленивые объекты вроде request.user
+        # на проверке __class__ сами пошли бы в базу.
+        if (template is None and issubclass(type(node), Node)
+                and getattr(node, 'token', None) is not None
+                and getattr(node, 'origin', None) is not None):
+            template = f'{node.origin.template_name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if (code is None and filename.startswith(PROJECT_DIR)
+                and filename not in WRAPPER_FILES):
+            code = '{}:{} в {}'.format(
+                os.path.relpath(filename, PROJECT_DIR), frame.f_lineno,
+                frame.f_code.co_name,
+            )
+        frame = frame.f_back
+    return ', '.join(place for place in (template, code) if place) or '?'
+
+
+class QueryLog:
+    """Запросы к базе с их видом и местом, откуда они сделаны."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append({
+            'shape': query_shape(sql),
+            'origin': query_origin(),
+        })
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def shapes(self):
+        return Counter(query['shape'] for query in self.queries)
+
+    def report(self, shapes=None):
+        """Запросы (только вида из `shapes`, если задано) с их местами."""
+        lines = []
+        for query in self.queries:
+            if shapes is None or query['shape'] in shapes:
+                lines.append(f'  {query["origin"]}\n    {query["shape"]}')
+        return '\n'.join(lines)
+
+
+@pytest.fixture
+def count_queries():
+    """Контекстный менеджер, собирающий запросы ко всем базам в QueryLog."""
+    @contextmanager
+    def recorder():
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            yield log
+    return recorder
+
+
+@pytest.fixture
+def assert_queries_stable():
+    """Проверить, что число запросов не растёт вместе с данными.
+
+    Принимает имя адреса и словарь {размер данных: QueryLog}, запоминает
+    снимок для --query-snapshot и при росте показывает, какие запросы
+    добавились и откуда они сделаны.
+    """
+    def check(name, logs):
+        SNAPSHOTS[name] = {
+            size: [query['shape'] for query in log.queries]
+            for size, log in logs.items()
+        }
+        sizes = sorted(logs)
+        smallest = logs[sizes[0]]
+        for size in sizes[1:]:
+            log = logs[size]
+            if len(log) <= len(smallest):
+                continue
+            before = smallest.shapes()
+            grown = {
+                shape for shape, count in log.shapes().items()
+                if count > before[shape]
+            }
+            assert False, (
+                f'Адрес `{name}` делает больше запросов к базе, когда данных '
+                f'больше: {len(smallest)} при размере {sizes[0]}, '
+                f'{len(log)} при размере {size}. Похоже на N+1. '
+                f'Добавившиеся запросы:\n{log.report(grown)}'
+            )
+    return check
@@ -0,0 +1,102 @@
+import pytest
+from django.urls import reverse
+from posts.models import Comment, Follow, Group, Post
+
+from about import urls as about_urls
+from posts import urls as posts_urls
+from users import urls as users_urls
+
+pytestmark = [pytest.mark.django_db]
+
+# Размеры данных: меньше страницы, почти страница и больше страницы.
+SIZES = (1, 5, 15)
+URLCONFS = (posts_urls, users_urls, about_urls)
+QUERY_STRINGS = {'posts:search': '?q=пост'}
+
+
+def url_names():
+    return [
+        f'{urlconf.app_name}:{pattern.name}'
+        for urlconf in URLCONFS for pattern in urlconf.urlpatterns
+    ]
+
+
+class Dataset:
+    """Данные, которые растут между замерами.
+
+    Пользователь `user` пишет посты в группу и подписан на других авторов,
+    у каждого из которых есть пост; к первому посту пишут комментарии.
+    """
+
+    def __init__(self, user, django_user_model):
+        self.user = user
+        self.users = django_user_model.objects
+        self.group = Group.objects.create(
+            title='Группа', slug='queries', description='Описание')
+        self.post = Post.objects.create(
+            text='Первый пост', author=user, group=self.group)
+        self.other = self.users.create_user(username='QueryAuthor')
+
+    def grow(self, size):
+        for i in range(self.user.posts.count(), size):
+            Post.objects.create(
+                text=f'Пост {i}', author=self.user, group=self.group)
+            author = self.users.create_user(username=f'author{i}')
+            Post.objects.create(text=f'Пост автора {i}', author=author)
+            Follow.objects.create(user=self.user, author=author)
+            Comment.objects.create(
+                post=self.post, author=author, text=f'Комментарий {i}')
+
+    def url(self, name):
+        values = {
+            'post_id': self.post.pk,
+            'username': self.user.username,
+            'slug': self.group.slug,
+            'uidb64': 'MQ',
+            'token': 'set-password',
+            'format': 'atom',
+        }
+        if name in ('posts:profile_follow', 'posts:profile_unfollow'):
+            values['username'] = self.other.username
+        app_name, url_name = name.split(':')
+        urlconf = {urls.app_name: urls for urls in URLCONFS}[app_name]
+        pattern = next(
+            pattern for pattern in urlconf.urlpatterns
+            if pattern.name == url_name
+        )
+        kwargs = {key: values[key] for key in pattern.pattern.converters}
+        return reverse(name, kwargs=kwargs) + QUERY_STRINGS.get(name, '')
+
+
+@pytest.fixture
+def no_cache(settings):
+    """Без кэша, чтобы он не прятал лишние запросы."""
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    }
+    settings.PERF_SAMPLE_RATE = 0
+
+
+@pytest.mark.parametrize('name', url_names())
+def test_query_count_does_not_grow(name, no_cache, client, user,
+                                   django_user_model, count_queries,
+                                   assert_queries_stable):
+    dataset = Dataset(user, django_user_model)
+    logs = {}
+    for size in SIZES:
+        dataset.grow(size)
+        url = dataset.url(name)
+        # Первый запрос прогревает кэши Django (типы контента и т.п.).
+        client.force_login(user)
+        client.get(url)
+        client.force_login(user)
+        with count_queries() as log:
+            response = client.get(url)
+            if response.streaming:
+                # Потоковый ответ читает базу, пока его отдают.
+                b''.join(response.streaming_content)
+        assert response.status_code < 500, (
+            f'Адрес `{url}` ответил с ошибкой {response.status_code}'
+        )
+        logs[size] = log
+    assert_queries_stable(name, logs)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Обработчики request_started/request_finished очереди задач.
+        from . import tasks  # noqa: F401
@@ -0,0 +1,464 @@
+"""Бэкенды кэша: общий уровень для всех воркеров и локальный L1 перед ним.
+
+``TieredCache`` держит в памяти процесса небольшой LRU-кэш и ходит в общий
+кэш (``LOCATION`` — имя другого кэша из ``settings.CACHES``) только при
+промахе. Записи L1 живут не дольше ``L1_TIMEOUT`` секунд, поэтому
+изменения, сделанные другими воркерами, видны не позже чем через это
+время; изменения своего процесса видны сразу.
+
+``DatabaseCache`` — таблица кэша Django, которая пишет ``set_many``
+пачкой, а не по ключу; ``CacheRouter`` уводит её в отдельную базу
+``cache``, если она настроена. ``RedisCache`` — необязательный бэкенд
+для Redis (нужен пакет ``redis``).
+"""
+import base64
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends import db
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import DatabaseError, connections, router, transaction
+from django.utils import timezone
+
+from . import perf
+
+_MISSING = object()
+# Какой метрике запроса (core.perf) соответствует счётчик кэша.
+PERF_COUNTERS = {
+    'hits': 'cache_hits', 'l2_hits': 'cache_hits', 'misses': 'cache_misses',
+}
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'l2_hits': 0, 'misses': 0, 'evictions': 0}
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def stats(self):
+        """Счётчики этого процесса: попадания в L1 и L2, промахи, вытеснения.
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._l1))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+        if name in PERF_COUNTERS:
+            perf.count(PERF_COUNTERS[name], amount)
+
+    def _l1_get(self, key):
+        with self._lock:
+            value, expires = self._l1.get(key, (_MISSING, 0))
+            if value is _MISSING:
+                return _MISSING
+            if expires < time.monotonic():
+                del self._l1[key]
+                return _MISSING
+            self._l1.move_to_end(key)
+            return value
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        ttl = self._l1_timeout if timeout is None else min(
+            self._l1_timeout, timeout)
+        if ttl <= 0:
+            return self._l1_delete(key)
+        with self._lock:
+            self._l1[key] = (value, time.monotonic() + ttl)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self._max_entries:
+                self._l1.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _l1_delete(self, key):
+        with self._lock:
+            self._l1.pop(key, None)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        value = self._l1_get(local_key)
+        if value is not _MISSING:
+            self._count('hits')
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._count('misses')
+            return default
+        self._count('l2_hits')
+        self._l1_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            value = self._l1_get(self.make_key(key, version))
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        self._count('hits', len(found))
+        if remote:
+            fetched = self.shared.get_many(remote, version=version)
+            self._count('l2_hits', len(fetched))
+            self._count('misses', len(remote) - len(fetched))
+            for key, value in fetched.items():
+                self._l1_set(self.make_key(key, version), value)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._l1_set(self.make_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in (failed or ()):
+                self._l1_set(self.make_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(self.make_key(key, version), value, timeout)
+        return added
+
+    def add_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """Записать в общий кэш ключи, которых там ещё нет.
+
+        Что осталось в кэше, читается ``get_many``; L1 не заполняется,
+        потому что значение может оказаться чужим.
+        """
+        add_many = getattr(self.shared, 'add_many', None)
+        if add_many is not None:
+            return add_many(data, timeout, version=version)
+        for key, value in data.items():
+            self.shared.add(key, value, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(self.make_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self.make_key(key, version))
+        return self.shared.touch(key, timeout, version=version)
+
+    def has_key(self, key, version=None):
+        if self._l1_get(self.make_key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self.make_key(key, version))
+        self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self.make_key(key, version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+class CacheRouter:
+    """Таблица ``DatabaseCache`` — в базе ``cache``, если она есть.
+
+    Тогда запись в кэш идёт в свой файл и не встаёт в очередь писателей
+    основной базы (``core.sqlite3``), а в базу ``cache`` не попадают
+    таблицы приложений.
+    """
+    alias = 'cache'
+    app_label = 'django_cache'
+
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label == self.app_label
+                and self.alias in settings.DATABASES):
+            return self.alias
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if self.alias not in settings.DATABASES:
+            return None
+        if app_label == self.app_label:
+            return db == self.alias
+        if db == self.alias:
+            return False
+        return None
+
+
+class DatabaseCache(db.DatabaseCache):
+    # Строк в одном INSERT: по три параметра на строку, а старые SQLite
+    # принимают не больше 999 параметров.
+    batch_size = 300
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """Записать ключи одним DELETE и одним INSERT на пачку.
+
+        У Django каждый ключ — отдельные SELECT и INSERT или UPDATE,
+        и страница из N фрагментов стоила бы 2N запросов. Если база
+        записи не приняла, возвращаются все ключи как незаписанные.
+        """
+        rows = self._encode(data, version)
+        if not rows:
+            return []
+        try:
+            self._write_rows(rows, self._expires(timeout))
+        except DatabaseError:
+            # Как и у Django, запись в кэш — по возможности: при
+            # блокировке или гонке за ключ страница не должна падать.
+            return list(data)
+        return []
+
+    def add_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """Записать ключи, которых ещё нет, одним INSERT на пачку.
+
+        Живые значения не меняются: из одновременных ``add_many`` одного
+        ключа остаётся одно значение, и прочитать его можно ``get_many``.
+        """
+        rows = self._encode(data, version)
+        if not rows:
+            return
+        try:
+            self._write_rows(rows, self._expires(timeout), replace=False)
+        except DatabaseError:
+            pass
+
+    def _encode(self, data, version):
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            pickled = pickle.dumps(value, self.pickle_protocol)
+            rows.append((key, base64.b64encode(pickled).decode('latin1')))
+        return rows
+
+    def _expires(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return datetime.max
+        if settings.USE_TZ:
+            return datetime.utcfromtimestamp(timeout)
+        return datetime.fromtimestamp(timeout)
+
+    @staticmethod
+    def _now(connection):
+        now = datetime.utcnow() if settings.USE_TZ else datetime.now()
+        return connection.ops.adapt_datetimefield_value(
+            now.replace(microsecond=0))
+
+    def _write_rows(self, rows, expires, replace=True):
+        """Вставить строки; без ``replace`` живые ключи не трогать."""
+        alias = router.db_for_write(self.cache_model_class)
+        connection = connections[alias]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        cache_key = quote_name('cache_key')
+        expires = connection.ops.adapt_datetimefield_value(
+            expires.replace(microsecond=0))
+        insert = connection.ops.insert_statement(ignore_conflicts=not replace)
+        suffix = connection.ops.ignore_conflicts_suffix_sql(
+            ignore_conflicts=not replace)
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            if cursor.fetchone()[0] > self._max_entries:
+                self._cull(alias, cursor, timezone.now().replace(
+                    microsecond=0))
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                keys = [key for key, _ in batch]
+                placeholders = ', '.join(['%s'] * len(batch))
+                if replace:
+                    cursor.execute(
+                        f'DELETE FROM {table} '
+                        f'WHERE {cache_key} IN ({placeholders})', keys)
+                else:
+                    cursor.execute(
+                        f'DELETE FROM {table} '
+                        f'WHERE {cache_key} IN ({placeholders}) '
+                        f'AND {quote_name("expires")} < %s',
+                        keys + [self._now(connection)])
+                cursor.execute(
+                    '{} {} ({}, {}, {}) VALUES {}{}'.format(
+                        insert, table, cache_key, quote_name('value'),
+                        quote_name('expires'),
+                        ', '.join(['(%s, %s, %s)'] * len(batch)), suffix),
+                    [item for key, value in batch
+                     for item in (key, value, expires)])
+
+    def incr(self, key, delta=1, version=None):
+        """Увеличить число одним ``UPDATE``, не меняя срок записи.
+
+        ``BaseCache.incr`` делает ``get`` и ``set`` со сроком по умолчанию:
+        бессрочная версия кэша (``posts.cache``) истекала бы через пять
+        минут, а два одновременных ``incr`` записывали бы одно значение.
+        Здесь значение меняется, только если с чтения его никто не менял,
+        иначе чтение повторяется.
+        """
+        db_key = self.make_key(key, version=version)
+        self.validate_key(db_key)
+        alias = router.db_for_write(self.cache_model_class)
+        connection = connections[alias]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        cache_key = quote_name('cache_key')
+        value_column = quote_name('value')
+        expires = quote_name('expires')
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT {value_column} FROM {table} '
+                    f'WHERE {cache_key} = %s AND {expires} > %s',
+                    [db_key, self._now(connection)])
+                row = cursor.fetchone()
+                if row is None:
+                    raise ValueError("Key '%s' not found" % key)
+                raw = connection.ops.process_clob(row[0])
+                value = pickle.loads(base64.b64decode(raw.encode())) + delta
+                pickled = pickle.dumps(value, self.pickle_protocol)
+                cursor.execute(
+                    f'UPDATE {table} SET {value_column} = %s '
+                    f'WHERE {cache_key} = %s AND {value_column} = %s',
+                    [base64.b64encode(pickled).decode('latin1'), db_key, raw])
+                if cursor.rowcount:
+                    return value
+
+
+class RedisCache(BaseCache):
+    """Минимальный бэкенд Redis; ``LOCATION`` — URL вида redis://host/0.
+
+    Целые числа хранятся как есть, чтобы ``incr`` был атомарным
+    ``INCRBY``, остальное сериализуется pickle.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._url = location
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self._url)
+        return self._client
+
+    def _ttl(self, timeout):
+        """Время жизни в миллисекундах; None — бессрочно."""
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else int(timeout * 1000)
+
+    @staticmethod
+    def _dumps(value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _loads(raw):
+        try:
+            return int(raw)
+        except ValueError:
+            return pickle.loads(raw)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        raw = self.client.get(self._key(key, version))
+        return default if raw is None else self._loads(raw)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        raws = self.client.mget([self._key(key, version) for key in keys])
+        return {
+            key: self._loads(raw)
+            for key, raw in zip(keys, raws) if raw is not None
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        key = self._key(key, version)
+        if ttl is not None and ttl <= 0:
+            self.client.delete(key)
+            return
+        self.client.set(key, self._dumps(value), px=ttl)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        pipeline = self.client.pipeline()
+        ttl = self._ttl(timeout)
+        for key, value in data.items():
+            pipeline.set(self._key(key, version), self._dumps(value), px=ttl)
+        pipeline.execute()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return bool(self.client.set(
+            self._key(key, version), self._dumps(value),
+            px=self._ttl(timeout), nx=True,
+        ))
+
+    def add_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        pipeline = self.client.pipeline()
+        ttl = self._ttl(timeout)
+        for key, value in data.items():
+            pipeline.set(self._key(key, version), self._dumps(value), px=ttl,
+                         nx=True)
+        pipeline.execute()
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        if not self.client.exists(key):
+            raise ValueError("Key '%s' not found" % key)
+        return self.client.incrby(key, delta)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        key = self._key(key, version)
+        if ttl is None:
+            return bool(self.client.persist(key))
+        return bool(self.client.pexpire(key, ttl))
+
+    def has_key(self, key, version=None):
+        return bool(self.client.exists(self._key(key, version)))
+
+    def delete(self, key, version=None):
+        self.client.delete(self._key(key, version))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        """Очищает всю базу Redis из ``LOCATION``."""
+        self.client.flushdb()
+
+    def close(self, **kwargs):
+        pass
@@ -0,0 +1,47 @@
+"""Отправка писем через очередь задач.
+
+``QueuedEmailBackend`` не отправляет письма сам, а ставит каждое в
+очередь ``core.tasks``; задача отправляет его бэкендом
+``QUEUED_EMAIL_BACKEND``. Поэтому сброс пароля и другие формы не ждут
+почтовый сервер (или запись файла письма) во время запроса.
+"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .tasks import task
+
+
+@task(priority=20)
+def send_email(message):
+    """Отправить письмо, записанное ``serialize``."""
+    email = EmailMultiAlternatives(
+        connection=get_connection(settings.QUEUED_EMAIL_BACKEND),
+        **message,
+    )
+    email.alternatives = [tuple(part) for part in email.alternatives]
+    email.send()
+
+
+def serialize(message):
+    """Письмо в виде словаря для JSON; вложения не поддерживаются."""
+    if message.attachments:
+        raise ValueError('Письма с вложениями через очередь не отправить')
+    return {
+        'subject': str(message.subject),
+        'body': str(message.body),
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': dict(message.extra_headers),
+        'alternatives': list(getattr(message, 'alternatives', ())),
+    }
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            send_email.delay(serialize(message))
+        return len(email_messages)
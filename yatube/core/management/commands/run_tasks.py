@@ -0,0 +1,59 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет фоновые задачи из очереди core.tasks; SIGTERM и Ctrl+C '
+        'дают воркерам закончить текущую задачу'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Сколько процессов-воркеров запустить.',
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Выйти, когда готовых задач не останется.',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=1.0,
+            help='Пауза между проверками пустой очереди, в секундах.',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            self.work(options)
+            return
+        # Соединение с базой не должно достаться дочерним процессам.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=self.work, args=(options,))
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+
+        def stop(signum, frame):
+            for process in processes:
+                process.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        # Ctrl+C и так получает вся группа процессов.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
+
+    def work(self, options):
+        worker = Worker(sleep=options['sleep'])
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        done = worker.run(burst=options['burst'])
+        self.stdout.write(f'{worker.name}: выполнено задач: {done}')
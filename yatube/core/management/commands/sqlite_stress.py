@@ -0,0 +1,197 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+
+from posts.management.commands.benchmark import percentile
+
+MODES = {
+    # Как SQLite работает из коробки: журнал отката, synchronous=FULL,
+    # отложенные транзакции.
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}},
+    'tuned': {'ENGINE': 'core.sqlite3', 'OPTIONS': settings.SQLITE_OPTIONS},
+}
+POSTS = 1000
+SCHEMA = (
+    'CREATE TABLE post (id INTEGER PRIMARY KEY, text TEXT, '
+    'comments INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE comment (id INTEGER PRIMARY KEY, post_id INTEGER, '
+    'text TEXT)',
+    'CREATE INDEX comment_post ON comment (post_id)',
+)
+
+
+class Worker(threading.Thread):
+    """Поток, который до ``deadline`` читает ленту и пишет комментарии."""
+
+    def __init__(self, alias, deadline, write_ratio, seed,
+                 atomic_reads=False):
+        super().__init__()
+        self.alias = alias
+        self.deadline = deadline
+        self.write_ratio = write_ratio
+        self.atomic_reads = atomic_reads
+        self.rng = random.Random(seed)
+        self.reads = self.writes = self.errors = 0
+        self.write_timings = []
+
+    def run(self):
+        connection = connections[self.alias]
+        try:
+            while time.monotonic() < self.deadline:
+                try:
+                    if self.rng.random() < self.write_ratio:
+                        started = time.perf_counter()
+                        self.write(connection)
+                        self.write_timings.append(
+                            time.perf_counter() - started)
+                        self.writes += 1
+                    else:
+                        self.read(connection)
+                        self.reads += 1
+                except DatabaseError:
+                    self.errors += 1
+        finally:
+            connection.close()
+
+    def read(self, connection):
+        """Страница ленты: последние посты и комментарии к одному из них."""
+        if self.atomic_reads:
+            with transaction.atomic(using=self.alias):
+                return self.read_page(connection)
+        return self.read_page(connection)
+
+    def read_page(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id, text, comments FROM post '
+                'ORDER BY id DESC LIMIT 10')
+            cursor.fetchall()
+            cursor.execute(
+                'SELECT id, text FROM comment WHERE post_id = %s '
+                'ORDER BY id DESC LIMIT 10', [self.rng.randint(1, POSTS)])
+            cursor.fetchall()
+
+    def write(self, connection):
+        """Как add_comment: прочитать пост, добавить комментарий, счётчик."""
+        post_id = self.rng.randint(1, POSTS)
+        with transaction.atomic(using=self.alias), \
+                connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM post WHERE id = %s', [post_id])
+            cursor.fetchone()
+            cursor.execute(
+                'INSERT INTO comment (post_id, text) VALUES (%s, %s)',
+                [post_id, 'комментарий'])
+            cursor.execute(
+                'UPDATE post SET comments = comments + 1 WHERE id = %s',
+                [post_id])
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест SQLite: чтение ленты и запись комментариев из '
+        'нескольких потоков в обычном режиме SQLite и в режиме проекта'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument(
+            '--write-ratio', type=float, default=0.2,
+            help='Доля операций записи.',
+        )
+        parser.add_argument(
+            '--modes', nargs='+', choices=sorted(MODES),
+            default=['default', 'tuned'],
+        )
+        parser.add_argument(
+            '--atomic-reads', action='store_true',
+            help='Читать ленту внутри transaction.atomic: в режиме проекта '
+                 'такие чтения встают в очередь писателей.',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Сохранить результаты в JSON.')
+
+    def handle(self, *args, **options):
+        results = {}
+        self.stdout.write('{:<8} {:>7} {:>9} {:>8} {:>7} {:>12}'.format(
+            'режим', 'потоков', 'опер./с', 'записей', 'ошибок',
+            'запись p95'))
+        for mode in options['modes']:
+            results[mode] = {}
+            for workers in options['workers']:
+                result = self.run(mode, workers, options)
+                results[mode][workers] = result
+                self.stdout.write(
+                    '{:<8} {:>7} {:>9.0f} {:>8} {:>7} {:>9.1f} мс'.format(
+                        mode, workers, result['ops_per_second'],
+                        result['writes'], result['errors'],
+                        result['write_p95_ms']))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    def run(self, mode, workers, options):
+        """Прогон в отдельном файле базы под временным псевдонимом."""
+        alias = f'sqlite_stress_{mode}_{workers}'
+        with tempfile.TemporaryDirectory() as directory:
+            connections.databases[alias] = dict(
+                MODES[mode], NAME=os.path.join(directory, 'stress.sqlite3'))
+            connections.ensure_defaults(alias)
+            connections.prepare_test_settings(alias)
+            try:
+                self.create_schema(alias)
+                deadline = time.monotonic() + options['seconds']
+                threads = [
+                    Worker(alias, deadline, options['write_ratio'],
+                           options['seed'] + number,
+                           options['atomic_reads'])
+                    for number in range(workers)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                return self.summarize(alias, threads, options['seconds'])
+            finally:
+                connections[alias].close()
+                del connections[alias]
+                del connections.databases[alias]
+
+    @staticmethod
+    def create_schema(alias):
+        with connections[alias].cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.executemany(
+                'INSERT INTO post (text) VALUES (%s)',
+                [(f'пост {number}',) for number in range(POSTS)])
+
+    @staticmethod
+    def summarize(alias, threads, seconds):
+        reads = sum(thread.reads for thread in threads)
+        writes = sum(thread.writes for thread in threads)
+        timings = [value * 1000 for thread in threads
+                   for value in thread.write_timings]
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'SELECT (SELECT COUNT(*) FROM comment), '
+                '(SELECT SUM(comments) FROM post)')
+            comments, counted = cursor.fetchone()
+        p95 = percentile(timings, 95) if timings else 0
+        return {
+            'reads': reads,
+            'writes': writes,
+            'errors': sum(thread.errors for thread in threads),
+            'ops_per_second': round((reads + writes) / seconds, 1),
+            'write_p95_ms': round(p95, 2),
+            # Каждая подтверждённая запись на месте, счётчики сходятся.
+            'consistent': comments == counted == writes,
+        }
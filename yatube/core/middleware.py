@@ -0,0 +1,102 @@
+import random
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import perf
+
+
+class QueryTimer:
+    """Обёртка ``execute_wrapper``: число и время запросов к базе."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics.counters['queries'] += 1
+            self.metrics.timings['db'] += (
+                time.perf_counter() - started) * 1000
+
+
+class PerformanceMiddleware:
+    """Метрики выборки запросов: заголовок ``Server-Timing`` и лог.
+
+    Замеряется доля ``PERF_SAMPLE_RATE`` запросов, остальные проходят
+    без накладных расходов. Для них считаются запросы к базе и их время,
+    попадания и промахи кэша, время рендеринга шаблонов и обработки
+    картинок, а при ``PERF_TRACE_MEMORY`` — пик памяти по tracemalloc.
+    tracemalloc общий на процесс, поэтому в пик попадают и соседние
+    потоки, а пока его держит другой запрос, память не замеряется.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, 'PERF_SAMPLE_RATE', 0)
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+        metrics = perf.start()
+        trace_memory = (getattr(settings, 'PERF_TRACE_MEMORY', False)
+                        and not tracemalloc.is_tracing())
+        try:
+            with ExitStack() as stack:
+                timer = QueryTimer(metrics)
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                if trace_memory:
+                    tracemalloc.start()
+                    stack.callback(tracemalloc.stop)
+                response = self.get_response(request)
+                if trace_memory:
+                    metrics.counters['memory_peak_kb'] = (
+                        tracemalloc.get_traced_memory()[1] // 1024)
+            total = metrics.elapsed_ms()
+            response['Server-Timing'] = self.server_timing(metrics, total)
+            perf.log(self.record(request, response, metrics, total))
+            return response
+        finally:
+            perf.stop()
+
+    @staticmethod
+    def server_timing(metrics, total):
+        counters, timings = metrics.counters, metrics.timings
+        entries = [
+            'total;dur={:.1f}'.format(total),
+            'db;dur={:.1f};desc="{} queries"'.format(
+                timings['db'], counters['queries']),
+            'cache;desc="{} hits, {} misses"'.format(
+                counters['cache_hits'], counters['cache_misses']),
+            'template;dur={:.1f}'.format(timings['template']),
+        ]
+        if 'thumbnail' in timings:
+            entries.append(
+                'thumbnail;dur={:.1f}'.format(timings['thumbnail']))
+        if 'memory_peak_kb' in counters:
+            entries.append('memory;desc="peak {} KB"'.format(
+                counters['memory_peak_kb']))
+        return ', '.join(entries)
+
+    @staticmethod
+    def record(request, response, metrics, total):
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total, 2),
+        }
+        record.update(metrics.counters)
+        record.update(
+            (name + '_ms', round(value, 2))
+            for name, value in metrics.timings.items()
+        )
+        return record
@@ -0,0 +1,60 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """Поставленная в очередь задача ``core.tasks``."""
+    QUEUED = 'queued'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(
+        max_length=200,
+        verbose_name='Задача')
+    arguments = models.TextField(
+        default='{}',
+        verbose_name='Аргументы')
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name='Приоритет')
+    # Не раньше какого времени задачу можно взять; у взятой задачи —
+    # когда её можно взять снова, если воркер не справился.
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Когда выполнить')
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+        verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попыток')
+    max_attempts = models.PositiveSmallIntegerField(
+        default=5,
+        verbose_name='Попыток всего')
+    locked_by = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name='Воркер')
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Последняя ошибка')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Поставлена')
+
+    class Meta:
+        verbose_name = 'задача'
+        verbose_name_plural = 'задачи'
+        indexes = [
+            models.Index(
+                fields=('status', '-priority', 'run_at'),
+                name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
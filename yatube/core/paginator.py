@@ -0,0 +1,248 @@
+import base64
+import binascii
+import json
+from math import ceil, isfinite
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+
+# Целые больше этого база не примет как параметр запроса.
+MAX_CURSOR_INT = 2 ** 63 - 1
+
+
+def _encode_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _valid_cursor_value(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return abs(value) <= MAX_CURSOR_INT
+    if isinstance(value, float):
+        return isfinite(value)
+    return isinstance(value, str)
+
+
+class WindowedPaginator(Paginator):
+    """Пагинатор, который показывает не все номера страниц, а окно.
+
+    ``page_window`` возвращает номера вокруг текущей страницы, первые
+    и последние номера и ``None`` на месте пропусков — не больше
+    ``2 * (on_each_side + on_ends) + 3`` элементов при любом числе
+    страниц. Если число страниц неизвестно (``total_pages`` равно None:
+    счётчика нет или он приблизительный), окно заканчивается текущей
+    страницей, следующей за ней и пропуском.
+    """
+
+    @property
+    def total_pages(self):
+        return self.num_pages
+
+    def page_window(self, page, on_each_side=2, on_ends=1):
+        number = page.number
+        total = self.total_pages
+        if total is not None and total < number + page.has_next():
+            # Счётчик отстал от данных: номеру последней страницы не верим.
+            total = None
+        if total is not None and total <= 2 * (on_each_side + on_ends) + 1:
+            return list(range(1, total + 1))
+        window = []
+        if number > on_each_side + on_ends + 2:
+            window += list(range(1, on_ends + 1)) + [None]
+            window += list(range(number - on_each_side, number + 1))
+        else:
+            window += list(range(1, number + 1))
+        if total is None:
+            if page.has_next():
+                window += [number + 1, None]
+        elif number < total - on_each_side - on_ends - 1:
+            window += list(range(number + 1, number + on_each_side + 1))
+            window += [None] + list(range(total - on_ends + 1, total + 1))
+        else:
+            window += list(range(number + 1, total + 1))
+        return window
+
+
+class KeysetPaginator(WindowedPaginator):
+    """Курсорная пагинация по ключу (по умолчанию ``(pub_date, id)``).
+
+    Следующая страница запрашивается по курсору ``?after=``, предыдущая —
+    по ``?before=``; курсор — закодированные значения ключа крайней записи
+    текущей страницы. Стоимость такой страницы не зависит от её глубины
+    и не требует ``COUNT(*)``. Номера страниц (``?page=N``) поддерживаются
+    как запасной вариант через ``OFFSET``.
+
+    ``count`` — заранее известное число записей (например, из таблицы
+    счётчиков); без него, как и при ``estimated=True``, номер последней
+    страницы не показывается. Номер дальше последней страницы (или дальше
+    ``max_page``, если число страниц неизвестно) даёт последнюю страницу.
+    """
+    # Глубже по OFFSET не листаем: дальше — только последняя страница.
+    max_page = 10000
+
+    def __init__(self, object_list, per_page, key=('-pub_date', '-id'),
+                 count=None, estimated=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.key = tuple(key)
+        self.estimated = estimated
+        if count is not None:
+            self.__dict__['count'] = count
+
+    @property
+    def total_pages(self):
+        """Число страниц по точному счётчику или None."""
+        if self.estimated or 'count' not in self.__dict__:
+            return None
+        hits = max(1, self.count - self.orphans)
+        return max(1, ceil(hits / self.per_page))
+
+    @property
+    def key_names(self):
+        return [field.lstrip('-') for field in self.key]
+
+    def encode_cursor(self, obj):
+        values = [_encode_value(getattr(obj, name)) for name in self.key_names]
+        data = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Вернуть значения ключа из курсора или None, если он испорчен."""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != len(self.key):
+                return None
+            if not all(_valid_cursor_value(value) for value in values):
+                return None
+            values = self.cursor_values(values)
+        except (binascii.Error, TypeError, ValueError, OverflowError,
+                ValidationError):
+            return None
+        if any(value is None for value in values):
+            return None
+        return values
+
+    def cursor_values(self, values):
+        """Привести значения из курсора к типам полей ключа."""
+        opts = self.object_list.model._meta
+        return [
+            opts.get_field(name).to_python(value)
+            for name, value in zip(self.key_names, values)
+        ]
+
+    def _ordered(self, reverse=False):
+        fields = self.key
+        if reverse:
+            fields = [
+                field[1:] if field.startswith('-') else '-' + field
+                for field in self.key
+            ]
+        return self.object_list.order_by(*fields)
+
+    def _seek(self, values, reverse=False):
+        """Условие «строго после ``values``» в порядке ключа."""
+        condition = Q()
+        for i, field in enumerate(self.key):
+            descending = field.startswith('-') != reverse
+            lookup = '%s__%s' % (field.lstrip('-'), 'lt' if descending
+                                 else 'gt')
+            step = Q(**{lookup: values[i]})
+            for name, value in zip(self.key_names[:i], values[:i]):
+                step &= Q(**{name: value})
+            condition |= step
+        return condition
+
+    def seek(self, values=None, reverse=False):
+        """Запрос записей после ``values`` в порядке ключа."""
+        queryset = self._ordered(reverse)
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse))
+        return queryset
+
+    def rows(self, values=None, reverse=False, offset=0):
+        """До ``per_page + 1`` записей после ``values`` в порядке ключа."""
+        queryset = self.seek(values, reverse)
+        return list(queryset[offset:offset + self.per_page + 1])
+
+    def _forward(self, rows, has_previous):
+        return rows[:self.per_page], has_previous, len(rows) > self.per_page
+
+    def _backward(self, rows, has_next):
+        has_previous = len(rows) > self.per_page
+        return rows[:self.per_page][::-1], has_previous, has_next
+
+    def _last(self):
+        """Последняя страница с конца ключа, без ``OFFSET``.
+
+        При точном счётчике у неё настоящий номер и остаток записей,
+        как у ``?page=N``, иначе — полная страница без номера.
+        """
+        rows = self.rows(reverse=True)
+        total = self.total_pages
+        if total is None:
+            return (None,) + self._backward(rows, False)
+        rows = rows[:max(self.count - (total - 1) * self.per_page, 1)]
+        return total, rows[::-1], total > 1, False
+
+    def _fetch(self, number, after, before):
+        """Вернуть (записи, номер, есть ли предыдущая, есть ли следующая)."""
+        values = self.decode_cursor(after)
+        if values is not None:
+            return (None,) + self._forward(self.rows(values), True)
+        values = self.decode_cursor(before)
+        if values is not None:
+            return (None,) + self._backward(
+                self.rows(values, reverse=True), True)
+        if number == 'last':
+            return self._last()
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        if number > (self.total_pages or self.max_page):
+            return self._last()
+        offset = (number - 1) * self.per_page
+        rows = self.rows(offset=offset)
+        if not rows and number > 1:
+            return self._last()
+        return (number, rows[:self.per_page], number > 1,
+                len(rows) > self.per_page)
+
+    def get_page(self, number=None, after=None, before=None):
+        """Вернуть страницу по курсору или номеру, не падая на мусоре.
+
+        Номер курсорной страницы берётся из ``number``, если ссылка его
+        передала (``?after=...&page=N``), иначе он условный: 1 у первой
+        страницы, 2 у остальных, а ``page.numbered`` ложно. ``num_pages``
+        подбирается так, чтобы ``has_next()`` и ``has_previous()``
+        обычной ``Page`` отвечали верно.
+        """
+        fetched, rows, has_previous, has_next = self._fetch(
+            number, after, before)
+        if fetched is None and not has_previous:
+            fetched = 1
+        elif fetched is None and number != 'last':
+            fetched = self._cursor_number(number)
+        numbered = fetched is not None
+        number = fetched if numbered else 2 if has_previous else 1
+        self.__dict__['num_pages'] = number + 1 if has_next else number
+        page = self._get_page(rows, number, self)
+        page.numbered = numbered
+        page.next_cursor = self.encode_cursor(rows[-1]) if rows else ''
+        page.previous_cursor = self.encode_cursor(rows[0]) if rows else ''
+        return page
+
+    @staticmethod
+    def _cursor_number(number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return None
+        return number if number > 1 else None
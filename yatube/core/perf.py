@@ -0,0 +1,72 @@
+"""Метрики производительности текущего запроса.
+
+``PerformanceMiddleware`` открывает для выбранного запроса ``Metrics``
+в локальной памяти потока, а остальной код пополняет их через
+``count`` и ``timer``. Вне выбранного запроса обе функции почти ничего
+не стоят: одна проверка атрибута ``threading.local``.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger('yatube.perf')
+
+_local = threading.local()
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(float)
+        self._running = set()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+def current():
+    return getattr(_local, 'metrics', None)
+
+
+def start():
+    _local.metrics = Metrics()
+    return _local.metrics
+
+
+def stop():
+    _local.metrics = None
+
+
+def count(name, amount=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.counters[name] += amount
+
+
+@contextmanager
+def timer(name):
+    """Добавить время блока к метрике ``name``, в миллисекундах.
+
+    Вложенные блоки с тем же именем (шаблон внутри шаблона) не
+    считаются дважды. Годится и как декоратор функции.
+    """
+    metrics = current()
+    if metrics is None or name in metrics._running:
+        yield
+        return
+    metrics._running.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._running.discard(name)
+        metrics.timings[name] += (time.perf_counter() - started) * 1000
+
+
+def log(record):
+    """Записать метрики одной строкой JSON в лог ``yatube.perf``."""
+    logger.info(json.dumps(record, ensure_ascii=False, sort_keys=True))
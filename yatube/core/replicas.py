@@ -0,0 +1,102 @@
+"""Чтение из реплик базы с гарантией «читаю свои записи».
+
+Запросы на чтение идут в реплики (``REPLICA_DATABASES``) только внутри
+view, помеченных ``@use_replicas``, и только для моделей из
+``ReplicaRouter.apps``: сессии и таблица кэша всегда читаются из
+основной базы. Запись всегда идёт в основную базу.
+
+Реплики отстают от основной базы, поэтому после запроса, который
+что-то записал, ``PrimaryPinMiddleware`` ставит cookie, и следующие
+``REPLICA_PIN_SECONDS`` секунд этот пользователь читает только из
+основной базы — и видит свой пост, комментарий или подписку.
+"""
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'primary_until'
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'REPLICA_DATABASES', ())
+
+
+def current_replica():
+    """Реплика, из которой сейчас читает запрос, или None."""
+    if getattr(_state, 'wrote', False):
+        return None
+    return getattr(_state, 'replica', None)
+
+
+def use_replicas(view):
+    """Читать данные view из реплики, если пользователь не привязан
+    к основной базе.
+
+    Реплика выбирается одна на запрос, чтобы все его запросы видели
+    одно и то же состояние данных.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        previous = getattr(_state, 'replica', None)
+        aliases = replicas()
+        if aliases and not getattr(_state, 'pinned', False):
+            _state.replica = random.choice(aliases)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = previous
+    return wrapper
+
+
+class ReplicaRouter:
+    apps = {'auth', 'posts'}
+
+    def db_for_read(self, model, **hints):
+        replica = current_replica()
+        # После записи в этом же запросе читаем то, что записали.
+        if replica is not None and model._meta.app_label in self.apps:
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in self.apps:
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """Привязать пользователя к основной базе после записи."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            until = 0
+        _state.pinned = until > time.time()
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            if _state.wrote and replicas():
+                seconds = settings.REPLICA_PIN_SECONDS
+                response.set_cookie(
+                    PIN_COOKIE, str(int(time.time() + seconds)),
+                    max_age=seconds, httponly=True, samesite='Lax',
+                )
+            return response
+        finally:
+            _state.pinned = _state.wrote = False
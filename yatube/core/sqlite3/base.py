@@ -0,0 +1,154 @@
+"""SQLite под конкурентной записью: прагмы соединения и один писатель.
+
+Настраивается ключами ``OPTIONS`` базы вдобавок к параметрам
+``sqlite3.connect``:
+
+``pragmas``
+    словарь ``PRAGMA``, которые выполняются на каждом новом соединении:
+    WAL, ``synchronous``, ``busy_timeout``, ``mmap_size`` и т. п.
+``transaction_mode``
+    режим ``BEGIN`` у ``transaction.atomic``. С ``IMMEDIATE`` транзакция
+    берёт блокировку записи сразу. Отложенная транзакция, которая сначала
+    читает, а потом пишет, может получить «database is locked», не
+    дождавшись ``busy_timeout``: SQLite не ждёт там, где ожидание
+    привело бы к взаимоблокировке.
+``serialize_writes``
+    пускать транзакции процесса в файл базы по одной через общую
+    очередь. Иначе потоки спорят за блокировку SQLite и засыпают в её
+    обработчике занятости дольше, чем длится сама запись. Между
+    процессами запись по-прежнему разводит ``busy_timeout``. Запись вне
+    транзакции (``QuerySet.update()`` в автокоммите) встаёт в ту же
+    очередь на время одного запроса. Место в очереди занимает любой
+    ``atomic()``, даже если внутри только чтение: Django не говорит
+    заранее, будет ли транзакция писать, а ``BEGIN IMMEDIATE`` всё равно
+    берёт блокировку записи с самого начала. Поэтому чтение в
+    транзакцию не заворачивают; цену такого чтения показывает
+    ``sqlite_stress --atomic-reads``.
+"""
+import re
+import threading
+from contextlib import contextmanager
+
+from django.db.backends import utils
+from django.db.backends.sqlite3 import base
+from django.db.utils import OperationalError
+
+OPTIONS = ('pragmas', 'transaction_mode', 'serialize_writes')
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.I)
+
+
+def writer_lock(name):
+    """Общая для процесса очередь транзакций к файлу базы ``name``."""
+    with _writers_lock:
+        return _writers.setdefault(name, threading.Lock())
+
+
+class WriterQueueMixin:
+    """Курсор, который ставит запись вне транзакции в очередь писателей."""
+
+    def _execute(self, sql, *args):
+        with self.db.autocommit_writer(sql):
+            return super()._execute(sql, *args)
+
+    def _executemany(self, sql, *args):
+        with self.db.autocommit_writer(sql):
+            return super()._executemany(sql, *args)
+
+
+class CursorWrapper(WriterQueueMixin, utils.CursorWrapper):
+    pass
+
+
+class CursorDebugWrapper(WriterQueueMixin, utils.CursorDebugWrapper):
+    pass
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = options.get('pragmas', {})
+        self.transaction_mode = options.get('transaction_mode')
+        self.serialize_writes = options.get('serialize_writes', False)
+        # Дольше busy_timeout очередь не ждёт, как и сама SQLite.
+        self.writer_timeout = self.pragmas.get(
+            'busy_timeout', options.get('timeout', 5) * 1000) / 1000
+        self.holds_writer = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for option in OPTIONS:
+            kwargs.pop(option, None)
+        return kwargs
+
+    def init_connection_state(self):
+        super().init_connection_state()
+        cursor = self.connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+
+    def make_cursor(self, cursor):
+        return CursorWrapper(cursor, self)
+
+    def make_debug_cursor(self, cursor):
+        return CursorDebugWrapper(cursor, self)
+
+    def acquire_writer(self):
+        lock = writer_lock(self.settings_dict['NAME'])
+        if not lock.acquire(timeout=self.writer_timeout):
+            raise OperationalError('database is locked')
+        self.holds_writer = True
+
+    @contextmanager
+    def autocommit_writer(self, sql):
+        """Держать очередь писателей на время записи в автокоммите."""
+        if (not self.serialize_writes or self.holds_writer
+                or not self.get_autocommit()
+                or not WRITE_STATEMENT.match(sql)):
+            yield
+            return
+        self.acquire_writer()
+        try:
+            yield
+        finally:
+            self.release_writer()
+
+    def _start_transaction_under_autocommit(self):
+        if self.serialize_writes and not self.holds_writer:
+            self.acquire_writer()
+        try:
+            self.cursor().execute(
+                'BEGIN {}'.format(self.transaction_mode or '').strip())
+        except BaseException:
+            self.release_writer()
+            raise
+
+    def release_writer(self):
+        if self.holds_writer:
+            self.holds_writer = False
+            writer_lock(self.settings_dict['NAME']).release()
+
+    def _commit(self):
+        try:
+            super()._commit()
+        finally:
+            self.release_writer()
+
+    def _rollback(self):
+        try:
+            super()._rollback()
+        finally:
+            self.release_writer()
+
+    def _close(self):
+        try:
+            super()._close()
+        finally:
+            self.release_writer()
@@ -0,0 +1,134 @@
+"""Стеммер Портера (Snowball) для русского языка.
+
+Нужен поиску на SQLite: у FTS5 нет русского стеммера, поэтому текст
+и запрос приводятся к основам до того, как попадают в индекс.
+Слова не на кириллице только переводятся в нижний регистр.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (
+    (('в', 'вши', 'вшись'), True),
+    (('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'), False),
+)
+ADJECTIVE = ((
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем',
+    'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю',
+    'ая', 'яя', 'ою', 'ею',
+), False),
+PARTICIPLE = (
+    (('ем', 'нн', 'вш', 'ющ', 'щ'), True),
+    (('ивш', 'ывш', 'ующ'), False),
+)
+REFLEXIVE = (('ся', 'сь'), False),
+VERB = (
+    (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+      'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'), True),
+    (('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+      'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+      'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+     False),
+)
+NOUN = ((
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии',
+    'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам',
+    'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия',
+    'ья', 'я',
+), False),
+SUPERLATIVE = (('ейше', 'ейш'), False),
+DERIVATIONAL = ('ость', 'ост')
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile('[а-я]')
+
+
+def _regions(word):
+    """Начала областей RV и R2 в слове."""
+    rv = next(
+        (i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r1 = r2 = len(word)
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            if r1 == len(word):
+                r1 = i + 1
+            elif i - 1 >= r1:
+                r2 = i + 1
+                break
+    return rv, r2
+
+
+def _cut(word, groups):
+    """Отрезать самое длинное из окончаний ``groups``.
+
+    Окончания групп с флагом ``True`` снимаются, только если перед ними
+    стоит «а» или «я». Возвращает None, если подходящего окончания нет.
+    """
+    best = None
+    for endings, after_a in groups:
+        for ending in endings:
+            if word.endswith(ending) and (
+                    best is None or len(ending) > len(best[0])):
+                best = ending, after_a
+    if best is None:
+        return None
+    ending, after_a = best
+    stem = word[:-len(ending)]
+    if after_a and not stem.endswith(('а', 'я')):
+        return None
+    return stem
+
+
+def _strip_inflection(rv):
+    """Шаг 1: деепричастие либо возвратность и окончание."""
+    result = _cut(rv, PERFECTIVE_GERUND)
+    if result is not None:
+        return result
+    reflexive = _cut(rv, REFLEXIVE)
+    if reflexive is not None:
+        rv = reflexive
+    result = _cut(rv, ADJECTIVE)
+    if result is not None:
+        participle = _cut(result, PARTICIPLE)
+        return result if participle is None else participle
+    for groups in (VERB, NOUN):
+        result = _cut(rv, groups)
+        if result is not None:
+            return result
+    return rv
+
+
+def _strip_tail(rv):
+    """Шаг 4: «нн», превосходная степень или мягкий знак."""
+    if rv.endswith('нн'):
+        return rv[:-1]
+    result = _cut(rv, SUPERLATIVE)
+    if result is not None:
+        return result[:-1] if result.endswith('нн') else result
+    if rv.endswith('ь'):
+        return rv[:-1]
+    return rv
+
+
+def stem(word):
+    """Основа русского слова."""
+    word = word.lower().replace('ё', 'е')
+    rv_start, r2_start = _regions(word)
+    prefix = word[:rv_start]
+    rv = _strip_inflection(word[rv_start:])
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and (
+                len(prefix) + len(rv) - len(ending) >= r2_start):
+            rv = rv[:-len(ending)]
+            break
+    return prefix + _strip_tail(rv)
+
+
+def stem_words(text):
+    """Основы всех слов текста по порядку."""
+    return [
+        stem(word) if CYRILLIC_RE.search(word) else word
+        for word in WORD_RE.findall(text.lower().replace('ё', 'е'))
+    ]
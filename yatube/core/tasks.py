@@ -0,0 +1,238 @@
+"""Очередь фоновых задач в таблице базы, без внешнего брокера.
+
+Функция становится задачей декоратором ``@task``::
+
+    @task(priority=10)
+    def fan_out_post(post_id):
+        ...
+
+    fan_out_post.delay(post.pk)            # как можно скорее
+    fan_out_post.schedule(3600, post.pk)   # не раньше чем через час
+    fan_out_post(post.pk)                  # сейчас же, без очереди
+
+Задача записывается строкой ``Job`` в той же транзакции, что и данные,
+которые её породили: откатилась запись — пропала и задача. Аргументы
+хранятся в JSON, поэтому задачам передают id, а не объекты.
+
+Задачи разбирают воркеры ``manage.py run_tasks``: сначала с большим
+приоритетом, потом по времени. Взятая задача прячется от других
+воркеров на ``TASKS_LEASE_SECONDS``: если воркер за это время не
+закончил её (упал), её возьмёт другой. Упавшая задача повторяется со
+всё большей паузой, а после ``max_attempts`` попыток остаётся в таблице
+со статусом «Ошибка» и видна в админке. Поэтому задачи должны спокойно
+переносить повторное выполнение.
+
+При ``TASKS_INLINE`` задачи, поставленные во время запроса, выполняет
+сам веб-процесс, когда ответ уже отдан (по ``request_finished``), а
+поставленные вне запроса — сразу. Отложенные задачи и повторные
+попытки всё равно ждут воркера.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from functools import update_wrapper
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import perf
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Самая долгая пауза перед повторной попыткой, в секундах.
+MAX_RETRY_DELAY = 3600
+
+# Задачи, которые нужно выполнить после ответа на текущий запрос.
+_pending = threading.local()
+
+
+class Task:
+    """Функция, которую можно поставить в очередь."""
+
+    def __init__(self, function, priority=0, max_attempts=5, retry_delay=10):
+        self.function = function
+        self.name = f'{function.__module__}.{function.__qualname__}'
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        update_wrapper(self, function)
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Поставить задачу в очередь на ближайшее время."""
+        return self.schedule(None, *args, **kwargs)
+
+    def schedule(self, when, *args, **kwargs):
+        """Поставить задачу в очередь на время ``when``.
+
+        ``when`` — datetime, timedelta или число секунд от текущего
+        момента; None — как можно скорее.
+        """
+        now = timezone.now()
+        if when is None:
+            run_at = now
+        elif isinstance(when, datetime):
+            run_at = when
+        elif isinstance(when, timedelta):
+            run_at = now + when
+        else:
+            run_at = now + timedelta(seconds=when)
+        job = Job.objects.create(
+            name=self.name,
+            arguments=json.dumps({'args': args, 'kwargs': kwargs}),
+            priority=self.priority,
+            max_attempts=self.max_attempts,
+            run_at=run_at,
+        )
+        perf.count('tasks')
+        if settings.TASKS_INLINE and run_at <= now:
+            pending = getattr(_pending, 'job_ids', None)
+            if pending is not None:
+                pending.append(job.pk)
+            else:
+                run_job(job.pk)
+        return job
+
+    def get_retry_delay(self, attempts):
+        return min(self.retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def task(function=None, **options):
+    """Сделать функцию задачей: ``@task`` или ``@task(priority=...)``.
+
+    ``priority`` — чем больше, тем раньше; ``max_attempts`` — сколько
+    раз пробовать; ``retry_delay`` — пауза в секундах перед второй
+    попыткой, дальше она удваивается.
+    """
+    if function is None:
+        return lambda function: Task(function, **options)
+    return Task(function, **options)
+
+
+def claim(jobs, worker):
+    """Взять первую готовую к выполнению задачу из ``jobs`` или None."""
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            job = jobs.filter(
+                status=Job.QUEUED, run_at__lte=now
+            ).order_by(
+                '-priority', 'run_at', 'pk'
+            ).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            lease = now + timedelta(seconds=settings.TASKS_LEASE_SECONDS)
+            # Берём задачу, только если её не успел взять другой воркер:
+            # тогда он уже сдвинул run_at.
+            taken = Job.objects.filter(
+                pk=job.pk, run_at=job.run_at
+            ).update(
+                run_at=lease, locked_by=worker, attempts=F('attempts') + 1)
+        if taken:
+            job.run_at, job.locked_by = lease, worker
+            job.attempts += 1
+            return job
+
+
+def execute(job):
+    """Выполнить взятую задачу; True, если она выполнилась без ошибок."""
+    started = time.perf_counter()
+    task = None
+    try:
+        task = import_string(job.name)
+        if not isinstance(task, Task):
+            raise TypeError(f'{job.name} не задача')
+        arguments = json.loads(job.arguments)
+        task.function(*arguments['args'], **arguments['kwargs'])
+    except Exception:
+        logger.exception('Задача %s #%s не выполнилась', job.name, job.pk)
+        changes = {'locked_by': '', 'last_error': traceback.format_exc()}
+        if task is None or job.attempts >= job.max_attempts:
+            changes['status'] = Job.FAILED
+        else:
+            changes['run_at'] = timezone.now() + timedelta(
+                seconds=task.get_retry_delay(job.attempts))
+        Job.objects.filter(pk=job.pk).update(**changes)
+        succeeded = False
+    else:
+        Job.objects.filter(pk=job.pk).delete()
+        succeeded = True
+    # Как и запросы, замеряется доля PERF_SAMPLE_RATE задач.
+    rate = getattr(settings, 'PERF_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        perf.log({
+            'event': 'task',
+            'task': job.name,
+            'job_id': job.pk,
+            'attempt': job.attempts,
+            'succeeded': succeeded,
+            'task_ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+    return succeeded
+
+
+def run_job(job_id, worker='inline'):
+    """Выполнить задачу ``job_id`` сейчас, если её никто не взял."""
+    job = claim(Job.objects.filter(pk=job_id), worker)
+    if job is not None:
+        execute(job)
+
+
+@receiver(request_started)
+def collect_jobs(**kwargs):
+    _pending.job_ids = []
+
+
+@receiver(request_finished)
+def run_collected_jobs(**kwargs):
+    job_ids = getattr(_pending, 'job_ids', None) or ()
+    _pending.job_ids = None
+    for job_id in job_ids:
+        run_job(job_id)
+
+
+class Worker:
+    """Воркер, который берёт задачи из очереди по одной."""
+
+    def __init__(self, name=None, sleep=1.0):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.sleep = sleep
+        self.stopping = False
+
+    def stop(self, *args):
+        """Закончить после текущей задачи; годится как обработчик сигнала."""
+        self.stopping = True
+
+    def run(self, burst=False):
+        """Выполнять задачи до ``stop()``, а при ``burst`` — пока они есть.
+
+        Возвращает число выполненных задач.
+        """
+        done = 0
+        while not self.stopping:
+            # Внутри транзакции (в тестах) соединение закрывать нельзя.
+            if not connection.in_atomic_block:
+                close_old_connections()
+            job = claim(Job.objects.all(), self.name)
+            if job is None:
+                if burst:
+                    break
+                time.sleep(self.sleep)
+                continue
+            execute(job)
+            done += 1
+        return done
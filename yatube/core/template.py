@@ -0,0 +1,19 @@
+"""Шаблонный движок Django, замеряющий время рендеринга для ``core.perf``.
+"""
+from django.template.backends import django
+
+from . import perf
+
+
+class Template(django.Template):
+    def render(self, context=None, request=None):
+        with perf.timer('template'):
+            return super().render(context, request)
+
+
+class DjangoTemplates(django.DjangoTemplates):
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
@@ -0,0 +1,15 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page, on_each_side=2, on_ends=1):
+    """Номера страниц для навигации, ``None`` — пропуск.
+
+    Для страниц, открытых по курсору, номер неизвестен, и окно пустое:
+    остаются только ссылки «Предыдущая» и «Следующая».
+    """
+    if not getattr(page, 'numbered', True):
+        return []
+    return page.paginator.page_window(page, on_each_side, on_ends)
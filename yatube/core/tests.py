@@ -0,0 +1,386 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router
+from django.http import HttpResponse
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import CacheRouter, DatabaseCache, TieredCache
+from .models import Job
+from .paginator import WindowedPaginator
+from .replicas import PIN_COOKIE, PrimaryPinMiddleware, use_replicas
+from .sqlite3.base import writer_lock
+from .tasks import Worker, claim, task
+
+# Вызовы тестовых задач по порядку.
+calls = []
+
+
+@task
+def record(value):
+    calls.append(value)
+
+
+@task(priority=5)
+def record_urgent(value):
+    calls.append(value)
+
+
+@task(max_attempts=2, retry_delay=0)
+def fail(value):
+    calls.append(value)
+    raise ValueError(value)
+
+
+class TieredCacheTest(TestCase):
+    def make_cache(self, **options):
+        cache = TieredCache('shared', {'OPTIONS': options})
+        cache.clear()
+        return cache
+
+    def test_l1_lru_eviction_and_stats(self):
+        """L1 хранит не больше MAX_ENTRIES ключей и вытесняет самый старый."""
+        cache = self.make_cache(MAX_ENTRIES=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertIsNone(cache.get('missing'))
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['l2_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 2)
+
+    def test_shared_changes_visible_after_l1_timeout(self):
+        """Изменения из других процессов видны после истечения L1."""
+        cached = self.make_cache(L1_TIMEOUT=60)
+        fresh = self.make_cache(L1_TIMEOUT=0)
+        cached.set('key', 'old')
+        caches['shared'].set('key', 'new')
+        self.assertEqual(cached.get('key'), 'old')
+        self.assertEqual(fresh.get('key'), 'new')
+        self.assertEqual(cached.get_many(['key']), {'key': 'old'})
+
+    def test_incr_drops_local_copy(self):
+        cache = self.make_cache()
+        cache.set('version', 1)
+        cache.incr('version')
+        self.assertEqual(cache.get('version'), 2)
+
+
+class DatabaseCacheTest(TestCase):
+    def setUp(self):
+        self.cache = DatabaseCache('yatube_cache', {})
+        self.cache.clear()
+
+    def test_set_many_query_count_is_constant(self):
+        """``set_many`` пишет пачку ключей за одно и то же число запросов
+        и перезаписывает старые значения."""
+        self.cache.set('a', 'старое')
+        with CaptureQueriesContext(connection) as few:
+            self.cache.set_many({'a': 1, 'b': 2})
+        with CaptureQueriesContext(connection) as many:
+            self.cache.set_many({f'key{i}': i for i in range(400)})
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get('key399'), 399)
+        self.assertEqual(len(many), len(few) + 2)
+
+    def test_add_many_keeps_live_values(self):
+        """``add_many`` дописывает недостающие и истёкшие ключи, а живые
+        не трогает."""
+        self.cache.set('live', 'старое')
+        self.cache.set('expired', 'старое', -1)
+        self.cache.add_many({'live': 'новое', 'expired': 'новое',
+                             'missing': 'новое'})
+        self.assertEqual(
+            self.cache.get_many(['live', 'expired', 'missing']),
+            {'live': 'старое', 'expired': 'новое', 'missing': 'новое'})
+
+    def test_set_many_failure_is_not_fatal(self):
+        """Ошибка базы при записи не роняет запрос: ключи не записаны."""
+        with mock.patch.object(DatabaseCache, '_write_rows',
+                               side_effect=OperationalError('locked')):
+            self.assertEqual(
+                sorted(self.cache.set_many({'a': 1, 'b': 2})), ['a', 'b'])
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_incr_keeps_expiry(self):
+        """``incr`` меняет только значение: бессрочный ключ не истекает."""
+        self.cache.set('version', 1, None)
+
+        def expires():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT expires FROM yatube_cache WHERE cache_key = %s',
+                    [self.cache.make_key('version')])
+                return cursor.fetchone()[0]
+
+        before = expires()
+        self.assertEqual(self.cache.incr('version'), 2)
+        self.assertEqual(self.cache.incr('version', 10), 12)
+        self.assertEqual(self.cache.get('version'), 12)
+        self.assertEqual(expires(), before)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+
+class PerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    @override_settings(PERF_SAMPLE_RATE=1, PERF_TRACE_MEMORY=True)
+    def test_sampled_request_reports_metrics(self):
+        """Выбранный запрос получает Server-Timing и строку в логе."""
+        with self.assertLogs('yatube.perf', 'INFO') as logs:
+            response = self.client.get('/')
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'cache;desc=',
+                       'template;dur=', 'memory;desc="peak'):
+            self.assertIn(metric, timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'posts:index')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['cache_misses'], 0)
+        self.assertIn('memory_peak_kb', record)
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_not_sampled_request_untouched(self):
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class WindowedPaginatorTest(TestCase):
+    def test_window_is_bounded(self):
+        """Окно не растёт с числом страниц."""
+        paginator = WindowedPaginator(range(5000000), 10)
+        self.assertEqual(
+            paginator.page_window(paginator.page(25000)),
+            [1, None, 24998, 24999, 25000, 25001, 25002, None, 500000],
+        )
+        self.assertEqual(
+            paginator.page_window(paginator.page(2)),
+            [1, 2, 3, 4, None, 500000],
+        )
+        self.assertEqual(
+            paginator.page_window(paginator.page(500000)),
+            [1, None, 499998, 499999, 500000],
+        )
+
+    def test_short_range_is_not_elided(self):
+        paginator = WindowedPaginator(range(70), 10)
+        self.assertEqual(
+            paginator.page_window(paginator.page(4)), list(range(1, 8)))
+
+
+class CacheRouterTest(SimpleTestCase):
+    def test_cache_table_in_own_database(self):
+        """С базой cache таблица кэша живёт только в ней, а без такой
+        базы роутер ничего не решает."""
+        cache_router = CacheRouter()
+        model = DatabaseCache('yatube_cache', {}).cache_model_class
+        self.assertIsNone(cache_router.db_for_write(model))
+        self.assertIsNone(
+            cache_router.allow_migrate('default', 'django_cache'))
+        with mock.patch.dict(settings.DATABASES, cache={}):
+            self.assertEqual(cache_router.db_for_read(model), 'cache')
+            self.assertEqual(cache_router.db_for_write(model), 'cache')
+            self.assertIsNone(cache_router.db_for_read(Session))
+            self.assertTrue(
+                cache_router.allow_migrate('cache', 'django_cache'))
+            self.assertFalse(
+                cache_router.allow_migrate('default', 'django_cache'))
+            self.assertFalse(cache_router.allow_migrate('cache', 'posts'))
+            self.assertIsNone(cache_router.allow_migrate('default', 'posts'))
+
+
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.User = get_user_model()
+
+    def read_view(self, write=False):
+        """View, которое сообщает, откуда читались бы пользователи."""
+        @use_replicas
+        def view(request):
+            if write:
+                router.db_for_write(self.User)
+            return HttpResponse(','.join([
+                router.db_for_read(self.User),
+                router.db_for_read(Session),
+            ]))
+        return PrimaryPinMiddleware(view)
+
+    def test_reads_go_to_replica(self):
+        """Данные читаются из реплики, сессии — из основной базы."""
+        response = self.read_view()(self.factory.get('/'))
+        self.assertEqual(response.content, b'replica1,default')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(router.db_for_read(self.User), 'default')
+
+    def test_read_your_writes(self):
+        """После записи пользователь какое-то время читает основную базу."""
+        response = self.read_view(write=True)(self.factory.post('/'))
+        self.assertEqual(response.content, b'default,default')
+        cookie = response.cookies[PIN_COOKIE]
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = cookie.value
+        response = self.read_view()(request)
+        self.assertEqual(response.content, b'default,default')
+        request.COOKIES[PIN_COOKIE] = '0'
+        response = self.read_view()(request)
+        self.assertEqual(response.content, b'replica1,default')
+
+
+class SQLiteTest(TestCase):
+    def test_pragmas_applied(self):
+        """Прагмы из OPTIONS выполняются на каждом соединении."""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+
+class SQLiteStressTest(SimpleTestCase):
+    def run_stress(self, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'stress.json')
+            call_command('sqlite_stress', *args, '--output', output,
+                         stdout=StringIO())
+            with open(output, encoding='utf-8') as file:
+                return json.load(file)
+
+    def test_tuned_mode_applies_all_writes(self):
+        """Оба режима не теряют записей, а режим проекта не получает
+        «database is locked»."""
+        results = self.run_stress('--workers', '1', '4', '--seconds', '0.5')
+        for mode, runs in results.items():
+            for workers, result in runs.items():
+                with self.subTest(mode=mode, workers=workers):
+                    self.assertTrue(result['consistent'])
+                    self.assertGreater(result['writes'], 0)
+        for result in results['tuned'].values():
+            self.assertEqual(result['errors'], 0)
+
+    def test_tuned_mode_outperforms_default_under_contention(self):
+        """На четырёх потоках обычная SQLite теряет часть записей на
+        «database is locked», а режим проекта проводит все и больше."""
+        results = self.run_stress(
+            '--workers', '4', '--seconds', '0.5', '--write-ratio', '0.5')
+        default, tuned = results['default']['4'], results['tuned']['4']
+        self.assertGreater(default['errors'], 0)
+        self.assertEqual(tuned['errors'], 0)
+        self.assertGreater(tuned['writes'], default['writes'])
+
+    def test_autocommit_writes_wait_for_writer(self):
+        """Запись вне транзакции ждёт очередь писателей, чтение — нет."""
+        alias = 'sqlite_writer_queue'
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'queue.sqlite3')
+            connections.databases[alias] = {
+                'ENGINE': 'core.sqlite3',
+                'NAME': name,
+                'OPTIONS': dict(settings.SQLITE_OPTIONS,
+                                pragmas={'busy_timeout': 100}),
+            }
+            connections.ensure_defaults(alias)
+            connections.prepare_test_settings(alias)
+            queue = connections[alias]
+            try:
+                with queue.cursor() as cursor:
+                    cursor.execute('CREATE TABLE counter (value INTEGER)')
+                    cursor.execute('INSERT INTO counter VALUES (0)')
+                lock = writer_lock(name)
+                with lock:
+                    with self.assertRaisesMessage(
+                            OperationalError, 'database is locked'):
+                        with queue.cursor() as cursor:
+                            cursor.execute(
+                                'UPDATE counter SET value = value + 1')
+                    with queue.cursor() as cursor:
+                        cursor.execute('SELECT value FROM counter')
+                        self.assertEqual(cursor.fetchone(), (0,))
+                with queue.cursor() as cursor:
+                    cursor.execute('UPDATE counter SET value = value + 1')
+                    cursor.execute('SELECT value FROM counter')
+                    self.assertEqual(cursor.fetchone(), (1,))
+                self.assertFalse(queue.holds_writer)
+            finally:
+                queue.close()
+                del connections.databases[alias]
+
+
+@override_settings(TASKS_INLINE=False)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_priority_schedule_and_retries(self):
+        """Воркер берёт задачи по приоритету, ждёт отложенные и повторяет
+        упавшие, пока не кончатся попытки."""
+        record.delay('обычная')
+        record_urgent.delay('срочная')
+        record.schedule(3600, 'через час')
+        fail.delay('ошибка')
+        self.assertEqual(calls, [])
+        with self.assertLogs('core.tasks', 'ERROR') as logs:
+            self.assertEqual(Worker().run(burst=True), 4)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(calls, ['срочная', 'обычная', 'ошибка', 'ошибка'])
+        failed = Job.objects.get(status=Job.FAILED)
+        self.assertEqual(failed.attempts, 2)
+        self.assertIn('ValueError', failed.last_error)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_taken_job_returns_after_lease(self):
+        """Взятую задачу другой воркер не получит, пока не истечёт срок."""
+        job = record.delay('раз')
+        self.assertEqual(claim(Job.objects.all(), 'первый').pk, job.pk)
+        self.assertIsNone(claim(Job.objects.all(), 'второй'))
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        taken = claim(Job.objects.all(), 'второй')
+        self.assertEqual((taken.pk, taken.attempts), (job.pk, 2))
+
+    @override_settings(TASKS_INLINE=True)
+    def test_inline_runs_without_worker(self):
+        """Без воркеров задача, поставленная вне запроса, выполняется
+        сразу."""
+        record.delay('сразу')
+        self.assertEqual(calls, ['сразу'])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(
+        EMAIL_BACKEND='core.mail.QueuedEmailBackend',
+        QUEUED_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    )
+    def test_password_reset_email_is_queued(self):
+        """Письмо сброса пароля отправляет воркер, а не запрос."""
+        get_user_model().objects.create_user(
+            username='forgetful', email='forgetful@example.com',
+            password='secret')
+        Client().post(reverse('users:password_reset'),
+                      {'email': 'forgetful@example.com'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Worker().run(burst=True), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['forgetful@example.com'])
@@ -1,9 +1,49 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 
+from . import counts, search
 from .models import Post, Group, Comment, Follow
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в админке по полнотекстовому индексу вместо ``LIKE``.
+
+    Если у базы индекса нет, работает обычный поиск по ``search_fields``.
+    """
+    search_kind = search.POST
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term:
+            found = search.filter_matching(
+                queryset, search_term, self.search_kind)
+            if found is not None:
+                return found, False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class ApproximateCountPaginator(Paginator):
+    """Пагинатор списка, не считающий строки большой таблицы точно.
+
+    ``estimated`` показывает шаблону ``admin/posts/pagination.html``,
+    что число приблизительное.
+    """
+    estimated = False
+
+    @cached_property
+    def count(self):
+        count, self.estimated = counts.approximate_count(self.object_list)
+        return count
+
+
+class ApproximateCountMixin:
+    """Список без ``COUNT(*)`` по всей таблице на каждой странице."""
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+
+class PostAdmin(ApproximateCountMixin, FullTextSearchMixin,
+                admin.ModelAdmin):
     list_display = (
         'pk',
         'text',
@@ -28,7 +68,8 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ApproximateCountMixin, FullTextSearchMixin,
+                   admin.ModelAdmin):
     list_display = (
         'pk',
         'post',
@@ -36,7 +77,8 @@ class CommentAdmin(admin.ModelAdmin):
         'text',
         'created',
     )
-    search_fields = ('post',)
+    search_fields = ('text',)
+    search_kind = search.COMMENT
     list_filter = ('post',)
     empty_value_display = '-пусто-'
 
@@ -0,0 +1,320 @@
+"""Версионированные ключи кэша для страниц и фрагментов постов.
+
+У каждой области (лента, группа, профиль, пост) есть номер версии;
+он входит в ключи закэшированных страниц и фрагментов. Обработчики
+сигналов увеличивают версию, когда содержимое области меняется, поэтому
+записи живут часами и устаревают ровно в момент изменения данных.
+Объекты, которые кэширует ``posts.loaders``, лежат под ключами с
+версией своей области (``object_key``) и устаревают так же.
+
+Страницы и фрагменты хранятся через ``remember``: запись помнит версию,
+с которой её построили, и после ``bump`` или истечения срока ещё
+отдаётся, пока её пересчитывает один запрос, взявший блокировку.
+"""
+import hashlib
+import json
+import math
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.http import HttpResponse
+from django.utils.http import quote_etag
+from django.utils.safestring import mark_safe
+
+from core.replicas import current_replica
+
+GROUPS = 'groups'
+INDEX = 'index'
+
+CARD_TEMPLATE = 'includes/post_card.html'
+
+# Сколько секунд после срока запись ещё отдаётся, пока её пересчитывают.
+STALE_TIMEOUT = 60 * 60
+# Блокировка пересчёта снимается сама, если пересчитывающий упал.
+LOCK_TIMEOUT = 30
+# Сколько ждать чужого пересчёта, когда отдать нечего, и как часто
+# проверять, не готов ли он.
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+# β вероятностного досрочного истечения (XFetch): чем больше, тем раньше
+# срока кто-то один начинает пересчитывать запись.
+EARLY_EXPIRY_BETA = 1.0
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def profile_scope(user_id):
+    return f'profile:{user_id}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def _version_key(scope):
+    return f'posts:version:{scope}'
+
+
+def _new_version():
+    # Не 1, а время: если ключ версии вытеснен из кэша, новая версия
+    # не совпадёт со старой и не поднимет устаревшие фрагменты.
+    return int(time.time() * 1000)
+
+
+def _shared():
+    """Общий уровень кэша в обход L1 ``TieredCache``.
+
+    Версии читаются и меняются только здесь: в L1 другого процесса
+    старая версия жила бы ещё до ``L1_TIMEOUT`` секунд после ``bump``.
+    """
+    return getattr(cache, 'shared', cache)
+
+
+def get_versions(scopes):
+    """Версии областей по областям: один ``get_many``, а недостающие
+    версии создаются одним ``add_many``, если кэш его умеет.
+
+    Версия, которую не удалось ни прочитать, ни создать, — None.
+    """
+    shared = _shared()
+    keys = {scope: _version_key(scope) for scope in scopes}
+    versions = shared.get_many(list(keys.values()))
+    missing = {
+        key: _new_version() for key in keys.values() if key not in versions
+    }
+    if missing:
+        add_many = getattr(shared, 'add_many', None)
+        if add_many is not None:
+            add_many(missing, None)
+        else:
+            for key, value in missing.items():
+                shared.add(key, value, None)
+        # Версию мог создать и другой запрос: берём ту, что в кэше.
+        versions.update(shared.get_many(list(missing)))
+    return {scope: versions.get(key) for scope, key in keys.items()}
+
+
+def get_version(*scopes):
+    """Общая версия набора областей для ключа кэша."""
+    return '.'.join(
+        str(_new_version() if version is None else version)
+        for version in get_versions(scopes).values()
+    )
+
+
+def object_key(scope, version):
+    """Ключ объекта области для ``posts.loaders``."""
+    return f'posts:object:{scope}:{version}'
+
+
+def bump(*scopes):
+    """Сбросить всё, что закэшировано для этих областей."""
+    shared = _shared()
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            shared.incr(key)
+        except ValueError:
+            shared.set(key, _new_version(), None)
+
+
+def cache_context(*scopes):
+    """Переменные для ``{% cache cache_ttl ... cache_version %}``."""
+    return {
+        'cache_ttl': settings.POSTS_CACHE_TTL,
+        'cache_version': get_version(*scopes),
+    }
+
+
+def _is_fresh(entry, version):
+    _, entry_version, expires, duration = entry
+    if entry_version != version:
+        return False
+    # Чем ближе срок и чем дольше пересчёт, тем вероятнее, что запрос
+    # сочтёт запись истёкшей и пересчитает её заранее, пока остальные
+    # ещё получают её из кэша.
+    early = -duration * EARLY_EXPIRY_BETA * math.log(1 - random.random())
+    return time.time() + early < expires
+
+
+def _store(key, compute, version, timeout):
+    started = time.time()
+    value = compute()
+    duration = time.time() - started
+    cache.set(key, (value, version, started + timeout, duration),
+              timeout + STALE_TIMEOUT)
+    return value
+
+
+def remember(key, compute, version=None, timeout=None):
+    """Значение ``compute()`` из кэша по ключу ``key``.
+
+    Запись свежая, пока у неё та же ``version`` и не прошли ``timeout``
+    секунд. Устаревшую запись пересчитывает только запрос, взявший
+    блокировку, а остальные тем временем получают старое значение. Если
+    старого значения нет, они ждут пересчёта до ``WAIT_TIMEOUT`` секунд.
+
+    Значение, прочитанное из реплики, не кэшируется: реплика может
+    отставать от версий, и запись под новой версией держала бы старые
+    данные до конца срока. Устаревшая запись такому запросу тоже не
+    отдаётся.
+    """
+    timeout = timeout or settings.POSTS_CACHE_TTL
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry, version):
+        return entry[0]
+    if current_replica() is not None:
+        return compute()
+    lock = f'{key}:lock'
+    if cache.add(lock, 1, LOCK_TIMEOUT):
+        try:
+            # Локальный кэш процесса мог отстать от общего: запись уже
+            # пересчитана другим процессом.
+            latest = _shared().get(key)
+            if latest is not None and _is_fresh(latest, version):
+                return latest[0]
+            return _store(key, compute, version, timeout)
+        finally:
+            cache.delete(lock)
+    if entry is not None:
+        return entry[0]
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry[1] == version:
+            return entry[0]
+    return _store(key, compute, version, timeout)
+
+
+def cache_page_versioned(get_scopes, timeout=None):
+    """Кэш страницы по версии областей, с отдачей устаревшей копии.
+
+    Замена ``cache_page``: после изменения области или истечения срока
+    страницу рендерит один запрос, а остальные получают прежнюю копию
+    (``remember``). ``get_scopes`` получает аргументы view и возвращает
+    список областей. Ключ учитывает cookie, как ``vary_on_cookie``;
+    кэшируются только ответы 200 без новых cookie.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            version = get_version(*get_scopes(request, *args, **kwargs))
+            key = 'posts:page:{}:{}'.format(
+                view.__name__, hashlib.md5('{}:{}'.format(
+                    request.get_full_path(),
+                    request.META.get('HTTP_COOKIE', ''),
+                ).encode()).hexdigest())
+            response = None
+
+            def render_page():
+                nonlocal response
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.cookies or (
+                        response.streaming):
+                    return None
+                return (response.content, tuple(response.items()))
+
+            page = remember(key, render_page, version, timeout)
+            if response is not None:
+                return response
+            if page is None:
+                return view(request, *args, **kwargs)
+            content, headers = page
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+        return wrapper
+    return decorator
+
+
+def etag_versioned(get_scopes):
+    """Условный GET по версиям областей: ``304`` без запуска view.
+
+    ``get_scopes`` получает аргументы view и возвращает список областей
+    или None, если объекта нет, — тогда view сама ответит 404. Страница
+    зависит и от того, кто её смотрит (шапка, кнопка подписки, форма с
+    CSRF-токеном), поэтому в ETag входят пользователь и CSRF-cookie,
+    а ответ помечается ``Vary: Cookie``.
+
+    Страница, прочитанная из отстающей реплики, может быть старше версий
+    в кэше, поэтому её ETag не получает: иначе клиент держал бы старую
+    копию до следующего изменения.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            scopes = get_scopes(request, *args, **kwargs)
+            if scopes is None:
+                return view(request, *args, **kwargs)
+            version = get_version(*scopes)
+
+            def make_etag():
+                # CSRF-cookie могла появиться при рендеринге страницы.
+                return quote_etag(hashlib.md5('{}:{}:{}'.format(
+                    version, request.user.pk,
+                    request.META.get('CSRF_COOKIE', ''),
+                ).encode()).hexdigest())
+            response = get_conditional_response(request, etag=make_etag())
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or current_replica():
+                    return response
+            response['ETag'] = make_etag()
+            patch_vary_headers(response, ('Cookie',))
+            # Браузер каждый раз сверяет ETag и получает 304, пока
+            # страница не изменилась.
+            patch_cache_control(response, no_cache=True)
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def card_key(post):
+    """Ключ карточки поста; версия — хеш всего, что карточка показывает.
+
+    Правка поста, новая миниатюра или переименование группы дают новый
+    ключ только этой карточке, а старая запись истекает сама.
+    """
+    fingerprint = hashlib.md5(json.dumps([
+        post.text, post.pub_date.isoformat(), post.image.name,
+        post.thumbnail_url, post.thumbnail_width, post.thumbnail_height,
+        post.image_variants, post.author.username,
+        post.group.slug if post.group_id else None,
+        post.group.title if post.group_id else None,
+    ]).encode()).hexdigest()
+    return f'posts:card:{post.pk}:{fingerprint}'
+
+
+def post_cards(posts):
+    """Пары (пост, HTML карточки) в порядке ``posts``.
+
+    Готовые карточки читаются одним ``get_many``, недостающие рендерятся
+    и записываются одним ``set_many``.
+    """
+    posts = list(posts)
+    keys = [card_key(post) for post in posts]
+    cards = cache.get_many(keys)
+    missing = {}
+    for post, key in zip(posts, keys):
+        if key not in cards:
+            missing[key] = cards[key] = render_to_string(
+                CARD_TEMPLATE, {'post': post})
+    if missing:
+        cache.set_many(missing, settings.POSTS_CACHE_TTL)
+    return [(post, mark_safe(cards[key])) for post, key in zip(posts, keys)]
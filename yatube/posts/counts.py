@@ -0,0 +1,105 @@
+"""Приблизительное число строк больших таблиц.
+
+``COUNT(*)`` по таблице в десятки миллионов строк читает её целиком,
+поэтому для неотфильтрованных списков больше ``APPROX_COUNT_THRESHOLD``
+строк число берётся из статистики: на PostgreSQL — ``pg_class.reltuples``,
+который обновляют ANALYZE и autovacuum, на остальных базах — из таблицы
+``TableCounter``, которую ведут сигналы (``posts.signals``) и сверяет
+``reconcile_counters``. Такие числа показываются как приблизительные.
+"""
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F
+
+from .models import Comment, Post, TableCounter
+
+# Таблицы, для которых ведётся TableCounter.
+COUNTED_MODELS = (Post, Comment)
+
+
+def uses_statistics(connection):
+    return connection.vendor == 'postgresql'
+
+
+def table_rows(model, using=None):
+    """Оценка числа строк таблицы ``model`` или None, если её нет."""
+    using = using or router.db_for_read(model)
+    connection = connections[using]
+    table = model._meta.db_table
+    if uses_statistics(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+        # -1 или 0 — таблицу ещё ни разу не анализировали.
+        return row[0] if row and row[0] > 0 else None
+    return TableCounter.objects.using(using).filter(
+        table=table).values_list('rows', flat=True).first()
+
+
+def estimate(model, using=None):
+    """(число строк, приблизительное ли оно) без ``COUNT(*)``.
+
+    ``TableCounter`` меньше порога считается точным, как и прочие
+    денормализованные счётчики, а статистике PostgreSQL на маленькой
+    таблице верить нельзя — тогда число неизвестно: (None, True).
+    """
+    using = using or router.db_for_read(model)
+    rows = table_rows(model, using)
+    if rows is not None and rows >= settings.APPROX_COUNT_THRESHOLD:
+        return rows, True
+    if rows is None or uses_statistics(connections[using]):
+        return None, True
+    return rows, False
+
+
+def approximate_count(queryset):
+    """(число строк ``queryset``, приблизительное ли оно).
+
+    Оценка берётся только для неотфильтрованной выборки из большой
+    таблицы, иначе выполняется обычный ``COUNT(*)``.
+    """
+    query = queryset.query
+    if not (query.has_filters() or query.distinct or query.combinator
+            or not query.can_filter()):
+        rows = table_rows(queryset.model, queryset.db)
+        if rows is not None and rows >= settings.APPROX_COUNT_THRESHOLD:
+            return rows, True
+    return queryset.count(), False
+
+
+def change(model, delta, using=None):
+    """Сдвинуть ``TableCounter`` таблицы ``model`` на ``delta``."""
+    using = using or router.db_for_write(model)
+    if model not in COUNTED_MODELS or uses_statistics(connections[using]):
+        return
+    table = model._meta.db_table
+    counters = TableCounter.objects.using(using).filter(
+        table=table, rows__gte=max(-delta, 0))
+    if counters.update(rows=F('rows') + delta) or delta < 0:
+        return
+    _, created = TableCounter.objects.using(using).get_or_create(
+        table=table, defaults={'rows': delta})
+    if not created:
+        counters.update(rows=F('rows') + delta)
+
+
+def reconcile(using=None, dry_run=False):
+    """Сверить ``TableCounter`` с ``COUNT(*)``; вернуть пары (таблица,
+    на сколько счётчик отстал).
+    """
+    drift = []
+    for model in COUNTED_MODELS:
+        db = using or router.db_for_write(model)
+        if uses_statistics(connections[db]):
+            continue
+        table = model._meta.db_table
+        actual = model.objects.using(db).count()
+        counter = TableCounter.objects.using(db).filter(table=table).first()
+        rows = counter.rows if counter else 0
+        drift.append((table, actual - rows))
+        if actual != rows and not dry_run:
+            TableCounter.objects.using(db).update_or_create(
+                table=table, defaults={'rows': actual})
+    return drift
@@ -0,0 +1,228 @@
+"""Ленты постов для программ: JSON Feed, RSS 2.0 и Atom.
+
+Ответ потоковый: записи читаются из базы итератором и отдаются по
+мере чтения, по ``FEED_PAGE_SIZE`` на страницу; следующая страница —
+по курсору ``?after=``, как в HTML-лентах (``core.paginator``).
+
+``ETag`` строится из версий кэша (``posts.cache``), которые меняются
+при любом изменении постов ленты, ``Last-Modified`` — из даты последнего
+поста. Клиент, который опрашивает ленту каждую минуту, почти всегда
+получает пустой ``304`` за пару запросов к кэшу и индексу. Лента из
+отстающей реплики может быть старше версий, поэтому ``ETag`` и
+``Last-Modified`` у неё нет.
+"""
+import hashlib
+import json
+import re
+from calendar import timegm
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.utils.http import http_date, quote_etag, urlencode
+from django.utils.text import Truncator
+
+from core.paginator import KeysetPaginator
+from core.replicas import current_replica
+
+from . import cache
+
+CONTENT_TYPES = {
+    'json': 'application/feed+json; charset=utf-8',
+    'rss': 'application/rss+xml; charset=utf-8',
+    'atom': 'application/atom+xml; charset=utf-8',
+}
+# Управляющие символы, которых не может быть в XML 1.0.
+XML_INVALID_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class FormatConverter:
+    """Конвертер URL для расширения ленты: ``feed.json`` и т. п."""
+    regex = '|'.join(CONTENT_TYPES)
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+class Entries:
+    """Записи страницы ленты по мере чтения из базы.
+
+    После обхода ``next_url`` — адрес следующей страницы или None.
+    """
+
+    def __init__(self, request, paginator, values):
+        self.request = request
+        self.paginator = paginator
+        self.values = values
+        self.next_url = None
+
+    def __iter__(self):
+        per_page = self.paginator.per_page
+        rows = self.paginator.seek(self.values)[:per_page + 1]
+        last = None
+        for number, post in enumerate(rows.iterator()):
+            if number == per_page:
+                self.next_url = self.request.build_absolute_uri(
+                    '?' + urlencode({
+                        'after': self.paginator.encode_cursor(last)}))
+                break
+            last = post
+            yield self.entry(post)
+
+    def entry(self, post):
+        absolute = self.request.build_absolute_uri
+        url = absolute(reverse('posts:post_detail', args=[post.pk]))
+        return {
+            'url': url,
+            'title': Truncator(post.text).chars(60),
+            'text': post.text,
+            'published': post.pub_date,
+            'author': post.author.get_full_name() or post.author.username,
+            'author_url': absolute(
+                reverse('posts:profile', args=[post.author.username])),
+            'group': post.group.title if post.group_id else None,
+            'image': absolute(post.image.url) if post.image else None,
+        }
+
+
+def xml(value):
+    return escape(XML_INVALID_RE.sub('', value))
+
+
+def json_feed(feed, entries):
+    """JSON Feed 1.1: https://jsonfeed.org/version/1.1"""
+    header = json.dumps({
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': feed['title'],
+        'home_page_url': feed['link'],
+        'feed_url': feed['url'],
+    }, ensure_ascii=False)
+    yield header[:-1] + ', "items": ['
+    for number, entry in enumerate(entries):
+        item = {
+            'id': entry['url'],
+            'url': entry['url'],
+            'title': entry['title'],
+            'content_text': entry['text'],
+            'date_published': rfc3339_date(entry['published']),
+            'authors': [{'name': entry['author'],
+                         'url': entry['author_url']}],
+        }
+        if entry['group']:
+            item['tags'] = [entry['group']]
+        if entry['image']:
+            item['image'] = entry['image']
+        yield (', ' if number else '') + json.dumps(item, ensure_ascii=False)
+    yield ']'
+    if entries.next_url:
+        yield ', "next_url": ' + json.dumps(entries.next_url)
+    yield '}\n'
+
+
+def rss_feed(feed, entries):
+    yield (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+        '<channel>'
+        f'<title>{xml(feed["title"])}</title>'
+        f'<link>{xml(feed["link"])}</link>'
+        f'<description>{xml(feed["title"])}</description>'
+        '<language>ru</language>'
+        f'<atom:link rel="self" href={quoteattr(feed["url"])}/>'
+    )
+    for entry in entries:
+        yield (
+            '<item>'
+            f'<title>{xml(entry["title"])}</title>'
+            f'<link>{xml(entry["url"])}</link>'
+            f'<guid isPermaLink="true">{xml(entry["url"])}</guid>'
+            f'<pubDate>{rfc2822_date(entry["published"])}</pubDate>'
+            f'<description>{xml(entry["text"])}</description>'
+        )
+        if entry['group']:
+            yield f'<category>{xml(entry["group"])}</category>'
+        yield '</item>'
+    if entries.next_url:
+        yield f'<atom:link rel="next" href={quoteattr(entries.next_url)}/>'
+    yield '</channel></rss>\n'
+
+
+def atom_feed(feed, entries):
+    yield (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="ru">'
+        f'<id>{xml(feed["link"])}</id>'
+        f'<title>{xml(feed["title"])}</title>'
+        f'<updated>{rfc3339_date(feed["updated"])}</updated>'
+        f'<link rel="alternate" href={quoteattr(feed["link"])}/>'
+        f'<link rel="self" href={quoteattr(feed["url"])}/>'
+    )
+    for entry in entries:
+        yield (
+            '<entry>'
+            f'<id>{xml(entry["url"])}</id>'
+            f'<title>{xml(entry["title"])}</title>'
+            f'<link rel="alternate" href={quoteattr(entry["url"])}/>'
+            f'<published>{rfc3339_date(entry["published"])}</published>'
+            f'<updated>{rfc3339_date(entry["published"])}</updated>'
+            f'<author><name>{xml(entry["author"])}</name>'
+            f'<uri>{xml(entry["author_url"])}</uri></author>'
+            f'<content type="text">{xml(entry["text"])}</content>'
+        )
+        if entry['group']:
+            yield f'<category term={quoteattr(entry["group"])}/>'
+        yield '</entry>'
+    # Порядок элементов feed в Atom не задан, поэтому ссылка на
+    # следующую страницу (RFC 5005) может идти после записей.
+    if entries.next_url:
+        yield f'<link rel="next" href={quoteattr(entries.next_url)}/>'
+    yield '</feed>\n'
+
+
+WRITERS = {'json': json_feed, 'rss': rss_feed, 'atom': atom_feed}
+
+
+def respond(request, format, posts, scopes, title, link):
+    """Потоковая лента постов ``posts`` или ``304``, если она не менялась.
+
+    ``scopes`` — области кэша, версии которых меняются вместе с лентой.
+    """
+    # База выбирается сейчас: записи читаются уже после выхода из view.
+    posts = posts.using(posts.db)
+    latest = posts.order_by('-pub_date').values_list(
+        'pub_date', flat=True).first()
+    after = request.GET.get('after', '')
+    etag = last_modified = response = None
+    if current_replica() is None:
+        etag = quote_etag(hashlib.md5('{}:{}:{}'.format(
+            cache.get_version(*scopes), format, after,
+        ).encode()).hexdigest())
+        last_modified = timegm(latest.utctimetuple()) if latest else None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+    if response is None:
+        paginator = KeysetPaginator(posts, settings.FEED_PAGE_SIZE)
+        feed = {
+            'title': title,
+            'link': request.build_absolute_uri(link),
+            'url': request.build_absolute_uri(),
+            'updated': latest or timezone.now(),
+        }
+        entries = Entries(request, paginator, paginator.decode_cursor(after))
+        response = StreamingHttpResponse(
+            WRITERS[format](feed, entries),
+            content_type=CONTENT_TYPES[format],
+        )
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, max_age=settings.FEED_MAX_AGE)
+    return response
@@ -1,5 +1,6 @@
 from django import forms
 from .models import Post, Comment
+from .thumbnails import prepare_upload
 
 
 class PostForm(forms.ModelForm):
@@ -7,6 +8,14 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        return prepare_upload(self.cleaned_data.get('image'))
+
+    def save(self, commit=True):
+        if 'image' in self.changed_data:
+            self.instance.reset_thumbnail()
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,234 @@
+"""Посты, группы и пользователи по id — пачками через кэш.
+
+Загрузчики устроены как DataLoader: ключи сначала собираются
+(``want``), а первый ``load_many`` читает все собранные из кэша одним
+``get_many``; промахи догружаются из базы одним запросом ``id__in`` и
+записываются в кэш одним ``set_many``. Загрузчик живёт один запрос и
+помнит, что уже загрузил, поэтому автор десяти постов страницы
+читается один раз.
+
+Пока поток грузит ключ из базы, остальные потоки процесса, которым
+нужен тот же ключ, ждут его результата, а не идут в базу сами: один
+полёт на ключ, и истёкшая популярная запись не вызывает лавину
+одинаковых запросов.
+
+В ключ объекта входит версия его области ``posts.cache`` (поста, группы,
+профиля), поэтому он устаревает при тех же изменениях, что и страницы.
+Строка, прочитанная до чужой записи, ложится под старую версию и новым
+запросам не попадается. В кэше лежат значения полей, а не объекты:
+каждый запрос получает свои экземпляры моделей. Прочитанное из реплики
+в кэш не пишется — реплика может отставать.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import router
+from django.dispatch import receiver
+
+from core.replicas import current_replica
+
+from . import cache as posts_cache
+from .models import Group, Post, PostQuerySet, User
+
+# Сколько секунд ждать чужой загрузки ключа, прежде чем читать самому.
+FLIGHT_TIMEOUT = 5
+
+_state = threading.local()
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class Flight:
+    """Загрузка ключа, которую ведёт один поток, а ждут остальные."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.loaded = False
+        self.values = None
+
+
+class Loader:
+    model = None
+    # Поля (attname), которые загружаются и хранятся в кэше.
+    fields = ()
+
+    def __init__(self):
+        self.memo = {}
+        self.pending = set()
+        # from_db ждёт значения в порядке полей модели.
+        self.columns = [
+            field.attname for field in self.model._meta.concrete_fields
+            if field.attname in self.fields
+        ]
+
+    def scope(self, pk):
+        """Область ``posts.cache``, при сбросе которой объект устаревает."""
+        raise NotImplementedError
+
+    def keys(self, pks):
+        """Ключи кэша по id; id без версии области (кэш недоступен)
+        получают None и читаются из базы."""
+        scopes = {pk: self.scope(pk) for pk in pks}
+        versions = posts_cache.get_versions(scopes.values())
+        return {
+            pk: None if versions[scope] is None
+            else posts_cache.object_key(scope, versions[scope])
+            for pk, scope in scopes.items()
+        }
+
+    def want(self, pks):
+        """Запомнить id, чтобы загрузить их следующей пачкой."""
+        self.pending.update(
+            pk for pk in pks if pk is not None and pk not in self.memo)
+
+    def load_many(self, pks):
+        """Объекты по id; тех, которых нет в базе, в словаре нет."""
+        pks = list(pks)
+        self.want(pks)
+        if self.pending:
+            self.dispatch()
+        return {
+            pk: self.memo[pk] for pk in pks if self.memo.get(pk) is not None
+        }
+
+    def load(self, pk):
+        return self.load_many([pk]).get(pk)
+
+    def dispatch(self):
+        pks = sorted(self.pending)
+        self.pending.clear()
+        keys = self.keys(pks)
+        found = cache.get_many([key for key in keys.values() if key])
+        missing = {pk: key for pk, key in keys.items() if key not in found}
+        rows = {pk: found[key] for pk, key in keys.items() if key in found}
+        if missing:
+            rows.update(self.fetch(missing))
+        alias = router.db_for_read(self.model)
+        for pk in pks:
+            values = rows.get(pk)
+            self.memo[pk] = values and self.model.from_db(
+                alias, self.columns, values)
+
+    def fetch(self, keys):
+        """Значения полей из базы по словарю id -> ключ кэша.
+
+        Ключи, которые уже грузит другой поток, берутся у него; id без
+        ключа читаются из базы без кэша.
+        """
+        uncached = [pk for pk, key in keys.items() if key is None]
+        with _flights_lock:
+            own = {pk: key for pk, key in keys.items()
+                   if key is not None and key not in _flights}
+            others = {pk: _flights[key] for pk, key in keys.items()
+                      if key in _flights}
+            for key in own.values():
+                _flights[key] = Flight()
+        rows = {}
+        selected = False
+        try:
+            if own or uncached:
+                rows = self.select(list(own) + uncached)
+                selected = True
+                if current_replica() is None:
+                    cache.set_many(
+                        {own[pk]: values for pk, values in rows.items()
+                         if pk in own},
+                        settings.POSTS_CACHE_TTL)
+        finally:
+            with _flights_lock:
+                for pk, key in own.items():
+                    flight = _flights.pop(key)
+                    flight.values = rows.get(pk)
+                    flight.loaded = selected
+                    flight.done.set()
+        late = []
+        for pk, flight in others.items():
+            if flight.done.wait(FLIGHT_TIMEOUT) and flight.loaded:
+                rows[pk] = flight.values
+            else:
+                late.append(pk)
+        if late:
+            rows.update(self.select(late))
+        return {pk: values for pk, values in rows.items() if values}
+
+    def select(self, pks):
+        return {
+            values[0]: values
+            for values in self.model.objects.filter(
+                pk__in=list(pks)).order_by().values_list(*self.columns)
+        }
+
+
+class PostLoader(Loader):
+    model = Post
+    fields = tuple(
+        name if name not in ('author', 'group') else f'{name}_id'
+        for name in PostQuerySet.FEED_FIELDS if '__' not in name
+    )
+
+    def scope(self, pk):
+        return posts_cache.post_scope(pk)
+
+
+class GroupLoader(Loader):
+    model = Group
+    fields = ('id', 'title', 'slug', 'description', 'post_count')
+
+    def scope(self, pk):
+        return posts_cache.group_scope(pk)
+
+
+class UserLoader(Loader):
+    model = User
+    fields = ('id', 'username', 'first_name', 'last_name')
+
+    def scope(self, pk):
+        return posts_cache.profile_scope(pk)
+
+
+LOADERS = {Post: PostLoader, Group: GroupLoader, User: UserLoader}
+
+
+@receiver(request_started)
+def start_loaders(**kwargs):
+    _state.loaders = {}
+
+
+@receiver(request_finished)
+def finish_loaders(**kwargs):
+    _state.loaders = None
+
+
+def get_loader(model):
+    """Загрузчик модели текущего запроса; вне запроса — новый."""
+    loaders = getattr(_state, 'loaders', None)
+    if loaders is None:
+        return LOADERS[model]()
+    if model not in loaders:
+        loaders[model] = LOADERS[model]()
+    return loaders[model]
+
+
+def attach(objects, field, model):
+    """Подставить объектам связанный объект ``field`` из загрузчика."""
+    attname = f'{field}_id'
+    found = get_loader(model).load_many(
+        {getattr(obj, attname) for obj in objects} - {None})
+    for obj in objects:
+        related = found.get(getattr(obj, attname))
+        if related is not None:
+            setattr(obj, field, related)
+
+
+def load_posts(pks):
+    """Посты в порядке ``pks`` с авторами и группами; удалённых нет."""
+    found = get_loader(Post).load_many(pks)
+    posts = [found[pk] for pk in pks if pk in found]
+    # Авторы и группы всех постов — по одной пачке на модель.
+    get_loader(User).want(post.author_id for post in posts)
+    get_loader(Group).want(post.group_id for post in posts)
+    attach(posts, 'author', User)
+    attach(posts, 'group', Group)
+    return posts
@@ -0,0 +1,374 @@
+import http.client
+import json
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import django
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Group, Post, User, UserCounter
+
+ENDPOINTS = (
+    'index', 'group_posts', 'profile', 'post_detail', 'follow_index',
+    'post_create', 'add_comment',
+)
+NO_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+SAMPLE = 1000
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def percentile(values, percent):
+    """Процентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    rank = max(int(-(-percent * len(ordered) // 100)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(timings, queries, errors):
+    timings_ms = [value * 1000 for value in timings]
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(timings_ms, 50), 2),
+        'p95_ms': round(percentile(timings_ms, 95), 2),
+        'p99_ms': round(percentile(timings_ms, 99), 2),
+        'mean_ms': round(sum(timings_ms) / len(timings_ms), 2),
+        'max_ms': round(max(timings_ms), 2),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Targets:
+    """Случайные, но воспроизводимые по ``seed`` адреса запросов."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.post_ids = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:SAMPLE])
+        if not self.post_ids:
+            raise CommandError(
+                'В базе нет постов; сначала запустите seed_benchmark.')
+        self.usernames = list(Post.objects.filter(
+            pk__in=self.post_ids
+        ).values_list('author__username', flat=True).distinct())
+        self.slugs = list(Group.objects.values_list(
+            'slug', flat=True)[:SAMPLE])
+
+    def text(self):
+        return 'Нагрузочный тест {}'.format(self.rng.random())
+
+    def request(self, endpoint):
+        """(метод, путь, данные формы) для очередного запроса."""
+        rng = self.rng
+        if endpoint == 'index':
+            return 'GET', reverse('posts:index'), None
+        if endpoint == 'group_posts':
+            slug = rng.choice(self.slugs)
+            return 'GET', reverse('posts:group_list', args=[slug]), None
+        if endpoint == 'profile':
+            username = rng.choice(self.usernames)
+            return 'GET', reverse('posts:profile', args=[username]), None
+        if endpoint == 'post_detail':
+            post_id = rng.choice(self.post_ids)
+            return 'GET', reverse('posts:post_detail', args=[post_id]), None
+        if endpoint == 'follow_index':
+            return 'GET', reverse('posts:follow_index'), None
+        if endpoint == 'post_create':
+            return 'POST', reverse('posts:post_create'), {'text': self.text()}
+        post_id = rng.choice(self.post_ids)
+        return ('POST', reverse('posts:add_comment', args=[post_id]),
+                {'text': self.text()})
+
+
+class ClientRunner:
+    """Запросы через тестовый клиент Django, в этом же потоке."""
+
+    name = 'client'
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def __call__(self, method, path, data):
+        send = self.client.post if method == 'POST' else self.client.get
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = send(path, data or {})
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(queries)
+
+    def close(self):
+        pass
+
+
+class QueryCounter:
+    """WSGI-обёртка, считающая запросы к базе в потоке сервера."""
+
+    def __init__(self, application):
+        self.application = application
+        self.last = 0
+
+    def __call__(self, environ, start_response):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.application(environ, start_response)
+            try:
+                body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        self.last = len(queries)
+        return [body]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class WSGIRunner:
+    """Запросы по HTTP к настоящему WSGI-серверу в отдельном потоке."""
+
+    name = 'wsgi'
+
+    def __init__(self, user):
+        self.application = QueryCounter(get_wsgi_application())
+        self.server = make_server(
+            '127.0.0.1', 0, self.application, handler_class=QuietHandler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        client = Client()
+        client.force_login(user)
+        self.cookies = {
+            settings.SESSION_COOKIE_NAME:
+                client.cookies[settings.SESSION_COOKIE_NAME].value,
+        }
+        self.csrf_token = self.fetch_csrf_token()
+
+    def fetch_csrf_token(self):
+        status, body, headers = self.send('GET', reverse('posts:post_create'))
+        cookie = SimpleCookie()
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                cookie.load(value)
+        if settings.CSRF_COOKIE_NAME in cookie:
+            self.cookies[settings.CSRF_COOKIE_NAME] = (
+                cookie[settings.CSRF_COOKIE_NAME].value)
+        match = CSRF_RE.search(body.decode())
+        return match.group(1) if match else ''
+
+    def send(self, method, path, data=None):
+        connection = http.client.HTTPConnection(*self.server.server_address)
+        headers = {'Cookie': '; '.join(
+            f'{name}={value}' for name, value in self.cookies.items())}
+        body = None
+        if method == 'POST':
+            body = urlencode(dict(
+                data or {}, csrfmiddlewaretoken=self.csrf_token))
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            return response.status, response.read(), response.getheaders()
+        finally:
+            connection.close()
+
+    def __call__(self, method, path, data):
+        started = time.perf_counter()
+        status, _, _ = self.send(method, path, data)
+        elapsed = time.perf_counter() - started
+        return status, elapsed, self.application.last
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+RUNNERS = {'client': ClientRunner, 'wsgi': WSGIRunner}
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержки (p50/p95/p99), число запросов к базе и память '
+        'для публичных страниц и сохраняет результат в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument(
+            '--memory-requests', type=int, default=5,
+            help='Сколько запросов каждого вида пройдёт под tracemalloc.',
+        )
+        parser.add_argument(
+            '--endpoint', action='append', choices=ENDPOINTS,
+            help='Замерить только эти страницы (можно повторять).',
+        )
+        parser.add_argument(
+            '--mode', action='append', choices=sorted(RUNNERS),
+            help='Тестовый клиент, WSGI-сервер или оба (по умолчанию).',
+        )
+        parser.add_argument(
+            '--username',
+            help='От чьего имени ходить; по умолчанию — самый '
+                 'подписанный пользователь.',
+        )
+        parser.add_argument('--no-cache', action='store_true')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument(
+            '--baseline',
+            help='JSON прошлого запуска, с которым сравнить результат.',
+        )
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write(
+                'DEBUG = True: цифры будут хуже, чем в продакшене.')
+        user = self.get_user(options['username'])
+        endpoints = options['endpoint'] or ENDPOINTS
+        modes = options['mode'] or sorted(RUNNERS)
+        caches = NO_CACHE if options['no_cache'] else settings.CACHES
+        report = {
+            'commit': git_commit(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'cache': not options['no_cache'],
+            'username': user.username,
+            'dataset': self.dataset(),
+            'results': {},
+        }
+        with override_settings(CACHES=caches):
+            targets = Targets(options['seed'])
+            for mode in modes:
+                runner = RUNNERS[mode](user)
+                try:
+                    report['results'][mode] = {
+                        endpoint: self.measure(runner, targets, endpoint,
+                                               options)
+                        for endpoint in endpoints
+                    }
+                finally:
+                    runner.close()
+        report['max_rss_kb'] = max_rss_kb()
+        self.write_report(report, options['output'])
+        if options['baseline']:
+            self.compare(report, options['baseline'])
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            counter = UserCounter.objects.select_related('user').order_by(
+                '-following_count').first()
+            user = counter.user if counter else User.objects.first()
+        if user is None:
+            raise CommandError('Нет пользователя, от имени которого ходить.')
+        return user
+
+    def dataset(self):
+        return {
+            'users': User.objects.count(),
+            'posts': Post.objects.count(),
+            'groups': Group.objects.count(),
+        }
+
+    def measure(self, runner, targets, endpoint, options):
+        for _ in range(options['warmup']):
+            runner(*targets.request(endpoint))
+        timings, queries, errors = [], [], 0
+        for _ in range(options['requests']):
+            status, elapsed, count = runner(*targets.request(endpoint))
+            errors += status >= 400
+            timings.append(elapsed)
+            queries.append(count)
+        result = summarize(timings, queries, errors)
+        if runner.name == 'client' and options['memory_requests']:
+            result['memory_peak_kb'] = self.memory_peak(
+                runner, targets, endpoint, options['memory_requests'])
+        self.stdout.write(
+            '{} {}: p50 {p50_ms} мс, p95 {p95_ms} мс, p99 {p99_ms} мс, '
+            'запросов {queries_mean}'.format(runner.name, endpoint, **result)
+        )
+        return result
+
+    @staticmethod
+    def memory_peak(runner, targets, endpoint, count):
+        """Наибольший пик выделенной Python памяти за один запрос, КБ."""
+        peak = 0
+        for _ in range(count):
+            tracemalloc.start()
+            try:
+                runner(*targets.request(endpoint))
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        return round(peak / 1024, 1)
+
+    def write_report(self, report, output):
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if output == '-':
+            self.stdout.write(data)
+            return
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(data + '\n')
+        self.stdout.write(f'Результат сохранён в {output}')
+
+    def compare(self, report, path):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        self.stdout.write('Сравнение с {} ({}):'.format(
+            path, baseline.get('commit')))
+        for mode, results in report['results'].items():
+            for endpoint, result in results.items():
+                old = baseline.get('results', {}).get(mode, {}).get(endpoint)
+                if not old:
+                    continue
+                change = (result['p95_ms'] - old['p95_ms']) / max(
+                    old['p95_ms'], 0.01) * 100
+                self.stdout.write(
+                    '{} {}: p95 {} → {} мс ({:+.0f}%), '
+                    'запросов {} → {}'.format(
+                        mode, endpoint, old['p95_ms'], result['p95_ms'],
+                        change, old['queries_mean'], result['queries_mean'],
+                    )
+                )
@@ -0,0 +1,155 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls
+from posts.models import Group, Post
+
+NO_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+SQLITE_INDEXED = (
+    'USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY',
+    'USING PRIMARY KEY', 'VIRTUAL TABLE',
+)
+PG_SORT_RE = re.compile(r'(^|->\s+)Sort\s')
+PG_SEQ_SCAN_RE = re.compile(r'Seq Scan on (\S+)')
+
+
+def explain_sqlite(cursor, sql):
+    """Замечания к плану SQLite: (таблица или None, текст)."""
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+    for row in cursor.fetchall():
+        detail = row[-1]
+        scan = re.match(r'SCAN (?:TABLE )?(\S+)', detail)
+        if scan and not any(mark in detail for mark in SQLITE_INDEXED):
+            yield scan.group(1), 'полное сканирование: ' + detail
+        elif 'USE TEMP B-TREE' in detail:
+            yield None, 'сортировка без индекса: ' + detail
+
+
+def explain_postgresql(cursor, sql):
+    """Замечания к плану PostgreSQL: (таблица или None, текст).
+
+    Последовательное чтение и сортировка запрещаются на время проверки,
+    поэтому в плане они остаются, только если индекса нет вовсе.
+    """
+    cursor.execute('EXPLAIN ' + sql)
+    for line, in cursor.fetchall():
+        line = line.strip()
+        scan = PG_SEQ_SCAN_RE.search(line)
+        if scan:
+            yield scan.group(1), 'полное сканирование: ' + line
+        elif PG_SORT_RE.search(line):
+            yield None, 'сортировка без индекса: ' + line
+
+
+EXPLAIN = {
+    'sqlite': explain_sqlite,
+    'postgresql': explain_postgresql,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN для запросов каждого view из posts/views.py '
+        'и отмечает полные сканирования и сортировки без индекса'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--allow', action='append', default=[], metavar='TABLE',
+            help='Не отмечать полное сканирование этой таблицы.',
+        )
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Завершиться с ошибкой, если есть замечания.',
+        )
+
+    def handle(self, *args, **options):
+        explain = EXPLAIN.get(connection.vendor)
+        if explain is None:
+            raise CommandError(
+                f'EXPLAIN для {connection.vendor} не поддерживается.')
+        post = Post.objects.select_related('author').first()
+        if post is None:
+            raise CommandError('В базе нет постов, проверять нечего.')
+        self.allowed = set(options['allow'])
+        self.tables = set(connection.introspection.table_names())
+        self.explained = {}
+        with override_settings(CACHES=NO_CACHE,
+                               ALLOWED_HOSTS=['testserver']), \
+                transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute('SET LOCAL enable_sort = off')
+            client = Client()
+            client.force_login(post.author)
+            issues = sum(
+                self.audit(client, name, url, explain)
+                for name, url in self.view_urls(post)
+            )
+            transaction.set_rollback(True)
+        self.stdout.write(f'Замечаний: {issues}')
+        if issues and options['fail']:
+            raise CommandError('Есть запросы без подходящего индекса.')
+
+    def view_urls(self, post):
+        """Адреса всех view приложения с аргументами из ``post``."""
+        group = post.group or Group.objects.first()
+        values = {
+            'post_id': post.pk,
+            'username': post.author.username,
+            'slug': group.slug if group else None,
+            'format': 'json',
+        }
+        word = (post.text.split() or [''])[0]
+        for pattern in urls.urlpatterns:
+            names = list(pattern.pattern.converters)
+            if any(values[name] is None for name in names):
+                self.stdout.write(f'{pattern.name}: нет данных, пропущено')
+                continue
+            url = reverse(f'{urls.app_name}:{pattern.name}', kwargs={
+                name: values[name] for name in names
+            })
+            if pattern.name == 'search':
+                url += f'?q={word}'
+            yield pattern.name, url
+
+    def audit(self, client, name, url, explain):
+        """Проверить запросы view по ``url`` и следующей его страницы."""
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            if response.streaming:
+                # Ленты читают базу, пока ответ отдаётся.
+                b''.join(response.streaming_content)
+            page = (response.context or {}).get('page_obj')
+            if page is not None and page.has_next():
+                separator = '&' if '?' in url else '?'
+                client.get(f'{url}{separator}after={page.next_cursor}')
+        statements = [
+            query['sql'] for query in queries
+            if query['sql'].lstrip().upper().startswith('SELECT')
+        ]
+        self.stdout.write(f'{name} {url}: запросов {len(statements)}')
+        issues = 0
+        for sql in statements:
+            for table, problem in self.explain(explain, sql):
+                # Подзапросы тоже «сканируются», но это не таблицы.
+                if table in self.allowed or (
+                        table is not None and table not in self.tables):
+                    continue
+                issues += 1
+                self.stdout.write(f'  ! {problem}\n    {sql[:200]}')
+        return issues
+
+    def explain(self, explain, sql):
+        if sql not in self.explained:
+            with connection.cursor() as cursor:
+                self.explained[sql] = list(explain(cursor, sql))
+        return self.explained[sql]
@@ -0,0 +1,38 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает группы, посты, комментарии и подписки в файлы JSONL или '
+        'CSV; прерванная выгрузка продолжается с места остановки, повторная '
+        'дописывает только новые строки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS, default='jsonl')
+        parser.add_argument(
+            '--batch-size', type=int, default=transfer.BATCH_SIZE)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Забыть прошлую выгрузку и начать файлы заново.',
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        os.makedirs(directory, exist_ok=True)
+        progress = transfer.Progress(
+            os.path.join(directory, '.export-progress.json'),
+            restart=options['restart'],
+        )
+        for table in transfer.TABLES:
+            exported = transfer.export_table(
+                table, directory, options['format'], progress,
+                options['batch_size'],
+            )
+            self.stdout.write(f'{table.name}: выгружено {exported}')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_thumbnail
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры для постов с картинкой, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Перестроить миниатюры у всех постов с картинкой.',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='')
+        if not options['all']:
+            posts = posts.filter(thumbnail_url='')
+        total = 0
+        for pk in posts.values_list('pk', flat=True).iterator():
+            try:
+                generate_thumbnail(pk)
+            except Exception as error:
+                self.stderr.write(
+                    'Не удалось построить миниатюру поста {}: {}'.format(
+                        pk, error))
+            total += 1
+        self.stdout.write('Обработано постов: {}'.format(total))
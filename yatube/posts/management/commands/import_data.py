@@ -0,0 +1,67 @@
+import os
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline, transfer
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает группы, посты, комментарии и подписки из файлов '
+        'export_data; прерванная загрузка продолжается с места остановки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS, default='jsonl')
+        parser.add_argument(
+            '--batch-size', type=int, default=transfer.BATCH_SIZE)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Читать файлы с начала; загруженное раньше пропускается.',
+        )
+        parser.add_argument(
+            '--append', action='store_true',
+            help='Сдвинуть id постов и комментариев за наибольшие id в '
+                 'базе, чтобы добавить данные к существующим.',
+        )
+        parser.add_argument(
+            '--skip-search', action='store_true',
+            help='Не перестраивать полнотекстовый индекс.',
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError(f'Нет каталога {directory}.')
+        progress = transfer.Progress(
+            os.path.join(directory, '.import-progress.json'),
+            restart=options['restart'],
+        )
+        for table in transfer.TABLES:
+            read, saved = transfer.import_table(
+                table, directory, options['format'], progress,
+                options['batch_size'], options['append'],
+            )
+            self.stdout.write(
+                f'{table.name}: прочитано {read}, сохранено {saved}')
+        # bulk_create не вызывает сигналов: счётчики, ленты, поиск и
+        # кэш приводятся в порядок один раз после загрузки.
+        transfer.reset_sequences()
+        self.step('Счётчики', call_command, 'reconcile_counters',
+                  stdout=self.stdout)
+        self.step('Ленты', timeline.rebuild)
+        if not options['skip_search']:
+            self.step('Поисковый индекс', call_command,
+                      'rebuild_search_index', stdout=self.stdout)
+        cache.clear()
+
+    def step(self, title, function, *args, **kwargs):
+        started = time.monotonic()
+        function(*args, **kwargs)
+        self.stdout.write('{}: {:.1f} с'.format(
+            title, time.monotonic() - started))
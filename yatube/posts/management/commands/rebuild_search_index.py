@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from posts import search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов и комментариев'
+
+    def handle(self, *args, **options):
+        alias = router.db_for_write(Post)
+        with transaction.atomic(using=alias):
+            search.rebuild(
+                connections[alias],
+                Post.objects.using(alias).values_list(
+                    'pk', 'text').iterator(),
+                Comment.objects.using(alias).values_list(
+                    'pk', 'post_id', 'text').iterator(),
+            )
+        self.stdout.write(
+            'Индекс перестроен: постов {}, комментариев {}'.format(
+                Post.objects.using(alias).count(),
+                Comment.objects.using(alias).count(),
+            )
+        )
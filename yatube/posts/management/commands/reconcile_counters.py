@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts import counts
+from posts.models import Comment, Follow, Group, Post, User, UserCounter
+
+
+def count_of(model, field, outer='pk'):
+    """Подзапрос: сколько строк ``model`` ссылаются на внешнюю строку."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef(outer)})
+        .order_by().values(field).annotate(total=Count('pk'))
+        .values('total')[:1],
+        output_field=models.IntegerField(),
+    ), 0)
+
+
+COUNTERS = (
+    (Group, 'post_count', lambda: count_of(Post, 'group')),
+    (Post, 'comment_count', lambda: count_of(Comment, 'post')),
+    (UserCounter, 'post_count', lambda: count_of(Post, 'author', 'user')),
+    (UserCounter, 'follower_count',
+     lambda: count_of(Follow, 'author', 'user')),
+    (UserCounter, 'following_count',
+     lambda: count_of(Follow, 'user', 'user')),
+)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счётчики с данными и чинит расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не меняя.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        with transaction.atomic():
+            missing = User.objects.filter(counter__isnull=True)
+            if not dry_run:
+                UserCounter.objects.bulk_create(
+                    UserCounter(user_id=pk)
+                    for pk in missing.values_list('pk', flat=True).iterator()
+                )
+            for model, field, actual in COUNTERS:
+                drifted = model.objects.annotate(actual=actual()).exclude(
+                    **{field: F('actual')}
+                )
+                fixed = drifted.count()
+                if fixed and not dry_run:
+                    model.objects.filter(
+                        pk__in=drifted.values('pk')
+                    ).update(**{field: actual()})
+                self.stdout.write(
+                    f'{model.__name__}.{field}: расхождений {fixed}'
+                )
+            for table, drift in counts.reconcile(dry_run=dry_run):
+                self.stdout.write(f'TableCounter.{table}: {drift:+d}')
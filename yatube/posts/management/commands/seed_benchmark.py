@@ -0,0 +1,185 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from posts import timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.transfer import batches, explicit_dates
+
+PREFIX = 'bench_'
+WORDS = (
+    'сегодня', 'вчера', 'город', 'утро', 'вечер', 'кофе', 'книга', 'кот',
+    'собака', 'поезд', 'дорога', 'море', 'горы', 'лес', 'река', 'снег',
+    'дождь', 'солнце', 'работа', 'проект', 'код', 'релиз', 'тест',
+    'база', 'данных', 'запрос', 'индекс', 'кэш', 'сервер', 'ответ',
+    'друзья', 'семья', 'музыка', 'фильм', 'театр', 'выставка', 'парк',
+    'новый', 'старый', 'большой', 'маленький', 'быстрый', 'медленный',
+    'читал', 'смотрел', 'писал', 'думал', 'гулял', 'ехал', 'ждал',
+    'очень', 'снова', 'почти', 'всегда', 'иногда', 'наконец', 'опять',
+)
+
+
+def power_law_rank(rng, size):
+    """Случайный ранг от 0 до ``size - 1`` с плотностью около 1/x.
+
+    Первые ранги (популярные авторы, посты) выпадают намного чаще
+    последних — как подписчики и комментарии в реальной соцсети.
+    """
+    return min(int(size ** rng.random()) - 1, size - 1)
+
+
+def sentence(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high))).capitalize()
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу данными для нагрузочных тестов: пользователи, '
+        'посты, неравномерный граф подписок и комментарии'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--posts', type=int, default=5000000)
+        parser.add_argument('--comments', type=int, default=2000000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument(
+            '--max-follows', type=int, default=200,
+            help='Больше стольких авторов пользователь не читает.',
+        )
+        parser.add_argument(
+            '--scale', type=float, default=1.0,
+            help='Множитель числа пользователей, постов и комментариев.',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--skip-search', action='store_true',
+            help='Не перестраивать полнотекстовый индекс.',
+        )
+
+    def handle(self, *args, **options):
+        # Комментарии раскладываются по диапазону id новых постов, а он
+        # сплошной, только если постов до загрузки не было.
+        if (Post.objects.exists()
+                or User.objects.filter(username__startswith=PREFIX).exists()):
+            raise CommandError(
+                'В базе уже есть посты или тестовые данные; '
+                'начните с пустой базы.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.period = timedelta(days=options['days']).total_seconds()
+        scale = options['scale']
+        users = max(int(options['users'] * scale), 2)
+        posts = int(options['posts'] * scale)
+        comments = int(options['comments'] * scale)
+
+        user_ids = self.step('Пользователи', self.create_users, users)
+        group_ids = self.step(
+            'Группы', self.create_groups, options['groups'])
+        with explicit_dates(Post._meta.get_field('pub_date'),
+                            Comment._meta.get_field('created')):
+            post_range = self.step(
+                'Посты', self.create_posts, posts, user_ids, group_ids)
+            self.step('Подписки', self.create_follows, user_ids,
+                      options['max_follows'])
+            self.step('Комментарии', self.create_comments, comments,
+                      user_ids, post_range)
+        self.step('Счётчики', call_command, 'reconcile_counters',
+                  stdout=self.stdout)
+        self.step('Ленты', timeline.rebuild)
+        if not options['skip_search']:
+            self.step('Поисковый индекс', call_command,
+                      'rebuild_search_index', stdout=self.stdout)
+
+    def step(self, title, function, *args, **kwargs):
+        started = time.monotonic()
+        result = function(*args, **kwargs)
+        self.stdout.write('{}: {:.1f} с'.format(
+            title, time.monotonic() - started))
+        return result
+
+    def bulk_create(self, model, objects):
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+
+    def random_date(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.period)
+
+    def create_users(self, count):
+        self.bulk_create(User, (
+            User(username=f'{PREFIX}{i}', password='!')
+            for i in range(count)
+        ))
+        # Ранг популярности пользователя — его место в этом списке.
+        return list(User.objects.filter(
+            username__startswith=PREFIX
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_groups(self, count):
+        self.bulk_create(Group, (
+            Group(title=f'Группа {i}', slug=f'{PREFIX}group-{i}',
+                  description=sentence(self.rng, 5, 20))
+            for i in range(count)
+        ))
+        return list(Group.objects.filter(
+            slug__startswith=PREFIX).values_list('pk', flat=True))
+
+    def create_posts(self, count, user_ids, group_ids):
+        rng = self.rng
+        self.bulk_create(Post, (
+            Post(
+                author_id=user_ids[power_law_rank(rng, len(user_ids))],
+                group_id=(rng.choice(group_ids)
+                          if group_ids and rng.random() < 0.6 else None),
+                text=sentence(rng, 5, 60),
+                pub_date=self.random_date(),
+            )
+            for _ in range(count)
+        ))
+        # Постов до загрузки не было (см. handle), поэтому id идут подряд.
+        return Post.objects.aggregate(first=Min('pk'), last=Max('pk'))
+
+    def create_follows(self, user_ids, max_follows):
+        rng = self.rng
+        total = len(user_ids)
+
+        def follows():
+            for user_id in user_ids:
+                wanted = min(power_law_rank(rng, max_follows) + 1, total - 1)
+                authors = set()
+                # На маленькой базе столько различных авторов по степенному
+                # закону можно выбирать очень долго, поэтому попыток не
+                # больше десятикратного числа подписок.
+                for _ in range(wanted * 10):
+                    author_id = user_ids[power_law_rank(rng, total)]
+                    if author_id != user_id:
+                        authors.add(author_id)
+                    if len(authors) == wanted:
+                        break
+                for author_id in authors:
+                    yield Follow(user_id=user_id, author_id=author_id)
+        self.bulk_create(Follow, follows())
+
+    def create_comments(self, count, user_ids, post_range):
+        """Комментарии; немногие посты собирают большую их часть."""
+        if post_range['last'] is None:
+            return
+        rng = self.rng
+        total = post_range['last'] - post_range['first'] + 1
+        self.bulk_create(Comment, (
+            Comment(
+                post_id=post_range['last'] - power_law_rank(rng, total),
+                author_id=rng.choice(user_ids),
+                text=sentence(rng, 3, 30),
+                created=self.random_date(),
+            )
+            for _ in range(count)
+        ))
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.16 on 2026-10-18 09:12
+
+from django.db import migrations
+
+# Схема индекса на момент этой миграции; posts.search может меняться
+# дальше, а миграция должна давать ту же таблицу, что и тогда.
+CREATE_SQL = {
+    'sqlite': [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING fts5('
+        'body, post_id UNINDEXED, '
+        "tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        'CREATE TABLE IF NOT EXISTS posts_search ('
+        'id bigint PRIMARY KEY, post_id integer NOT NULL, '
+        'document tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS posts_search_document_idx '
+        'ON posts_search USING GIN (document)',
+    ],
+}
+DROP_SQL = 'DROP TABLE IF EXISTS posts_search'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in CREATE_SQL.get(vendor, ()):
+        schema_editor.execute(sql)
+    # В SQLite индекс хранит основы слов из core.stemmer, их считает
+    # Python: существующие посты туда кладёт rebuild_search_index.
+    # PostgreSQL строит tsvector сам.
+    if vendor == 'postgresql':
+        Post = apps.get_model('posts', 'Post')
+        Comment = apps.get_model('posts', 'Comment')
+        schema_editor.execute(
+            'INSERT INTO posts_search (id, post_id, document) '
+            "SELECT 2 * id, id, to_tsvector('russian', text) FROM {} "
+            'UNION ALL '
+            "SELECT 2 * id + 1, post_id, to_tsvector('russian', text) "
+            'FROM {}'.format(Post._meta.db_table, Comment._meta.db_table)
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_post_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    TableCounter = apps.get_model('posts', 'TableCounter')
+    for name in ('Post', 'Comment'):
+        model = apps.get_model('posts', name)
+        TableCounter.objects.create(
+            table=model._meta.db_table, rows=model.objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableCounter',
+            fields=[
+                ('table', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Таблица')),
+                ('rows', models.BigIntegerField(default=0, verbose_name='Число строк')),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_fanned_out(apps, schema_editor):
+    UserCounter = apps.get_model('posts', 'UserCounter')
+    UserCounter.objects.filter(
+        follower_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).update(fanned_out=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_table_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounter',
+            name='fanned_out',
+            field=models.BooleanField(default=True, verbose_name='Посты раскладываются по лентам'),
+        ),
+        migrations.RunPython(fill_fanned_out, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
+import json
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, router, transaction
 from django.db.models.constraints import UniqueConstraint
 
 User = get_user_model()
@@ -19,12 +21,69 @@ class Group(models.Model):
         verbose_name='Описание группы',
         help_text='Введите описание группы'
     )
+    post_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число постов')
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class PostQuerySet(models.QuerySet):
+    # Колонки, которые читают шаблоны лент и страницы поста.
+    FEED_FIELDS = (
+        'id', 'text', 'pub_date', 'image', 'comment_count',
+        'thumbnail_url', 'thumbnail_width', 'thumbnail_height',
+        'image_variants', 'author', 'author__username',
+        'author__first_name', 'author__last_name',
+        'group', 'group__title', 'group__slug',
+    )
+
+    def feed(self):
+        """Посты с авторами и группами одним запросом, без лишних колонок."""
+        return self.select_related('author', 'group').only(*self.FEED_FIELDS)
+
+
+class CommentQuerySet(models.QuerySet):
+    FEED_FIELDS = (
+        'id', 'text', 'created', 'post', 'author', 'author__username',
+    )
+
+    def with_authors(self):
+        """Комментарии вместе с авторами, без запроса на каждый."""
+        return self.select_related('author').only(*self.FEED_FIELDS)
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    def with_posts(self):
+        """Записи ленты вместе с постами, их авторами и группами."""
+        return self.select_related(
+            'post__author', 'post__group'
+        ).only('pub_date', 'post', *(
+            f'post__{name}' for name in PostQuerySet.FEED_FIELDS
+        ))
+
+
+class CountedModel(models.Model):
+    """Модель, от которой зависят счётчики (см. ``posts.signals``).
+
+    Сохранение идёт в транзакции вместе с обработчиками post_save,
+    поэтому запись и изменение счётчиков либо проходят вместе, либо нет.
+    Удаление Django и так выполняет в транзакции вместе с post_delete.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+
+class Post(CountedModel):
     text = models.TextField(
         verbose_name='Текст нового поста',
         help_text='Введите текст поста')
@@ -34,6 +93,7 @@ class Post(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='posts',
         verbose_name='Автор'
     )
@@ -42,6 +102,7 @@ class Post(models.Model):
         models.SET_NULL,
         blank=True,
         null=True,
+        db_index=False,
         related_name='posts',
         verbose_name='Группа',
         help_text='Группа, к которой будет относиться пост'
@@ -51,19 +112,78 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число комментариев')
+    # Заполняются фоновым воркером (posts.thumbnails), пока пусто —
+    # вместо картинки показывается заглушка.
+    thumbnail_url = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        verbose_name='Адрес миниатюры')
+    thumbnail_width = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Ширина миниатюры')
+    thumbnail_height = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Высота миниатюры')
+    # JSON вида [["image/webp", [[480, "url"], ...]], ...] для srcset.
+    image_variants = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Варианты картинки')
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
+        # Ленты листаются по ключу (pub_date, id), см. core.paginator;
+        # индексы по author и group покрывают и сами внешние ключи.
+        indexes = [
+            models.Index(fields=('-pub_date', '-id'),
+                         name='post_date_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='post_author_date_idx'),
+            models.Index(fields=('group', '-pub_date', '-id'),
+                         name='post_group_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    def reset_thumbnail(self):
+        self.thumbnail_url = ''
+        self.thumbnail_width = self.thumbnail_height = None
+        self.image_variants = ''
+
+    @property
+    def image_sources(self):
+        """Источники для ``<picture>``: MIME-тип и готовый ``srcset``."""
+        try:
+            variants = json.loads(self.image_variants)
+        except ValueError:
+            return []
+        return [
+            {
+                'type': mime_type,
+                'srcset': ', '.join(
+                    '{} {}w'.format(url, width) for width, url in sizes
+                ),
+            }
+            for mime_type, sizes in variants
+        ]
 
-class Comment(models.Model):
+
+class Comment(CountedModel):
     post = models.ForeignKey(
         Post, null=True,
         blank=True,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='comments',
         verbose_name='Пост комментария',
         help_text='Пост комментария',)
@@ -81,14 +201,24 @@ class Comment(models.Model):
     )
     created = models.DateTimeField('date published', auto_now_add=True)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('post', 'created', 'id'),
+                         name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return self.text[:15]
 
 
-class Follow(models.Model):
+class Follow(CountedModel):
+    # Индекс по user даёт уникальность (user, author).
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='follower')
     author = models.ForeignKey(
         User,
@@ -96,8 +226,97 @@ class Follow(models.Model):
         related_name='following')
 
     class Meta:
-        constraints = UniqueConstraint(fields=('user', 'author',),
-                                       name='uniq_follow')
+        constraints = [
+            UniqueConstraint(fields=('user', 'author'), name='uniq_follow'),
+            models.CheckConstraint(check=~models.Q(user=models.F('author')),
+                                   name='no_self_follow'),
+        ]
 
     def __str__(self):
         return self.user
+
+
+class UserCounter(models.Model):
+    """Счётчики пользователя, чтобы не считать строки на каждый запрос."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='counter',
+        verbose_name='Пользователь')
+    post_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число постов')
+    follower_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписчиков')
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписок')
+    # Снят — посты автора не раскладываются по лентам, а подмешиваются
+    # при чтении (см. ``posts.timeline``).
+    fanned_out = models.BooleanField(
+        default=True,
+        verbose_name='Посты раскладываются по лентам')
+
+    def __str__(self):
+        return str(self.user_id)
+
+    @classmethod
+    def for_user(cls, user):
+        try:
+            return user.counter
+        except cls.DoesNotExist:
+            return cls.objects.get_or_create(user=user)[0]
+
+
+class TableCounter(models.Model):
+    """Число строк большой таблицы для приблизительных подсчётов.
+
+    Ведётся сигналами там, где у базы нет статистики планировщика
+    (SQLite), см. ``posts.counts``.
+    """
+    table = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Таблица')
+    rows = models.BigIntegerField(
+        default=0,
+        verbose_name='Число строк')
+
+    def __str__(self):
+        return f'{self.table}: {self.rows}'
+
+
+class TimelineEntry(models.Model):
+    """Пост в ленте подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write), поэтому страница
+    ``/follow/`` читается одним диапазоном индекса ``(user, pub_date)``.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации поста')
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-pub_date', '-post_id')
+        constraints = [
+            UniqueConstraint(fields=('user', 'post'),
+                             name='uniq_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=('user', '-pub_date', '-post'),
+                         name='timeline_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
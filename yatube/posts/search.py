@@ -0,0 +1,307 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+Индекс — отдельная таблица ``posts_search``: на SQLite это виртуальная
+таблица FTS5, куда текст попадает уже приведённым к основам
+(``core.stemmer``), на PostgreSQL — ``tsvector`` с конфигурацией
+``russian`` и GIN-индексом. Документ поста и документ комментария
+различаются чётностью ``id``: ``2 * pk`` и ``2 * pk + 1``, поэтому
+обновление и удаление идут по первичному ключу. Индекс обновляется
+сигналами при сохранении и удалении постов и комментариев, целиком
+перестраивается командой ``rebuild_search_index``.
+
+Результаты — посты, отсортированные по релевантности лучшего из их
+документов (поста или комментария к нему), страницы листаются курсором
+по паре (релевантность, id).
+"""
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from core.paginator import KeysetPaginator
+from core.stemmer import stem_words
+from yatube.settings import PST_ON_PAGE
+
+from .models import Comment, Post
+
+POST, COMMENT = 0, 1
+
+
+def document_id(kind, pk):
+    return 2 * pk + kind
+
+
+class SearchBackend:
+    """Поиск без индекса, через ``LIKE``, для прочих СУБД."""
+
+    table = 'posts_search'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create(self):
+        pass
+
+    def drop(self):
+        pass
+
+    def index(self, kind, pk, post_id, text):
+        pass
+
+    def remove(self, kind, pk):
+        pass
+
+    def clear(self):
+        pass
+
+    def matching_sql(self, query, kind):
+        """SQL с pk подходящих объектов ``kind`` и его параметры.
+
+        None — индекса нет, искать нужно обычными средствами.
+        """
+        return None
+
+    def hits(self, query, limit, values=None, reverse=False, offset=0):
+        """Пары (id поста, релевантность) по убыванию релевантности."""
+        words = query.split()
+        if not words:
+            return []
+        posts = Q()
+        comments = Q()
+        for word in words:
+            posts &= Q(text__icontains=word)
+            comments &= Q(text__icontains=word)
+        queryset = Post.objects.using(self.connection.alias).filter(
+            posts | Q(pk__in=Comment.objects.filter(comments).values('post'))
+        )
+        if values is not None:
+            lookup = 'pk__gt' if reverse else 'pk__lt'
+            queryset = queryset.filter(**{lookup: values[1]})
+        queryset = queryset.order_by('pk' if reverse else '-pk')
+        ids = queryset.values_list('pk', flat=True)[offset:offset + limit]
+        return [(pk, 0.0) for pk in ids]
+
+    def execute(self, sql, params=()):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.description:
+                return cursor.fetchall()
+        return None
+
+    def ranked(self, hits_sql, params, values, reverse, limit, offset):
+        """Отсортировать и отрезать страницу из запроса ``hits_sql``.
+
+        ``hits_sql`` возвращает столбцы ``post_id`` и ``score``.
+        """
+        where = ''
+        if values is not None:
+            where = (
+                'WHERE score {0} %s OR (score = %s AND post_id {0} %s)'
+            ).format('>' if reverse else '<')
+            params = list(params) + [values[0], values[0], values[1]]
+        order = 'ASC' if reverse else 'DESC'
+        sql = (
+            'SELECT post_id, score FROM ({}) AS hits {} '
+            'ORDER BY score {order}, post_id {order} LIMIT %s OFFSET %s'
+        ).format(hits_sql, where, order=order)
+        return [
+            (post_id, float(score)) for post_id, score in
+            self.execute(sql, list(params) + [limit, offset])
+        ]
+
+
+class SQLiteBackend(SearchBackend):
+    def create(self):
+        self.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5('
+            'body, post_id UNINDEXED, '
+            "tokenize = 'unicode61 remove_diacritics 2')".format(self.table)
+        )
+
+    def drop(self):
+        self.execute('DROP TABLE IF EXISTS {}'.format(self.table))
+
+    @staticmethod
+    def match_expression(query):
+        """Запрос FTS5: все основы слов, каждая в кавычках."""
+        return ' '.join(
+            '"{}"'.format(word.replace('"', '""'))
+            for word in stem_words(query)
+        )
+
+    def index(self, kind, pk, post_id, text):
+        self.remove(kind, pk)
+        self.execute(
+            'INSERT INTO {} (rowid, body, post_id) '
+            'VALUES (%s, %s, %s)'.format(self.table),
+            [document_id(kind, pk), ' '.join(stem_words(text)), post_id],
+        )
+
+    def remove(self, kind, pk):
+        self.execute(
+            'DELETE FROM {} WHERE rowid = %s'.format(self.table),
+            [document_id(kind, pk)],
+        )
+
+    def clear(self):
+        self.execute('DELETE FROM {}'.format(self.table))
+
+    def matching_sql(self, query, kind):
+        return (
+            'SELECT rowid / 2 FROM {} WHERE {} MATCH %s '
+            'AND rowid %% 2 = %s'.format(self.table, self.table),
+            [self.match_expression(query) or '""', kind],
+        )
+
+    def hits(self, query, limit, values=None, reverse=False, offset=0):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        # bm25 (скрытый столбец rank) тем меньше, чем документ релевантнее.
+        hits_sql = (
+            'SELECT post_id, -MIN(rank) AS score FROM {} '
+            'WHERE {} MATCH %s GROUP BY post_id'
+        ).format(self.table, self.table)
+        return self.ranked(
+            hits_sql, [expression], values, reverse, limit, offset)
+
+
+class PostgresBackend(SearchBackend):
+    config = 'russian'
+
+    def create(self):
+        self.execute(
+            'CREATE TABLE IF NOT EXISTS {0} ('
+            'id bigint PRIMARY KEY, post_id integer NOT NULL, '
+            'document tsvector NOT NULL)'.format(self.table)
+        )
+        self.execute(
+            'CREATE INDEX IF NOT EXISTS {0}_document_idx '
+            'ON {0} USING GIN (document)'.format(self.table)
+        )
+
+    def drop(self):
+        self.execute('DROP TABLE IF EXISTS {}'.format(self.table))
+
+    def index(self, kind, pk, post_id, text):
+        self.execute(
+            'INSERT INTO {} (id, post_id, document) '
+            'VALUES (%s, %s, to_tsvector(%s, %s)) '
+            'ON CONFLICT (id) DO UPDATE SET post_id = EXCLUDED.post_id, '
+            'document = EXCLUDED.document'.format(self.table),
+            [document_id(kind, pk), post_id, self.config, text],
+        )
+
+    def remove(self, kind, pk):
+        self.execute(
+            'DELETE FROM {} WHERE id = %s'.format(self.table),
+            [document_id(kind, pk)],
+        )
+
+    def clear(self):
+        self.execute('TRUNCATE {}'.format(self.table))
+
+    def matching_sql(self, query, kind):
+        return (
+            'SELECT id / 2 FROM {} WHERE document @@ '
+            'plainto_tsquery(%s, %s) AND id %% 2 = %s'.format(self.table),
+            [self.config, query, kind],
+        )
+
+    def hits(self, query, limit, values=None, reverse=False, offset=0):
+        if not query.strip():
+            return []
+        hits_sql = (
+            'SELECT post_id, MAX(ts_rank_cd(document, query)) AS score '
+            'FROM {}, plainto_tsquery(%s, %s) AS query '
+            'WHERE document @@ query GROUP BY post_id'
+        ).format(self.table)
+        return self.ranked(
+            hits_sql, [self.config, query], values, reverse, limit, offset)
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend(connection):
+    return BACKENDS.get(connection.vendor, SearchBackend)(connection)
+
+
+def write_backend():
+    return get_backend(connections[router.db_for_write(Post)])
+
+
+def index_post(post):
+    write_backend().index(POST, post.pk, post.pk, post.text)
+
+
+def index_comment(comment):
+    write_backend().index(COMMENT, comment.pk, comment.post_id, comment.text)
+
+
+def remove_post(pk):
+    write_backend().remove(POST, pk)
+
+
+def remove_comment(pk):
+    write_backend().remove(COMMENT, pk)
+
+
+def rebuild(connection, post_rows, comment_rows):
+    """Перестроить индекс из пар (pk, текст) и троек (pk, id поста, текст).
+    """
+    backend = get_backend(connection)
+    backend.clear()
+    for pk, text in post_rows:
+        backend.index(POST, pk, pk, text)
+    for pk, post_id, text in comment_rows:
+        backend.index(COMMENT, pk, post_id, text)
+
+
+def filter_matching(queryset, query, kind):
+    """Сузить ``queryset`` до объектов ``kind``, подходящих под запрос.
+
+    Возвращает None, если у базы нет полнотекстового индекса.
+    """
+    matching = get_backend(connections[queryset.db]).matching_sql(
+        query, kind)
+    if matching is None:
+        return None
+    return queryset.filter(pk__in=RawSQL(*matching))
+
+
+class SearchPaginator(KeysetPaginator):
+    """Курсорная пагинация результатов поиска по (релевантность, id)."""
+
+    def __init__(self, object_list, per_page, query, **kwargs):
+        super().__init__(
+            object_list, per_page, key=('-search_rank', '-id'), **kwargs)
+        self.query = query
+        self.backend = get_backend(connections[object_list.db])
+
+    def cursor_values(self, values):
+        return [float(values[0]), int(values[1])]
+
+    def rows(self, values=None, reverse=False, offset=0):
+        hits = self.backend.hits(
+            self.query, self.per_page + 1, values, reverse, offset)
+        posts = self.object_list.in_bulk([post_id for post_id, _ in hits])
+        rows = []
+        for post_id, score in hits:
+            post = posts.get(post_id)
+            if post is not None:
+                post.search_rank = score
+                rows.append(post)
+        return rows
+
+
+def get_search_page(request, query):
+    """Страница результатов поиска по ?after=/?before= или ?page=N."""
+    paginator = SearchPaginator(Post.objects.feed(), PST_ON_PAGE, query)
+    return paginator.get_page(
+        request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
@@ -0,0 +1,166 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cache, counts, search, timeline
+from .models import Comment, Follow, Group, Post, User, UserCounter
+
+
+def change_counter(queryset, field, delta):
+    """Сдвинуть счётчик ``field`` у строк ``queryset`` на ``delta``.
+
+    Обновление идёт одним UPDATE через F(), поэтому параллельные
+    запросы не теряют изменений, а счётчик не уходит ниже нуля.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def change_group_counter(group_id, delta):
+    if group_id is not None:
+        change_counter(Group.objects.filter(pk=group_id), 'post_count', delta)
+
+
+def change_user_counter(user_id, field, delta):
+    updated = change_counter(
+        UserCounter.objects.filter(user_id=user_id), field, delta)
+    if not updated and delta > 0:
+        UserCounter.objects.create(user_id=user_id, **{field: delta})
+
+
+@receiver(post_save, sender=User)
+def create_user_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserCounter.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._saved_group_id = Post.objects.filter(
+            pk=instance.pk).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counts.change(Post, 1)
+        change_user_counter(instance.author_id, 'post_count', 1)
+        change_group_counter(instance.group_id, 1)
+        timeline.fan_out_post.delay(instance.pk)
+        return
+    old_group_id = getattr(instance, '_saved_group_id', instance.group_id)
+    if old_group_id != instance.group_id:
+        change_group_counter(old_group_id, -1)
+        change_group_counter(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counts.change(Post, -1)
+    change_user_counter(instance.author_id, 'post_count', -1)
+    change_group_counter(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counts.change(Comment, 1)
+        change_counter(
+            Post.objects.filter(pk=instance.post_id), 'comment_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counts.change(Comment, -1)
+    change_counter(
+        Post.objects.filter(pk=instance.post_id), 'comment_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_user_counter(instance.author_id, 'follower_count', 1)
+        change_user_counter(instance.user_id, 'following_count', 1)
+        timeline.backfill_follow.delay(
+            instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    change_user_counter(instance.author_id, 'follower_count', -1)
+    change_user_counter(instance.user_id, 'following_count', -1)
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    scopes = [
+        cache.INDEX,
+        cache.post_scope(instance.pk),
+        cache.profile_scope(instance.author_id),
+        cache.group_scope(instance.group_id),
+    ]
+    old_group_id = getattr(instance, '_saved_group_id', instance.group_id)
+    if old_group_id != instance.group_id:
+        scopes.append(cache.group_scope(old_group_id))
+    cache.bump(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache.bump(cache.post_scope(instance.post_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache.bump(cache.GROUPS, cache.group_scope(instance.pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache.bump(cache.profile_scope(instance.pk))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache.bump(
+            cache.profile_scope(instance.author_id),
+            cache.profile_scope(instance.user_id),
+        )
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.remove_comment(instance.pk)
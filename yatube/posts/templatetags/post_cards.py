@@ -0,0 +1,12 @@
+from django import template
+
+from posts import cache
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts):
+    """Закэшированные карточки постов: ``{% post_cards page_obj as cards %}``.
+    """
+    return cache.post_cards(posts)
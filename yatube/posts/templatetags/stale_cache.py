@@ -0,0 +1,54 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts import cache
+
+register = template.Library()
+
+
+class StaleCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, vary_on, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        key = 'posts:fragment:' + make_template_fragment_key(
+            self.fragment_name,
+            [var.resolve(context) for var in self.vary_on],
+        )
+        return cache.remember(
+            key,
+            lambda: self.nodelist.render(context),
+            version=self.version and self.version.resolve(context),
+            timeout=self.timeout.resolve(context),
+        )
+
+
+@register.tag
+def stale_cache(parser, token):
+    """``{% cache %}``, который отдаёт устаревший фрагмент, пока его
+    пересчитывает один запрос::
+
+        {% stale_cache cache_ttl post_detail post.pk version=cache_version %}
+            ...
+        {% endstale_cache %}
+    """
+    nodelist = parser.parse(('endstale_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} ждёт срок и имя фрагмента')
+    version = None
+    if bits[-1].startswith('version='):
+        version = parser.compile_filter(bits.pop()[len('version='):])
+    return StaleCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        bits[2],
+        [parser.compile_filter(bit) for bit in bits[3:]],
+        version,
+    )
@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from .. import transfer
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class BenchmarkTest(TestCase):
+    def test_seed_and_measure(self):
+        """Генератор данных и замер задержек работают на малом наборе."""
+        out = StringIO()
+        call_command('seed_benchmark', '--users', '30', '--posts', '200',
+                     '--comments', '100', '--groups', '3', '--skip-search',
+                     stdout=out)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertTrue(Follow.objects.exists())
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark', '--requests', '3', '--warmup', '0',
+                         '--memory-requests', '1', '--mode', 'client',
+                         '--output', output, stdout=out, stderr=out)
+            with open(output, encoding='utf-8') as file:
+                report = json.load(file)
+        self.assertEqual(report['dataset']['posts'], 200)
+        results = report['results']['client']
+        self.assertEqual(set(results), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'post_create', 'add_comment',
+        })
+        for endpoint, result in results.items():
+            with self.subTest(endpoint=endpoint):
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+                self.assertIn('memory_peak_kb', result)
+
+    def test_seed_refuses_non_empty_database(self):
+        """Комментарии ссылаются на посты по диапазону id, поэтому
+        генератор работает только с пустой таблицей постов."""
+        user = User.objects.create_user(username='author')
+        Post.objects.create(author=user, text='Уже в базе')
+        with self.assertRaises(CommandError):
+            call_command('seed_benchmark', '--users', '2', '--posts', '2',
+                         '--comments', '2', '--skip-search',
+                         stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 1)
+
+
+class TransferTest(TestCase):
+    def setUp(self):
+        call_command('seed_benchmark', '--users', '20', '--posts', '60',
+                     '--comments', '40', '--groups', '3', '--skip-search',
+                     stdout=StringIO())
+        Group.objects.create(title='Новая', slug='new', description='')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    @staticmethod
+    def snapshot():
+        return {
+            'groups': set(Group.objects.values_list(
+                'slug', 'title', 'description', 'post_count')),
+            'posts': set(Post.objects.values_list(
+                'id', 'author__username', 'group__slug', 'text', 'pub_date',
+                'comment_count')),
+            'comments': set(Comment.objects.values_list(
+                'id', 'post', 'author__username', 'text', 'created')),
+            'follows': set(Follow.objects.values_list(
+                'user__username', 'author__username')),
+        }
+
+    def export_and_clear(self, *args):
+        call_command('export_data', self.directory.name, *args,
+                     stdout=StringIO())
+        Post.objects.all().delete()
+        Group.objects.all().delete()
+        Follow.objects.all().delete()
+
+    def test_round_trip(self):
+        """Выгрузка и загрузка сохраняют данные и связи через
+        естественные ключи, а счётчики пересчитываются."""
+        for format in transfer.FORMATS:
+            with self.subTest(format=format):
+                before = self.snapshot()
+                self.export_and_clear('--format', format, '--restart')
+                call_command('import_data', self.directory.name,
+                             '--format', format, '--restart',
+                             '--skip-search', stdout=StringIO())
+                self.assertEqual(self.snapshot(), before)
+
+    def test_restore_keeps_ids(self):
+        """По умолчанию строки возвращаются со своими id, уже имеющиеся
+        пропускаются, а подписки на себя отбрасываются."""
+        before = self.snapshot()
+        call_command('export_data', self.directory.name, stdout=StringIO())
+        Post.objects.order_by('pk').first().delete()
+        Follow.objects.all().delete()
+        username = User.objects.first().username
+        path = os.path.join(self.directory.name, 'follows.jsonl')
+        with open(path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({'user': username, 'author': username}))
+        out = StringIO()
+        call_command('import_data', self.directory.name, '--skip-search',
+                     stdout=out)
+        self.assertEqual(self.snapshot(), before)
+        self.assertIn(
+            f'follows: прочитано {len(before["follows"]) + 1}, '
+            f'сохранено {len(before["follows"])}', out.getvalue())
+
+    def test_append_into_non_empty_database(self):
+        """С --append строки с занятыми id получают новые id, комментарии
+        остаются у своих постов, а повторная загрузка ничего не
+        дублирует."""
+        def natural():
+            return {
+                'posts': set(Post.objects.values_list(
+                    'author__username', 'group__slug', 'text', 'pub_date',
+                    'comment_count')),
+                'comments': set(Comment.objects.values_list(
+                    'post__text', 'post__pub_date', 'author__username',
+                    'text', 'created')),
+            }
+
+        before = natural()
+        post_id = Post.objects.order_by('pk').first().pk
+        comment_id = Comment.objects.order_by('pk').first().pk
+        self.export_and_clear()
+        author = User.objects.first()
+        post = Post.objects.create(id=post_id, author=author, text='Свой')
+        comment = Comment.objects.create(
+            id=comment_id, post=post, author=author, text='Свой комментарий')
+        for _ in range(2):
+            call_command('import_data', self.directory.name, '--append',
+                         '--restart', '--skip-search', stdout=StringIO())
+        after = natural()
+        after['posts'].remove((author.username, None, 'Свой', post.pub_date,
+                               1))
+        after['comments'].remove(('Свой', post.pub_date, author.username,
+                                  'Свой комментарий', comment.created))
+        self.assertEqual(after, before)
+
+    def test_interrupted_import_resumes(self):
+        """Прерванная загрузка продолжается после последней пачки."""
+        before = self.snapshot()
+        self.export_and_clear('--batch-size', '7')
+        create = Comment.objects.bulk_create
+        calls = []
+
+        def fail_on_third(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return create(*args, **kwargs)
+
+        with mock.patch.object(Comment.objects, 'bulk_create',
+                               fail_on_third):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('import_data', self.directory.name,
+                             '--batch-size', '10', '--skip-search',
+                             stdout=StringIO())
+        self.assertEqual(Comment.objects.count(), 20)
+        out = StringIO()
+        call_command('import_data', self.directory.name, '--skip-search',
+                     stdout=out)
+        self.assertIn('comments: прочитано 20, сохранено 20', out.getvalue())
+        self.assertIn('posts: прочитано 0', out.getvalue())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_interrupted_export_resumes(self):
+        """Обрывок строки после сбоя выгрузки отрезается, новые строки
+        дописываются без повторов."""
+        call_command('export_data', self.directory.name, stdout=StringIO())
+        path = os.path.join(self.directory.name, 'posts.jsonl')
+        with open(path, 'ab') as file:
+            file.write(b'{"id": 99')
+        Post.objects.create(author=User.objects.first(), text='Новый пост')
+        call_command('export_data', self.directory.name, stdout=StringIO())
+        with open(path, encoding='utf-8') as file:
+            ids = [json.loads(line)['id'] for line in file]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), Post.objects.count())
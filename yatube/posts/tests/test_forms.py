@@ -1,8 +1,17 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from PIL import Image
 from posts.models import Post, Group, Comment
+from posts.thumbnails import generate_thumbnail
+from core.models import Job
+from core.tasks import Worker
 User = get_user_model()
 
 
@@ -147,3 +156,79 @@ class CommentFormTest(TestCase):
             )
         )
         self.assertEqual(CommentFormTest.comment.text, comment_data['text'])
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_INLINE=False)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='painter')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_thumbnail_generated_after_upload(self):
+        """Пока миниатюры нет, вместо неё показывается заглушка."""
+        image = SimpleUploadedFile(
+            name='small.gif',
+            content=(
+                b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                b'\x0A\x00\x3B'
+            ),
+            content_type='image/gif',
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С картинкой', 'image': image},
+        )
+        post = Post.objects.get(text='С картинкой')
+        self.assertTrue(post.image.name.startswith('posts/small'))
+        self.assertEqual(post.thumbnail_url, '')
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        self.assertContains(
+            self.authorized_client.get(url), 'Картинка обрабатывается'
+        )
+        self.assertTrue(Job.objects.filter(
+            name=generate_thumbnail.name, arguments=f'{{"args": [{post.pk}], '
+            '"kwargs": {}}').exists())
+        Worker().run(burst=True)
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.thumbnail_width, post.thumbnail_height), (960, 339)
+        )
+        response = self.authorized_client.get(url)
+        self.assertNotContains(response, 'Картинка обрабатывается')
+        self.assertContains(response, post.thumbnail_url)
+        self.assertContains(response, 'type="image/jpeg"')
+        self.assertContains(response, ' 960w')
+
+    @override_settings(POST_IMAGE_MAX_SIZE=100)
+    def test_upload_is_capped_and_stripped(self):
+        """Оригинал уменьшается и теряет EXIF при загрузке."""
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', (400, 40)).save(buffer, 'JPEG', exif=exif)
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Большая картинка',
+                'image': SimpleUploadedFile(
+                    'big.jpg', buffer.getvalue(), 'image/jpeg'
+                ),
+            },
+        )
+        post = Post.objects.get(text='Большая картинка')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 10))
+            self.assertFalse(image.getexif())
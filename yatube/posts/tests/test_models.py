@@ -1,7 +1,14 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from ..models import Group, Post
+from .. import counts
+from ..models import (Comment, Follow, Group, Post, TableCounter,
+                      UserCounter)
 
 User = get_user_model()
 
@@ -72,3 +79,151 @@ class GroupModelTest(TestCase):
         group = self.group
         expected_object_name = group.title
         self.assertEqual(expected_object_name, str(group))
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-slug',
+            description='Тестовое описание',
+        )
+
+    def counters(self):
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        return (
+            UserCounter.objects.get(user=self.user),
+            UserCounter.objects.get(user=self.reader),
+        )
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении объектов."""
+        post = Post.objects.create(
+            author=self.user, text='text', group=self.group
+        )
+        Comment.objects.create(author=self.reader, post=post, text='text')
+        follow = Follow.objects.create(user=self.reader, author=self.user)
+        author, reader = self.counters()
+        post.refresh_from_db()
+        self.assertEqual(author.post_count, 1)
+        self.assertEqual(author.follower_count, 1)
+        self.assertEqual(reader.following_count, 1)
+        self.assertEqual(self.group.post_count, 1)
+        self.assertEqual(post.comment_count, 1)
+
+        post.group = self.other_group
+        post.save()
+        self.counters()
+        self.assertEqual(self.group.post_count, 0)
+        self.assertEqual(self.other_group.post_count, 1)
+
+        follow.delete()
+        post.delete()
+        author, reader = self.counters()
+        self.assertEqual(author.post_count, 0)
+        self.assertEqual(author.follower_count, 0)
+        self.assertEqual(reader.following_count, 0)
+        self.assertEqual(self.other_group.post_count, 0)
+
+    def test_reconcile_counters(self):
+        """Команда reconcile_counters исправляет расхождения."""
+        Post.objects.create(author=self.user, text='text', group=self.group)
+        UserCounter.objects.filter(user=self.user).update(post_count=7)
+        Group.objects.filter(pk=self.group.pk).update(post_count=0)
+        UserCounter.objects.filter(user=self.reader).delete()
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        author, reader = self.counters()
+        self.assertEqual(author.post_count, 1)
+        self.assertEqual(reader.post_count, 0)
+        self.assertEqual(self.group.post_count, 1)
+        self.assertIn('UserCounter.post_count: расхождений 1', out.getvalue())
+
+
+class ApproximateCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        cls.post = Post.objects.create(author=cls.user, text='пост')
+        Comment.objects.create(post=cls.post, author=cls.user, text='да')
+
+    def rows(self, model):
+        return TableCounter.objects.get(table=model._meta.db_table).rows
+
+    def test_counter_follows_changes(self):
+        self.assertEqual(self.rows(Post), Post.objects.count())
+        self.assertEqual(self.rows(Comment), 1)
+        self.post.delete()
+        self.assertEqual(self.rows(Post), Post.objects.count())
+        self.assertEqual(self.rows(Comment), 0)
+
+    @override_settings(APPROX_COUNT_THRESHOLD=1000)
+    def test_large_table_is_estimated(self):
+        """Большая таблица считается по счётчику, выборка — точно."""
+        TableCounter.objects.filter(table='posts_post').update(rows=5000)
+        self.assertEqual(counts.approximate_count(Post.objects.all()),
+                         (5000, True))
+        self.assertEqual(counts.estimate(Post), (5000, True))
+        self.assertEqual(
+            counts.approximate_count(Post.objects.filter(author=self.user)),
+            (1, False),
+        )
+        TableCounter.objects.filter(table='posts_post').update(rows=5)
+        self.assertEqual(counts.approximate_count(Post.objects.all()),
+                         (1, False))
+        self.assertEqual(counts.estimate(Post), (5, False))
+
+    @override_settings(APPROX_COUNT_THRESHOLD=1000)
+    def test_admin_changelist_skips_count(self):
+        TableCounter.objects.filter(table='posts_post').update(rows=5000)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/posts/post/')
+        self.assertContains(response, '≈ 5000')
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] and '"posts_post"' in query['sql']
+            for query in queries.captured_queries
+        ))
+
+    def test_reconcile_fixes_table_counter(self):
+        TableCounter.objects.filter(table='posts_post').update(rows=40)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual(self.rows(Post), 1)
+        self.assertIn('TableCounter.posts_post: -39', out.getvalue())
+
+
+class FeedIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.author = User.objects.create_user(username='author')
+        group = Group.objects.create(title='title', slug='slug')
+        for i in range(12):
+            Post.objects.create(author=cls.author, text=f'пост {i}',
+                                group=group)
+
+    def test_follow_constraints(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.author)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.user)
+
+    def test_feed_queries_use_indexes(self):
+        """Ленты и их следующие страницы читаются по индексам."""
+        out = StringIO()
+        call_command('explain_views', '--allow', 'posts_group', stdout=out)
+        self.assertIn('index /: запросов', out.getvalue())
+        self.assertNotIn('полное сканирование', out.getvalue())
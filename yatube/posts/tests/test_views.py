@@ -1,10 +1,31 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
 from django.urls import reverse
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
 from django import forms
-from posts.models import Post, Group, Comment, Follow
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from posts import cache as posts_cache, loaders
+from posts.models import (Post, Group, Comment, Follow, TimelineEntry,
+                          UserCounter)
 
 User = get_user_model()
 
@@ -62,6 +83,115 @@ class PaginatorViewsTest(TestCase):
                 )
                 self.assertEqual(len(response.context['page_obj']), count)
 
+    def test_cursor_pages(self):
+        """Курсоры ?after=/?before= листают ленту без COUNT(*)."""
+        url = reverse('posts:index')
+        with CaptureQueriesContext(connection) as queries:
+            first = self.authorized_client.get(url).context['page_obj']
+            self.assertTrue(first.has_next())
+            second = self.authorized_client.get(
+                url + '?after=' + first.next_cursor
+            ).context['page_obj']
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] and 'posts_post' in query['sql']
+            for query in queries.captured_queries
+        ))
+        self.assertEqual(len(second), 3)
+        self.assertFalse(second.has_next())
+        self.assertEqual(second[0].text, 'Number of post - 3')
+        back = self.authorized_client.get(
+            url + '?before=' + second.previous_cursor
+        ).context['page_obj']
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+        # Число постов известно из счётчика: последняя страница — остаток.
+        last = self.authorized_client.get(url + '?page=last')
+        self.assertEqual(
+            list(last.context['page_obj']), Post.objects.order_by('pub_date')
+            [:3][::-1]
+        )
+        self.assertEqual(last.context['page_obj'].number, 2)
+
+    def test_page_window(self):
+        """Номера страниц — окно по счётчику или до следующей страницы."""
+        profile = reverse('posts:profile', kwargs={'username': self.user})
+        page = self.authorized_client.get(profile).context['page_obj']
+        self.assertEqual(page.paginator.page_window(page), [1, 2])
+        last = self.authorized_client.get(
+            profile + '?page=last').context['page_obj']
+        self.assertEqual((last.number, len(last)), (2, 3))
+        with self.settings(APPROX_COUNT_THRESHOLD=1):
+            index = self.authorized_client.get(reverse('posts:index'))
+            page = index.context['page_obj']
+            self.assertIsNone(page.paginator.total_pages)
+            self.assertEqual(page.paginator.page_window(page), [1, 2, None])
+            second = self.authorized_client.get(
+                reverse('posts:index') + f'?after={page.next_cursor}&page=2'
+            ).context['page_obj']
+        self.assertTrue(second.numbered)
+        self.assertEqual(second.paginator.page_window(second), [1, 2])
+        self.assertContains(index, 'page=2')
+        self.assertContains(index, 'Всего постов: ≈ 13')
+
+    def test_last_page_link_without_offset(self):
+        """Последний номер окна ведёт на ?page=last, а она без OFFSET."""
+        profile = reverse('posts:profile', kwargs={'username': self.user})
+        response = self.authorized_client.get(profile)
+        self.assertContains(response, '?page=last">2</a>')
+        self.assertNotContains(response, '?page=2"')
+        with CaptureQueriesContext(connection) as queries:
+            page = self.authorized_client.get(
+                profile + '?page=last').context['page_obj']
+        self.assertEqual((page.number, len(page)), (2, 3))
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'posts_post' in query['sql'] and 'OFFSET' in query['sql']
+        ])
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор не ломает страницу."""
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?after=garbage'
+        )
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_cursor_with_wrong_values(self):
+        """Курсор из null, чужих типов или лишних значений игнорируется."""
+        profile = reverse('posts:profile', kwargs={'username': self.user})
+        post = Post.objects.first()
+        # W251bGwsMV0 — это [null,1].
+        cursors = ['W251bGwsMV0', 'WzEsMl0', 'WyJ4Il0', 'eyJhIjoxfQ',
+                   'W3RydWUsMV0']
+        for cursor in cursors:
+            for url in (reverse('posts:index') + f'?after={cursor}',
+                        profile + f'?before={cursor}',
+                        reverse('posts:comment_list', args=[post.pk])
+                        + f'?after={cursor}'):
+                with self.subTest(url=url):
+                    self.assertEqual(
+                        self.authorized_client.get(url).status_code, 200)
+        response = self.authorized_client.get(
+            reverse('posts:index_feed', args=['json']) + '?after=W251bGwsMV0')
+        self.assertEqual(
+            len(json.loads(b''.join(response.streaming_content))['items']),
+            13)
+
+    def test_huge_page_number_gives_last_page(self):
+        """Номер страницы за концом ленты даёт последнюю страницу."""
+        number = '1' + '0' * 20
+        for url in (reverse('posts:index'),
+                    reverse('posts:profile', kwargs={'username': self.user}),
+                    reverse('posts:group_list',
+                            kwargs={'slug': self.group.slug})):
+            with self.subTest(url=url):
+                page = self.authorized_client.get(
+                    url + f'?page={number}').context['page_obj']
+                self.assertEqual((page.number, len(page)), (2, 3))
+        response = self.authorized_client.get(
+            reverse('posts:search'), {'q': 'post', 'page': number})
+        self.assertEqual(response.status_code, 200)
+
 
 class PostViewTest(TestCase):
     @classmethod
@@ -97,6 +227,7 @@ class PostViewTest(TestCase):
         self.authorized_client2.force_login(self.user_following)
         self.author_client = Client()
         self.author_client.force_login(PostViewTest.user)
+        self.guest_client = Client()
         cache.clear()
 
     def test_about_page_uses_correct_template(self):
@@ -178,6 +309,37 @@ class PostViewTest(TestCase):
         self.assertEqual(response.context['post'].image,
                          PostViewTest.post.image)
 
+    def test_conditional_get(self):
+        """Неизменившиеся пост и профиль отвечают 304 без рендеринга,
+        а изменение или другой пользователь дают новую страницу."""
+        pages = (
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('posts:profile', args=[self.user.username]),
+        )
+        for url in pages:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                etag = response['ETag']
+                self.assertIn('Cookie', response['Vary'])
+                self.assertIn('private', response['Cache-Control'])
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.authorized_client.get(
+                        url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertIsNone(response.context)
+                # Сессия, пользователь, id объекта и версия из общего кэша.
+                self.assertLessEqual(len(queries), 4)
+                response = self.authorized_client2.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+        Comment.objects.create(post=self.post, author=self.user_following,
+                               text='Новый комментарий')
+        response = self.authorized_client.get(
+            pages[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новый комментарий')
+
     def test_create_post(self):
         """Шаблон create_post сформирован с правильным контекстом."""
         response = self.authorized_client.get(reverse('posts:post_create'))
@@ -231,21 +393,47 @@ class PostViewTest(TestCase):
         self.assertIsInstance(form_field, forms.fields.CharField)
 
     def test_cache_index_page(self):
-        """Тест кэширования главной страницы."""
+        """Главная страница кэшируется до изменения постов."""
         response1 = self.authorized_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(text='changed')
+        response2 = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(response1.content, response2.content)
         Post.objects.create(
             author=self.user,
             text='test-text',
             group=self.group
         )
-        response2 = self.authorized_client.get(reverse('posts:index'))
-        self.assertEqual(response1.content, response2.content)
-        cache.clear()
         response3 = self.authorized_client.get(reverse('posts:index'))
         self.assertNotEqual(response3.content, response1.content)
         self.assertEqual(response3.context['page_obj'][0].text, 'test-text')
         self.assertEqual(len(response3.context['page_obj'].object_list), 2)
 
+    def test_cache_fragments_invalidated(self):
+        """Фрагменты страниц сбрасываются при изменении их содержимого."""
+        urls = (
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='stale text')
+        Comment.objects.bulk_create(
+            [Comment(post=self.post, author=self.user, text='скрытый')]
+        )
+        for url in urls[:2]:
+            with self.subTest(url=url):
+                self.assertNotContains(self.guest_client.get(url),
+                                       'stale text')
+        self.assertNotContains(self.guest_client.get(urls[2]), 'скрытый')
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'fresh text'
+        post.save()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.guest_client.get(url), 'fresh text')
+        self.assertContains(self.guest_client.get(urls[2]), 'скрытый')
+
     def test_follow_to_author(self):
         """"Тест подписки отписки от автора."""
         profile_rct = reverse('posts:profile',
@@ -284,6 +472,673 @@ class PostViewTest(TestCase):
             text=self.post.text))
 
 
+class TimelineTest(TestCase):
+    """Лента подписок заполняется при записи."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.old_post = Post.objects.create(author=cls.author, text='old')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def follow_page(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_fan_out_and_unfollow(self):
+        self.client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}
+        ))
+        self.assertEqual(self.follow_page(), [self.old_post])
+        new_post = Post.objects.create(author=self.author, text='new')
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post
+        ).exists())
+        self.assertEqual(self.follow_page(), [new_post, self.old_post])
+        self.client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}
+        ))
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader
+        ).exists())
+        self.assertEqual(self.follow_page(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_author_merged_on_read(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='new')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.follow_page(), [new_post, self.old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_author_back_under_limit_keeps_posts(self):
+        """Посты, вышедшие, пока автор был за лимитом, остаются в ленте,
+        когда после отписки он возвращается к раскладке."""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        follow = Follow.objects.create(user=other, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='new')
+        self.assertFalse(TimelineEntry.objects.filter(post=new_post).exists())
+        follow.delete()
+        self.assertTrue(UserCounter.objects.get(user=self.author).fanned_out)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post
+        ).exists())
+        self.assertEqual(self.follow_page(), [new_post, self.old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_merged_pages_follow_key_order(self):
+        """Лента вместе с автором на merge on read листается курсором и
+        номером страницы без пропусков и повторов."""
+        popular = User.objects.create_user(username='popular')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=popular)
+        # Разложен, пока у автора был один подписчик.
+        Post.objects.create(author=popular, text='early')
+        Follow.objects.create(
+            user=User.objects.create_user(username='fan'), author=popular)
+        for i in range(15):
+            Post.objects.create(
+                author=popular if i % 2 else self.author, text=str(i))
+        expected = list(Post.objects.filter(
+            author__in=[self.author, popular]
+        ).order_by('-pub_date', '-id'))
+        url = reverse('posts:follow_index')
+        page = self.client.get(url).context['page_obj']
+        found = list(page)
+        while page.has_next():
+            page = self.client.get(
+                url, {'after': page.next_cursor}).context['page_obj']
+            found.extend(page)
+        self.assertEqual(found, expected)
+        second = self.client.get(url, {'page': 2}).context['page_obj']
+        self.assertEqual(list(second), expected[10:])
+        first = self.client.get(
+            url, {'before': second.previous_cursor}).context['page_obj']
+        self.assertEqual(list(first), expected[:10])
+
+
+class SearchTest(TestCase):
+    """Полнотекстовый поиск по постам и комментариям."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.cats = Post.objects.create(
+            author=cls.user, text='Коты гуляют по крышам')
+        cls.dogs = Post.objects.create(author=cls.user, text='Про собак')
+        Comment.objects.create(
+            author=cls.user, post=cls.dogs, text='А котёнок сидит на крыше')
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params})
+        return response.context['page_obj']
+
+    def test_stemmed_search_covers_comments(self):
+        self.assertCountEqual(self.search('крыша'), [self.cats, self.dogs])
+        self.assertEqual(list(self.search('собаки')), [self.dogs])
+        self.assertEqual(list(self.search('котенок')), [self.dogs])
+        self.assertEqual(list(self.search('')), [])
+
+    def test_index_follows_edits(self):
+        post = Post.objects.get(pk=self.cats.pk)
+        post.text = 'Птицы'
+        post.save()
+        self.assertEqual(list(self.search('гуляют')), [])
+        self.assertEqual(list(self.search('птица')), [post])
+        Post.objects.get(pk=self.dogs.pk).delete()
+        self.assertEqual(list(self.search('котенок')), [])
+
+    def test_ranked_pages_by_cursor(self):
+        Post.objects.bulk_create(
+            Post(author=self.user, text='слово ' * (i % 3 + 1))
+            for i in range(15)
+        )
+        call_command('rebuild_search_index', stdout=StringIO())
+        page = self.search('слово')
+        found = list(page)
+        while page.has_next():
+            page = self.search('слово', after=page.next_cursor)
+            found.extend(page)
+        self.assertEqual(len(found), 15)
+        self.assertEqual(len(set(found)), 15)
+        ranks = [post.search_rank for post in found]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+    def test_admin_search(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'кот'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.cats])
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'крыши'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class FeedTest(TestCase):
+    ATOM = '{http://www.w3.org/2005/Atom}'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(
+            title='Лента', slug='feed', description='Описание')
+        for number in range(3):
+            Post.objects.create(author=cls.user, group=cls.group,
+                                text=f'Пост ленты {number} <&>')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if response.status_code == 200:
+            self.assertTrue(response.streaming)
+            response.body = b''.join(response.streaming_content)
+        return response
+
+    def test_formats(self):
+        """Ленты главной, группы и профиля в JSON Feed, RSS и Atom."""
+        urls = (
+            ('posts:index_feed', []),
+            ('posts:group_feed', [self.group.slug]),
+            ('posts:profile_feed', [self.user.username]),
+        )
+        for name, args in urls:
+            with self.subTest(name=name):
+                response = self.get(reverse(name, args=args + ['json']))
+                self.assertEqual(response['Content-Type'],
+                                 'application/feed+json; charset=utf-8')
+                items = json.loads(response.body)['items']
+                self.assertEqual(items[0]['content_text'],
+                                 'Пост ленты 2 <&>')
+                self.assertEqual(items[0]['tags'], ['Лента'])
+
+                response = self.get(reverse(name, args=args + ['rss']))
+                channel = ElementTree.fromstring(response.body)[0]
+                self.assertEqual(len(channel.findall('item')), 3)
+
+                response = self.get(reverse(name, args=args + ['atom']))
+                feed = ElementTree.fromstring(response.body)
+                self.assertEqual(
+                    feed.find(f'{self.ATOM}entry/{self.ATOM}content').text,
+                    'Пост ленты 2 <&>')
+
+    @override_settings(FEED_PAGE_SIZE=2)
+    def test_cursor_pages(self):
+        """Следующая страница — по ссылке next с курсором."""
+        response = self.get(reverse('posts:index_feed', args=['json']))
+        feed = json.loads(response.body)
+        self.assertEqual(len(feed['items']), 2)
+        feed = json.loads(self.get(feed['next_url']).body)
+        self.assertEqual([item['content_text'] for item in feed['items']],
+                         ['Пост ленты 0 <&>'])
+        self.assertNotIn('next_url', feed)
+
+        response = self.get(reverse('posts:index_feed', args=['atom']))
+        next_link = ElementTree.fromstring(response.body).find(
+            f'{self.ATOM}link[@rel="next"]')
+        feed = ElementTree.fromstring(self.get(next_link.get('href')).body)
+        self.assertEqual(len(feed.findall(f'{self.ATOM}entry')), 1)
+
+    def test_conditional_get(self):
+        """Неизменившаяся лента отвечает 304, новый пост меняет ETag."""
+        url = reverse('posts:group_feed', args=[self.group.slug, 'rss'])
+        response = self.get(url)
+        etag = response['ETag']
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertEqual(
+            self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        ).status_code, 304)
+        Post.objects.filter(text__startswith='Пост ленты 1').first().save()
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @mock.patch('posts.feeds.current_replica', return_value='replica1')
+    def test_replica_feed_without_validators(self, current_replica):
+        """Лента из реплики не получает ETag и Last-Modified."""
+        response = self.get(reverse('posts:index_feed', args=['rss']))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.get(
+            reverse('posts:index_feed', args=['rss']), HTTP_IF_NONE_MATCH='*',
+        ).status_code, 200)
+
+    def test_unknown_format_and_method(self):
+        self.assertEqual(self.client.get('/feed.xml').status_code, 404)
+        self.assertEqual(self.client.post(
+            reverse('posts:index_feed', args=['json'])).status_code, 405)
+
+
+class CommentPagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='commenter')
+        cls.post = Post.objects.create(author=cls.user, text='Обсуждаемый')
+        for number in range(45):
+            Comment.objects.create(post=cls.post, author=cls.user,
+                                   text=f'Комментарий №{number:02}')
+
+    def setUp(self):
+        cache.clear()
+
+    def comments(self, response):
+        content = response.content.decode()
+        return [number for number in range(45)
+                if f'Комментарий №{number:02}' in content]
+
+    def more_link(self, response):
+        match = re.search(r'data-fragment="([^"]+)"',
+                          response.content.decode())
+        return match and match.group(1).replace('&amp;', '&')
+
+    def test_first_page_inline_then_fragments(self):
+        """На странице поста первые комментарии, остальные — порциями
+        по ссылке «Показать ещё» от старых к новым."""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        self.assertContains(response, 'Комментариев: 45')
+        self.assertEqual(self.comments(response), list(range(20)))
+        response = self.client.get(self.more_link(response))
+        self.assertTemplateUsed(response, 'includes/comment_list.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertEqual(self.comments(response), list(range(20, 40)))
+        response = self.client.get(self.more_link(response))
+        self.assertEqual(self.comments(response), list(range(40, 45)))
+        self.assertIsNone(self.more_link(response))
+
+    def test_page_without_javascript(self):
+        """Без JS ссылка открывает страницу поста со следующей порцией."""
+        page = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        cursor = re.search(r'comments_after=([^#"]+)',
+                           page.content.decode()).group(1)
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]),
+            {'comments_after': cursor})
+        self.assertEqual(self.comments(response), list(range(20, 40)))
+
+    def test_query_count_does_not_depend_on_comments(self):
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, text='ещё')
+            for _ in range(100))
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(before), len(after))
+
+
+class PostCardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='carder')
+        self.client.force_login(self.user)
+        self.posts = [
+            Post.objects.create(author=self.user, text=f'Карточка {i}')
+            for i in range(3)
+        ]
+
+    def render_cards(self):
+        with mock.patch('posts.cache.render_to_string',
+                        wraps=render_to_string) as render:
+            cards = posts_cache.post_cards(Post.objects.feed())
+        return cards, render.call_count
+
+    def test_edit_renders_only_its_card(self):
+        """Карточки берутся из кэша, правка поста перерисовывает одну."""
+        self.assertEqual(self.render_cards()[1], 3)
+        self.assertEqual(self.render_cards()[1], 0)
+        self.client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.posts[0].pk}),
+            data={'text': 'Исправленная карточка'},
+        )
+        cards, rendered = self.render_cards()
+        self.assertEqual(rendered, 1)
+        self.assertIn('Исправленная карточка', dict(cards)[self.posts[0]])
+
+    def test_pages_share_cards(self):
+        """Карточки, собранные для главной, профиль берёт из кэша."""
+        response = self.client.get(reverse('posts:index'))
+        self.assertTemplateUsed(response, 'includes/post_card.html')
+        self.assertContains(response, 'Читать далее...', count=3)
+        response = self.client.get(
+            reverse('posts:profile', args=[self.user.username]))
+        self.assertTemplateNotUsed(response, 'includes/post_card.html')
+        self.assertContains(response, 'Читать далее...', count=3)
+
+
+class LoaderTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='loaded')
+        self.group = Group.objects.create(
+            title='Загружаемая', slug='loaded', description='Группа')
+        self.posts = [
+            Post.objects.create(
+                author=self.user, group=self.group, text=f'Пост {i}')
+            for i in range(3)
+        ]
+        self.pks = [post.pk for post in reversed(self.posts)]
+
+    def test_second_load_comes_from_cache(self):
+        """Посты, авторы и группы читаются из базы один раз."""
+        loaded = loaders.load_posts(self.pks)
+        self.assertEqual([post.pk for post in loaded], self.pks)
+        with CaptureQueriesContext(connection) as queries:
+            loaded = loaders.load_posts(self.pks)
+        self.assertFalse([
+            query for query in queries
+            if 'posts_' in query['sql'] or 'auth_user' in query['sql']
+        ])
+        self.assertEqual(loaded[0].author.username, 'loaded')
+        self.assertEqual(loaded[0].group.slug, 'loaded')
+
+    def test_edit_invalidates_loaded_post(self):
+        """Правка поста и автора даёт их записям в кэше новые ключи."""
+        loaders.load_posts(self.pks)
+        post = self.posts[0]
+        post.text = 'Исправленный пост'
+        post.save()
+        self.user.first_name = 'Лев'
+        self.user.save()
+        loaded = loaders.load_posts([post.pk])[0]
+        self.assertEqual(loaded.text, 'Исправленный пост')
+        self.assertEqual(loaded.author.first_name, 'Лев')
+
+    def test_version_bump_from_other_process_visible(self):
+        """Версия не задерживается в L1: сброс, сделанный другим
+        процессом в общем кэше, виден сразу."""
+        post = loaders.PostLoader().load(self.pks[0])
+        scope = posts_cache.post_scope(post.pk)
+        before = posts_cache.get_version(scope)
+        caches['shared'].incr(f'posts:version:{scope}')
+        self.assertNotEqual(posts_cache.get_version(scope), before)
+
+    def test_stale_read_does_not_outlive_write(self):
+        """Строка, прочитанная до записи, не переживает сброс версии."""
+        post = self.posts[0]
+        loader = loaders.PostLoader()
+        select = loader.select
+
+        def select_then_write(pks):
+            rows = select(pks)
+            # Чужая запись фиксируется между чтением и записью в кэш.
+            Post.objects.filter(pk=post.pk).update(text='Новый текст')
+            posts_cache.bump(posts_cache.post_scope(post.pk))
+            return rows
+
+        with mock.patch.object(loader, 'select', select_then_write):
+            self.assertEqual(loader.load(post.pk).text, post.text)
+        self.assertEqual(
+            loaders.PostLoader().load(post.pk).text, 'Новый текст')
+
+    def test_deleted_post_is_skipped(self):
+        self.posts[1].delete()
+        self.assertEqual(
+            [post.pk for post in loaders.load_posts(self.pks)],
+            [self.pks[0], self.pks[2]])
+
+    def test_request_memo(self):
+        """В одном запросе загрузчик не читает кэш повторно."""
+        loader = loaders.PostLoader()
+        loader.load(self.pks[0])
+        with mock.patch('posts.loaders.cache.get_many') as get_many:
+            self.assertEqual(loader.load(self.pks[0]).pk, self.pks[0])
+        get_many.assert_not_called()
+
+    def test_single_flight(self):
+        """Ключ, который уже грузится, другие потоки из базы не читают."""
+        rows = loaders.PostLoader().select(self.pks[:1])
+        started, release = threading.Event(), threading.Event()
+        waiting = threading.Semaphore(0)
+        calls = []
+
+        def select(loader, pks):
+            calls.append(pks)
+            started.set()
+            release.wait(5)
+            return rows
+
+        class Done(threading.Event):
+            def wait(self, timeout=None):
+                waiting.release()
+                return super().wait(timeout)
+
+        class Flight(loaders.Flight):
+            def __init__(self):
+                super().__init__()
+                self.done = Done()
+
+        results = []
+
+        def load():
+            results.append(loaders.PostLoader().load(self.pks[0]))
+
+        # Потоки не видят незакоммиченных данных теста, поэтому кэш и
+        # чтение из базы здесь подменены.
+        shared = mock.Mock(**{'get_many.return_value': {}})
+        versions = mock.Mock(
+            side_effect=lambda scopes: dict.fromkeys(scopes, 1))
+        with mock.patch('posts.loaders.cache', shared), \
+                mock.patch('posts.cache.get_versions', versions), \
+                mock.patch.object(loaders, 'Flight', Flight), \
+                mock.patch.object(loaders.PostLoader, 'select', select):
+            threads = [threading.Thread(target=load) for _ in range(10)]
+            threads[0].start()
+            self.assertTrue(started.wait(5))
+            for thread in threads[1:]:
+                thread.start()
+            for thread in threads[1:]:
+                self.assertTrue(waiting.acquire(timeout=5))
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        shared.set_many.assert_called_once()
+        self.assertEqual([post.pk for post in results], self.pks[:1] * 10)
+
+
+@mock.patch('posts.cache.cache', LocMemCache('stale', {}))
+class StaleWhileRevalidateTest(TestCase):
+    """Устаревшая запись отдаётся, пока её пересчитывает один запрос."""
+    REQUESTS = 200
+
+    def setUp(self):
+        posts_cache.cache.clear()
+
+    def run_concurrently(self, function):
+        barrier = threading.Barrier(self.REQUESTS)
+        results = []
+
+        def run():
+            barrier.wait()
+            results.append(function())
+
+        threads = [threading.Thread(target=run) for _ in range(self.REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_page_rendered_once(self):
+        """200 одновременных запросов к пустому кэшу рендерят страницу раз.
+        """
+        calls = []
+
+        @posts_cache.cache_page_versioned(lambda request: [posts_cache.INDEX])
+        def view(request):
+            calls.append(request)
+            time.sleep(0.2)
+            return HttpResponse('Страница')
+
+        request = RequestFactory().get('/')
+        responses = self.run_concurrently(lambda: view(request))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            {response.content.decode() for response in responses},
+            {'Страница'})
+
+    def test_stale_served_while_regenerating(self):
+        """После смены версии старое значение отдаётся всем, кроме одного.
+        """
+        posts_cache.remember('hot', lambda: 'старое', version=1)
+        regenerated = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            # Пока идёт пересчёт, остальные запросы уже получили ответ.
+            regenerated.wait(5)
+            return 'новое'
+
+        stale = []
+        lock = threading.Lock()
+
+        def get():
+            value = posts_cache.remember('hot', compute, version=2)
+            if value == 'старое':
+                with lock:
+                    stale.append(value)
+                    if len(stale) == self.REQUESTS - 1:
+                        regenerated.set()
+            return value
+
+        results = self.run_concurrently(get)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results.count('новое'), 1)
+        self.assertEqual(results.count('старое'), self.REQUESTS - 1)
+        self.assertEqual(
+            posts_cache.remember('hot', compute, version=2), 'новое')
+
+    def test_early_expiry(self):
+        """Запись близко к сроку иногда пересчитывается заранее."""
+        posts_cache.cache.set(
+            'early', ('старое', None, time.time() + 10, 1.0), 60)
+        with mock.patch('posts.cache.random.random', return_value=0):
+            self.assertEqual(
+                posts_cache.remember('early', lambda: 'новое'), 'старое')
+        with mock.patch('posts.cache.random.random',
+                        return_value=1 - 1e-9):
+            self.assertEqual(
+                posts_cache.remember('early', lambda: 'новое'), 'новое')
+
+    def test_replica_read_not_cached(self):
+        """Прочитанное из реплики не кэшируется и старое не отдаётся."""
+        posts_cache.remember('page', lambda: 'старое', version=1)
+        with mock.patch('posts.cache.current_replica',
+                        return_value='replica1'):
+            self.assertEqual(
+                posts_cache.remember('page', lambda: 'реплика', version=2),
+                'реплика')
+            self.assertEqual(
+                posts_cache.remember('page', lambda: 'реплика', version=1),
+                'старое')
+        self.assertEqual(
+            posts_cache.remember('page', lambda: 'основная', version=2),
+            'основная')
+
+    def test_template_tag(self):
+        template = Template(
+            '{% load stale_cache %}'
+            '{% stale_cache 60 fragment key version=version %}'
+            '{{ text }}{% endstale_cache %}'
+        )
+
+        def render(**context):
+            return template.render(Context(
+                dict({'key': 1, 'version': 1, 'text': 'старый'}, **context)))
+
+        self.assertEqual(render(), 'старый')
+        self.assertEqual(render(text='новый'), 'старый')
+        self.assertEqual(render(text='новый', version=2), 'новый')
+        self.assertEqual(render(text='другой', key=2), 'другой')
+
+
+class StaleWhileRevalidateBackendTest(SimpleTestCase):
+    """Пересчёт под настроенным кэшем: ``TieredCache`` над
+    ``DatabaseCache``, таблица которого — в отдельной базе ``cache``.
+
+    Потоки ходят в файл SQLite каждый через своё соединение, как воркеры;
+    тестовая база в памяти с транзакцией ``TestCase`` так не умеет.
+    """
+    databases = {'cache'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases['cache'] = {
+            'ENGINE': 'core.sqlite3',
+            'NAME': os.path.join(cls.directory.name, 'cache.sqlite3'),
+            'OPTIONS': settings.SQLITE_OPTIONS,
+        }
+        connections.ensure_defaults('cache')
+        connections.prepare_test_settings('cache')
+        super().setUpClass()
+        call_command('createcachetable', database='cache', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['cache'].close()
+        del connections['cache']
+        del connections.databases['cache']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_concurrent_misses_render_once(self):
+        """Два одновременных промаха по странице рендерят её один раз."""
+        calls = []
+        barrier = threading.Barrier(2)
+        responses = []
+
+        @posts_cache.cache_page_versioned(lambda request: [posts_cache.INDEX])
+        def view(request):
+            calls.append(request)
+            time.sleep(0.2)
+            return HttpResponse('Страница')
+
+        def run():
+            try:
+                barrier.wait()
+                responses.append(view(RequestFactory().get('/')))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            [response.content.decode() for response in responses],
+            ['Страница', 'Страница'])
+        with connections['cache'].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM yatube_cache')
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+
 class PagesError(TestCase):
     def setUp(self):
         self.client = Client()
@@ -293,3 +1148,48 @@ class PagesError(TestCase):
         response = self.client.get('/unexisting_page/')
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class QueryCountTest(TestCase):
+    """Число запросов не зависит от количества записей на странице."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.user, text='text')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def add_posts(self, start, stop):
+        for i in range(start, stop):
+            author = User.objects.create_user(username=f'author-{i}')
+            group = Group.objects.create(
+                title=f'title-{i}', slug=f'slug-{i}', description='-'
+            )
+            Post.objects.create(author=author, text=f'text-{i}', group=group)
+            Follow.objects.create(user=self.user, author=author)
+            Comment.objects.create(
+                author=author, post=self.post, text=f'comment-{i}'
+            )
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.get(url)
+        return len(queries)
+
+    def test_feed_query_count_is_constant(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+        self.add_posts(0, 1)
+        small = {url: self.count_queries(url) for url in urls}
+        self.add_posts(1, 9)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), small[url])
@@ -0,0 +1,127 @@
+"""Фоновая генерация миниатюр для картинок постов.
+
+Раньше миниатюра строилась тегом ``{% thumbnail %}`` прямо во время
+рендеринга страницы. Теперь после сохранения картинки через ``PostForm``
+миниатюра строится фоновой задачей (``core.tasks``), а шаблоны берут
+готовый адрес и размеры из полей поста; пока миниатюры нет,
+показывается заглушка.
+
+Кроме основной миниатюры строятся варианты нескольких ширин
+(``POST_IMAGE_WIDTHS``) в WebP, если Pillow его умеет, и в JPEG — из них
+собирается ``srcset`` для ``<picture>``. Оригинал при загрузке
+поворачивается по EXIF, лишается метаданных и уменьшается до
+``POST_IMAGE_MAX_SIZE`` по большей стороне.
+"""
+import json
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from PIL import Image, ImageOps, features
+from sorl.thumbnail import get_thumbnail
+
+from core import perf
+from core.tasks import task
+
+from . import cache
+from .models import Post
+
+THUMBNAIL_WIDTH = 960
+THUMBNAIL_HEIGHT = 339
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+
+def image_formats():
+    """Форматы вариантов в порядке предпочтения; JPEG есть всегда.
+
+    AVIF не строится: sorl-thumbnail не знает такого расширения.
+    """
+    if features.check('webp'):
+        return ('WEBP', 'JPEG')
+    return ('JPEG',)
+
+
+def make_thumbnail(image, width, image_format='JPEG'):
+    height = round(width * THUMBNAIL_HEIGHT / THUMBNAIL_WIDTH)
+    return get_thumbnail(
+        image, '{}x{}'.format(width, height),
+        format=image_format, **THUMBNAIL_OPTIONS
+    )
+
+
+def make_variants(image):
+    """Варианты картинки для ``srcset``, без увеличения сверх оригинала."""
+    widths = sorted(
+        width for width in settings.POST_IMAGE_WIDTHS
+        if width <= max(image.width, THUMBNAIL_WIDTH)
+    )
+    return [
+        (MIME_TYPES[image_format], [
+            (width, make_thumbnail(image, width, image_format).url)
+            for width in widths
+        ])
+        for image_format in image_formats()
+    ]
+
+
+@perf.timer('thumbnail')
+def prepare_upload(upload):
+    """Повернуть загруженную картинку по EXIF, убрать метаданные и
+    уменьшить до ``POST_IMAGE_MAX_SIZE``.
+
+    Анимированные картинки и файлы, которые не нужно менять,
+    возвращаются как есть.
+    """
+    if not isinstance(upload, UploadedFile):
+        return upload
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    upload.seek(0)
+    with Image.open(upload) as image:
+        image_format = image.format
+        if getattr(image, 'is_animated', False) or (
+            not image.getexif() and max(image.size) <= max_size
+        ):
+            upload.seek(0)
+            return upload
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        buffer = BytesIO()
+        options = {'quality': 90} if image_format == 'JPEG' else {}
+        image.save(buffer, format=image_format, exif=b'', **options)
+    return SimpleUploadedFile(
+        upload.name, buffer.getvalue(), upload.content_type
+    )
+
+
+@task
+@perf.timer('thumbnail')
+def generate_thumbnail(post_id):
+    """Построить миниатюру и варианты картинки поста и записать их."""
+    post = Post.objects.only(
+        'id', 'image', 'author', 'group'
+    ).filter(pk=post_id).first()
+    if post is None or not post.image:
+        return
+    thumbnail = make_thumbnail(post.image, THUMBNAIL_WIDTH)
+    updated = Post.objects.filter(
+        pk=post.pk, image=post.image.name
+    ).update(
+        thumbnail_url=thumbnail.url,
+        thumbnail_width=thumbnail.width,
+        thumbnail_height=thumbnail.height,
+        image_variants=json.dumps(make_variants(post.image)),
+    )
+    if updated:
+        cache.bump(
+            cache.INDEX,
+            cache.post_scope(post.pk),
+            cache.profile_scope(post.author_id),
+            cache.group_scope(post.group_id),
+        )
+
+
+def schedule_thumbnail(post):
+    """Поставить генерацию миниатюры в очередь задач."""
+    if post.image:
+        generate_thumbnail.delay(post.pk)
@@ -0,0 +1,258 @@
+"""Лента подписок, материализованная при записи (fan-out on write).
+
+Новый пост сразу раскладывается в ``TimelineEntry`` всех подписчиков
+автора, поэтому ``/follow/`` читает один диапазон индекса вместо
+соединения постов с подписками. Авторы, у которых подписчиков больше
+``TIMELINE_FANOUT_LIMIT``, не раскладываются: их посты подмешиваются
+в ленту при чтении (merge on read). Режим автора хранится в
+``UserCounter.fanned_out``: флаг снимается, когда раскладка или
+заполнение ленты застают автора за лимитом, и возвращается задачей
+``resume_fan_out``, которая сперва раскладывает посты по лентам всех
+подписчиков, — иначе посты, вышедшие в режиме merge on read, пропали
+бы из лент, как только автор вернётся под лимит.
+
+Раскладка нового поста и заполнение ленты при подписке идут фоновыми
+задачами (``fan_out_post`` и ``backfill_follow``), чтобы запрос не ждал
+тысяч вставок; отписка убирает посты из ленты сразу.
+"""
+import heapq
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from core.paginator import KeysetPaginator
+from core.tasks import task
+from yatube.settings import PST_ON_PAGE
+
+from .models import Follow, Post, TimelineEntry, UserCounter
+from .utils import get_page
+
+BATCH_SIZE = 500
+
+
+def _batches(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def is_fanned_out(author_id):
+    """Раскладываются ли посты автора по лентам.
+
+    Автора, у которого подписчиков стало больше лимита, здесь же
+    переводит на merge on read.
+    """
+    follower_count, fanned_out = UserCounter.objects.filter(
+        user_id=author_id
+    ).values_list('follower_count', 'fanned_out').first() or (0, True)
+    if fanned_out and follower_count > settings.TIMELINE_FANOUT_LIMIT:
+        UserCounter.objects.filter(user_id=author_id).update(
+            fanned_out=False)
+        return False
+    return fanned_out
+
+
+def fan_out(post):
+    """Добавить пост в ленты всех подписчиков автора."""
+    if not is_fanned_out(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    for batch in _batches(followers.iterator()):
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post.pk,
+                           pub_date=post.pub_date) for user_id in batch],
+            ignore_conflicts=True,
+        )
+
+
+def backfill(user_id, author_id):
+    """Заполнить ленту нового подписчика последними постами автора."""
+    if not is_fanned_out(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('pk', 'pub_date')[:settings.TIMELINE_BACKFILL]
+    for batch in _batches(posts.iterator()):
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+             for pk, pub_date in batch],
+            ignore_conflicts=True,
+        )
+
+
+@task(priority=10)
+def fan_out_post(post_id):
+    """Разложить пост по лентам, если его ещё не удалили."""
+    with transaction.atomic():
+        post = Post.objects.only(
+            'author', 'pub_date').filter(pk=post_id).first()
+        if post is not None:
+            fan_out(post)
+
+
+@task(priority=10)
+def backfill_follow(user_id, author_id):
+    """Заполнить ленту, если пользователь ещё не отписался."""
+    with transaction.atomic():
+        if Follow.objects.filter(
+                user_id=user_id, author_id=author_id).exists():
+            backfill(user_id, author_id)
+
+
+def backfill_followers(author_id):
+    """Заполнить ленты всех подписчиков автора его последними постами."""
+    alias = router.db_for_write(TimelineEntry)
+    tables = {
+        'entry': TimelineEntry._meta.db_table,
+        'follow': Follow._meta.db_table,
+        'post': Post._meta.db_table,
+    }
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {entry} (user_id, post_id, pub_date) '
+            'SELECT f.user_id, p.id, p.pub_date FROM {follow} f, ('
+            'SELECT id, pub_date FROM {post} WHERE author_id = %s '
+            'ORDER BY pub_date DESC, id DESC LIMIT %s'
+            ') p WHERE f.author_id = %s AND NOT EXISTS ('
+            'SELECT 1 FROM {entry} e '
+            'WHERE e.user_id = f.user_id AND e.post_id = p.id)'.format(
+                **tables),
+            [author_id, settings.TIMELINE_BACKFILL, author_id],
+        )
+
+
+@task(priority=10)
+def resume_fan_out(author_id):
+    """Вернуть автора к раскладке, если подписчиков снова не больше
+    лимита, и разложить его посты по лентам в той же транзакции."""
+    with transaction.atomic():
+        if UserCounter.objects.filter(
+            user_id=author_id,
+            fanned_out=False,
+            follower_count__lte=settings.TIMELINE_FANOUT_LIMIT,
+        ).update(fanned_out=True):
+            backfill_followers(author_id)
+
+
+def prune(user_id, author_id):
+    """Убрать из ленты посты автора, от которого отписались.
+
+    Если после отписки автор вернулся под лимит, ставится задача
+    ``resume_fan_out``.
+    """
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+    if UserCounter.objects.filter(
+        user_id=author_id,
+        fanned_out=False,
+        follower_count__lte=settings.TIMELINE_FANOUT_LIMIT,
+    ).exists():
+        resume_fan_out.delay(author_id)
+
+
+def rebuild():
+    """Перестроить все ленты заново одним ``INSERT ... SELECT``.
+
+    Нужно после массовой загрузки данных в обход сигналов; счётчики
+    подписчиков к этому моменту должны быть сверены
+    (``reconcile_counters``), по ним заново выбирается режим авторов.
+    Возвращает число записей в лентах.
+    """
+    alias = router.db_for_write(TimelineEntry)
+    counters = UserCounter.objects.using(alias)
+    counters.filter(
+        follower_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).update(fanned_out=False)
+    counters.filter(
+        follower_count__lte=settings.TIMELINE_FANOUT_LIMIT
+    ).update(fanned_out=True)
+    tables = {
+        'entry': TimelineEntry._meta.db_table,
+        'follow': Follow._meta.db_table,
+        'post': Post._meta.db_table,
+        'counter': UserCounter._meta.db_table,
+    }
+    with connections[alias].cursor() as cursor:
+        cursor.execute('DELETE FROM {entry}'.format(**tables))
+        cursor.execute(
+            'INSERT INTO {entry} (user_id, post_id, pub_date) '
+            'SELECT user_id, post_id, pub_date FROM ('
+            'SELECT f.user_id AS user_id, p.id AS post_id, '
+            'p.pub_date AS pub_date, ROW_NUMBER() OVER ('
+            'PARTITION BY f.id ORDER BY p.pub_date DESC, p.id DESC'
+            ') AS position '
+            'FROM {follow} f '
+            'JOIN {counter} c ON c.user_id = f.author_id '
+            'JOIN {post} p ON p.author_id = f.author_id '
+            'WHERE c.fanned_out'
+            ') ranked WHERE position <= %s'.format(**tables),
+            [settings.TIMELINE_BACKFILL],
+        )
+    return TimelineEntry.objects.using(alias).count()
+
+
+class TimelinePaginator(KeysetPaginator):
+    """Лента подписок, в которую подмешиваются авторы на merge on read.
+
+    Страница сливается из упорядоченных по ключу потоков: записей ленты
+    читателя (индекс ``(user, pub_date, post)``) и постов каждого такого
+    автора (индекс ``(author, pub_date, id)``). Из потока берётся не
+    больше записей, чем нужно странице, так что каждый запрос читает
+    короткий диапазон индекса.
+    """
+
+    def __init__(self, object_list, per_page, user, authors, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.user = user
+        self.authors = authors
+
+    def streams(self, values, reverse):
+        """Запросы пар (дата, id поста) после ``values`` в порядке ключа."""
+        entries = KeysetPaginator(
+            TimelineEntry.objects.filter(user=self.user), self.per_page,
+            key=('-pub_date', '-post_id'))
+        yield entries.seek(values, reverse).values_list('pub_date', 'post_id')
+        for author_id in self.authors:
+            posts = KeysetPaginator(
+                Post.objects.filter(author_id=author_id), self.per_page,
+                key=self.key)
+            yield posts.seek(values, reverse).values_list('pub_date', 'id')
+
+    def rows(self, values=None, reverse=False, offset=0):
+        limit = offset + self.per_page + 1
+        merged = heapq.merge(
+            *(list(stream[:limit])
+              for stream in self.streams(values, reverse)),
+            reverse=not reverse,
+        )
+        # Пост автора, разложенный до перехода на merge on read, есть в
+        # обоих потоках; в слиянии дубли стоят рядом.
+        post_ids = [pk for (_, pk), _ in groupby(merged)][offset:limit]
+        posts = self.object_list.in_bulk(post_ids)
+        return [posts[pk] for pk in post_ids if pk in posts]
+
+
+def get_timeline_page(request, user):
+    """Страница ленты подписок ``user`` в формате обычной ленты постов."""
+    celebrities = list(Follow.objects.filter(
+        user=user, author__counter__fanned_out=False,
+    ).values_list('author_id', flat=True))
+    entries = TimelineEntry.objects.filter(user=user)
+    if celebrities:
+        paginator = TimelinePaginator(
+            Post.objects.feed(), PST_ON_PAGE, user, celebrities)
+        return paginator.get_page(
+            request.GET.get('page'),
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+    page = get_page(request, entries.with_posts(),
+                    key=('-pub_date', '-post_id'))
+    page.object_list = [entry.post for entry in page.object_list]
+    return page
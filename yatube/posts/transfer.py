@@ -0,0 +1,368 @@
+"""Потоковая выгрузка и загрузка групп, постов, комментариев и подписок.
+
+Строки идут пачками по ``batch_size``, поэтому память не зависит от
+размера таблиц: выгрузка листает таблицу по первичному ключу, загрузка
+читает файл построчно и сохраняет пачку одним ``bulk_create``.
+
+Пользователи и группы записаны в файлах естественными ключами —
+username и slug — и при загрузке находятся или создаются. Посты и
+комментарии записаны со своими id, по ним комментарии ссылаются на
+посты. По умолчанию загрузка восстанавливает строки с этими же id, а
+строки, чьи id в базе уже заняты, пропускает (``ignore_conflicts``).
+Чтобы добавить выгрузку к базе, где уже есть свои посты, загрузка с
+``append`` прибавляет к id из файла наибольший id в базе: загруженные
+строки не сталкиваются с существующими, а комментарии попадают к своим
+постам. Сдвиг выбирается при первой такой загрузке каталога и хранится
+рядом с данными (``IDS_FILE``), поэтому повторная загрузка даёт те же
+id и пропускает уже загруженные строки.
+
+После каждой пачки ``Progress`` запоминает, до какого места дошли, и
+прерванная выгрузка или загрузка продолжается с этого места.
+"""
+import csv
+import io
+import json
+import os
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from .models import Comment, Follow, Group, Post, User
+
+BATCH_SIZE = 1000
+FORMATS = ('jsonl', 'csv')
+# Сдвиги id постов и комментариев при загрузке каталога.
+IDS_FILE = '.import-ids.json'
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Разрешить задавать поля с ``auto_now_add`` при ``bulk_create``."""
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def user_ids(usernames):
+    """id пользователей по username; недостающих создать без пароля."""
+    usernames = set(filter(None, usernames))
+    ids = dict(User.objects.filter(
+        username__in=usernames).values_list('username', 'pk'))
+    missing = usernames - ids.keys()
+    if missing:
+        User.objects.bulk_create((
+            User(username=username, password=make_password(None))
+            for username in missing
+        ), ignore_conflicts=True)
+        ids.update(User.objects.filter(
+            username__in=missing).values_list('username', 'pk'))
+    return ids
+
+
+def group_ids(slugs):
+    """id групп по slug; недостающих создать с slug вместо названия."""
+    slugs = set(filter(None, slugs))
+    ids = dict(Group.objects.filter(slug__in=slugs).values_list('slug', 'pk'))
+    missing = slugs - ids.keys()
+    if missing:
+        Group.objects.bulk_create((
+            Group(slug=slug, title=slug, description='') for slug in missing
+        ), ignore_conflicts=True)
+        ids.update(Group.objects.filter(
+            slug__in=missing).values_list('slug', 'pk'))
+    return ids
+
+
+def optional_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+class Table:
+    """Таблица в файле: колонки, их источники в базе и обратный путь."""
+    model = None
+    name = None
+    # Колонки файла и соответствующие им поля для values_list.
+    fields = ()
+    lookups = ()
+    # Сохраняются ли строки с id из файла (при append — со сдвигом).
+    keeps_ids = False
+
+    def objects(self, records, shifts):
+        """Объекты модели из записей файла; ``shifts`` — сдвиги id по
+        именам таблиц."""
+        raise NotImplementedError
+
+
+class Groups(Table):
+    model = Group
+    name = 'groups'
+    fields = lookups = ('slug', 'title', 'description')
+
+    def objects(self, records, shifts):
+        return [Group(**record) for record in records]
+
+
+class Posts(Table):
+    model = Post
+    name = 'posts'
+    fields = ('id', 'author', 'group', 'text', 'pub_date', 'image')
+    lookups = ('id', 'author__username', 'group__slug', 'text', 'pub_date',
+               'image')
+    keeps_ids = True
+
+    def objects(self, records, shifts):
+        authors = user_ids(record['author'] for record in records)
+        groups = group_ids(record['group'] for record in records)
+        return [
+            Post(
+                id=int(record['id']) + shifts['posts'],
+                author_id=authors[record['author']],
+                group_id=groups.get(record['group']),
+                text=record['text'],
+                pub_date=parse_datetime(record['pub_date']),
+                image=record['image'] or '',
+            )
+            for record in records
+        ]
+
+
+class Comments(Table):
+    model = Comment
+    name = 'comments'
+    fields = ('id', 'post', 'author', 'text', 'created')
+    lookups = ('id', 'post', 'author__username', 'text', 'created')
+    keeps_ids = True
+
+    def objects(self, records, shifts):
+        authors = user_ids(record['author'] for record in records)
+        # Комментарий к посту, которого нет в базе, нарушил бы внешний
+        # ключ и откатил всю пачку, поэтому такие пропускаются.
+        post_ids = [optional_int(record['post']) for record in records]
+        post_ids = [post_id and post_id + shifts['posts']
+                    for post_id in post_ids]
+        posts = set(Post.objects.filter(
+            pk__in=set(post_ids)).values_list('pk', flat=True))
+        posts.add(None)
+        return [
+            Comment(
+                id=int(record['id']) + shifts['comments'],
+                post_id=post_id,
+                author_id=authors.get(record['author']),
+                text=record['text'],
+                created=parse_datetime(record['created']),
+            )
+            for record, post_id in zip(records, post_ids)
+            if post_id in posts
+        ]
+
+
+class Follows(Table):
+    model = Follow
+    name = 'follows'
+    fields = ('user', 'author')
+    lookups = ('user__username', 'author__username')
+
+    def objects(self, records, shifts):
+        users = user_ids(
+            username for record in records
+            for username in (record['user'], record['author'])
+        )
+        # Подписку на себя запрещает ограничение в базе, и на
+        # PostgreSQL она откатила бы всю пачку.
+        pairs = (
+            (users[record['user']], users[record['author']])
+            for record in records
+        )
+        return [
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in pairs if user_id != author_id
+        ]
+
+
+# В порядке загрузки: сначала то, на что ссылаются.
+TABLES = (Groups(), Posts(), Comments(), Follows())
+
+
+def to_text(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class Lines:
+    """Строки файла, открытого в двоичном режиме, с позицией после
+    последней прочитанной — чтобы продолжить чтение с неё."""
+
+    def __init__(self, file):
+        self.file = file
+        self.offset = file.tell()
+
+    def __iter__(self):
+        for line in self.file:
+            self.offset += len(line)
+            yield line.decode('utf-8')
+
+
+def dump(format, fields, records):
+    """Пачка записей в виде байтов файла."""
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in records:
+            writer.writerow(['' if value is None else value
+                             for value in record])
+        text = buffer.getvalue()
+    else:
+        text = ''.join(
+            json.dumps(dict(zip(fields, record)), ensure_ascii=False) + '\n'
+            for record in records
+        )
+    return text.encode('utf-8')
+
+
+def load(format, fields, lines):
+    """Записи из строк файла."""
+    if format == 'csv':
+        for row in csv.reader(lines):
+            yield dict(zip(fields, row))
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Progress:
+    """Сделанная часть работы по каждому файлу, в JSON рядом с данными."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.state = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        elif os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                self.state = json.load(file)
+
+    def get(self, name):
+        return self.state.get(name, {})
+
+    def set(self, name, **values):
+        self.state[name] = values
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file)
+        os.replace(temporary, self.path)
+
+
+def path_of(directory, table, format):
+    return os.path.join(directory, f'{table.name}.{format}')
+
+
+def export_table(table, directory, format, progress, batch_size=BATCH_SIZE):
+    """Дописать в файл строки таблицы после выгруженных раньше.
+
+    Возвращает число выгруженных строк.
+    """
+    done = progress.get(table.name)
+    last, offset = done.get('last_pk', 0), done.get('offset', 0)
+    queryset = table.model.objects.order_by('pk')
+    exported = 0
+    with open(path_of(directory, table, format), 'a+b') as file:
+        # Всё, что дописано после последней сохранённой пачки, — обрывок.
+        file.truncate(offset)
+        if not offset and format == 'csv':
+            file.write(dump(format, table.fields, [table.fields]))
+        while True:
+            rows = list(queryset.filter(pk__gt=last).values_list(
+                'pk', *table.lookups)[:batch_size])
+            if not rows:
+                break
+            file.write(dump(format, table.fields, (
+                [to_text(value) for value in row[1:]] for row in rows
+            )))
+            file.flush()
+            os.fsync(file.fileno())
+            last = rows[-1][0]
+            exported += len(rows)
+            progress.set(table.name, last_pk=last, offset=file.tell())
+            # При DEBUG Django хранит тысячи последних запросов, а с
+            # пачкой вставок это сотни мегабайт.
+            reset_queries()
+    return exported
+
+
+def id_shifts(directory, table, append=False):
+    """Сдвиги id таблиц каталога.
+
+    Без ``append`` id не сдвигаются. С ним сдвиг ``table`` выбирается при
+    первой её загрузке: наибольший id в базе или 0, если таблица пуста.
+    """
+    if not append:
+        return {other.name: 0 for other in TABLES if other.keeps_ids}
+    shifts = Progress(os.path.join(directory, IDS_FILE))
+    if table.keeps_ids and not shifts.get(table.name):
+        last = table.model.objects.aggregate(last=Max('pk'))['last']
+        shifts.set(table.name, shift=last or 0)
+    return {
+        other.name: shifts.get(other.name).get('shift', 0)
+        for other in TABLES if other.keeps_ids
+    }
+
+
+def import_table(table, directory, format, progress, batch_size=BATCH_SIZE,
+                 append=False):
+    """Загрузить строки файла после загруженных раньше.
+
+    Возвращает число прочитанных строк и число сохранённых объектов;
+    строки, которые уже есть в базе, тоже считаются сохранёнными.
+    """
+    path = path_of(directory, table, format)
+    read = saved = 0
+    if not os.path.exists(path):
+        return read, saved
+    shifts = id_shifts(directory, table, append)
+    with open(path, 'rb') as file, explicit_dates(
+            Post._meta.get_field('pub_date'),
+            Comment._meta.get_field('created')):
+        file.seek(progress.get(table.name).get('offset', 0))
+        lines = Lines(file)
+        if format == 'csv' and not lines.offset:
+            next(iter(lines), None)
+        for batch in batches(load(format, table.fields, lines), batch_size):
+            with transaction.atomic():
+                objects = table.objects(batch, shifts)
+                table.model.objects.bulk_create(
+                    objects, ignore_conflicts=True)
+            read += len(batch)
+            saved += len(objects)
+            progress.set(table.name, offset=lines.offset)
+            reset_queries()
+    return read, saved
+
+
+def reset_sequences():
+    """Сдвинуть счётчики id после загрузки постов и комментариев с их id."""
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [Post, Comment])
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
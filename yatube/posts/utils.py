@@ -0,0 +1,38 @@
+from django.conf import settings
+
+from core.paginator import KeysetPaginator
+from yatube.settings import PST_ON_PAGE
+
+from . import loaders
+from .models import Comment
+
+
+def get_page(request, post_list, count=None, key=('-pub_date', '-id'),
+             estimated=False):
+    """Страница ленты постов по курсору ?after=/?before= или ?page=N."""
+    paginator = KeysetPaginator(post_list, PST_ON_PAGE, key=key, count=count,
+                                estimated=estimated)
+    return paginator.get_page(
+        request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+
+
+def get_post_page(request, posts, **kwargs):
+    """Страница постов: из базы только ключи страницы, сами посты с
+    авторами и группами — пачками из кэша (``posts.loaders``)."""
+    page = get_page(request, posts.only('id', 'pub_date'), **kwargs)
+    page.object_list = loaders.load_posts(
+        [post.pk for post in page.object_list])
+    return page
+
+
+def get_comment_page(post_id, after=None):
+    """Комментарии поста от старых к новым, страница после курсора."""
+    paginator = KeysetPaginator(
+        Comment.objects.filter(post_id=post_id).with_authors()
+        .order_by('created', 'id'),
+        settings.COMMENTS_ON_PAGE, key=('created', 'id'),
+    )
+    return paginator.get_page(after=after)
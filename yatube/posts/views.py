@@ -1,75 +1,176 @@
-from yatube.settings import PST_ON_PAGE
-from django.core.paginator import Paginator
+from functools import partial
+
+from django.http import Http404
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Post, Group, Follow, User
+from .models import Post, Group, Follow, User, UserCounter
 from .forms import PostForm, CommentForm
+from . import cache, counts, feeds, loaders
+from .search import get_search_page
+from .thumbnails import schedule_thumbnail
+from .timeline import get_timeline_page
+from .utils import get_comment_page, get_post_page
+from core.replicas import use_replicas
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.http import require_safe
+from django.views.decorators.vary import vary_on_cookie
 
 
-@cache_page(20, key_prefix='index_page')
+# Реплика выбирается снаружи кэша: страницу, прочитанную из неё,
+# cache_page_versioned не сохраняет.
+@use_replicas
+@cache.cache_page_versioned(lambda request: [cache.INDEX, cache.GROUPS])
+@vary_on_cookie
 def index(request):
     post_list = Post.objects.all()
-    paginator = Paginator(post_list, PST_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_count, estimated = counts.estimate(Post)
+    page_obj = get_post_page(request, post_list, count=post_count,
+                             estimated=estimated)
     context = {
         'page_obj': page_obj,
+        'post_count': post_count,
+        'post_count_estimated': estimated,
+        **cache.cache_context(cache.INDEX, cache.GROUPS),
     }
     return render(request, 'posts/index.html', context)
 
 
+@require_safe
+@use_replicas
+def index_feed(request, format):
+    return feeds.respond(
+        request, format, Post.objects.feed(), [cache.INDEX, cache.GROUPS],
+        title='Последние обновления на сайте', link=reverse('posts:index'),
+    )
+
+
+@use_replicas
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, PST_ON_PAGE)
-    page_num = request.GET.get('page')
-    page_obj = paginator.get_page(page_num)
+    # Не group.posts: он сверял бы group_id каждого поста с группой,
+    # а на странице из базы читаются только ключи.
+    posts = Post.objects.filter(group=group)
+    page_obj = get_post_page(request, posts, count=group.post_count)
     title = f'Записи сообщества <{group}>'
     context = {
         'group': group,
         'title': title,
         'page_obj': page_obj,
+        **cache.cache_context(cache.group_scope(group.pk), cache.GROUPS),
     }
     return render(request, template, context)
 
 
+@require_safe
+@use_replicas
+def group_feed(request, slug, format):
+    group = get_object_or_404(Group, slug=slug)
+    return feeds.respond(
+        request, format, group.posts.feed(),
+        [cache.group_scope(group.pk), cache.GROUPS],
+        title=f'Записи сообщества <{group}>',
+        link=reverse('posts:group_list', args=[slug]),
+    )
+
+
+def profile_scopes(request, username):
+    author_id = User.objects.filter(
+        username=username).values_list('pk', flat=True).first()
+    if author_id is None:
+        return None
+    return [cache.profile_scope(author_id), cache.GROUPS]
+
+
+@use_replicas
+@cache.etag_versioned(profile_scopes)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    post_count = post_list.count()
-    paginator = Paginator(post_list, PST_ON_PAGE)
-    page_num = request.GET.get('page')
-    page_obj = paginator.get_page(page_num)
+    author = get_object_or_404(
+        User.objects.select_related('counter'), username=username
+    )
+    counter = UserCounter.for_user(author)
+    post_list = Post.objects.filter(author=author)
+    page_obj = get_post_page(request, post_list, count=counter.post_count)
     following = False
     if (request.user.is_authenticated
         and Follow.objects.filter(author=author,
                                   user=request.user).exists()):
         following = True
     context = {
-        'post_count': post_count,
-        'paginator': paginator,
+        'post_count': counter.post_count,
+        'counter': counter,
+        'paginator': page_obj.paginator,
         'author': author,
         'page_obj': page_obj,
-        'following': following, }
+        'following': following,
+        **cache.cache_context(cache.profile_scope(author.pk), cache.GROUPS),
+    }
     return render(request, 'posts/profile.html', context)
 
 
+@require_safe
+@use_replicas
+def profile_feed(request, username, format):
+    author = get_object_or_404(User, username=username)
+    return feeds.respond(
+        request, format, author.posts.feed(),
+        [cache.profile_scope(author.pk), cache.GROUPS],
+        title=f'Записи пользователя {author.get_full_name() or author}',
+        link=reverse('posts:profile', args=[username]),
+    )
+
+
+def post_scopes(request, post_id):
+    author_id = Post.objects.filter(
+        pk=post_id).values_list('author_id', flat=True).first()
+    if author_id is None:
+        return None
+    return [cache.post_scope(post_id), cache.profile_scope(author_id),
+            cache.GROUPS]
+
+
+@use_replicas
+@cache.etag_versioned(post_scopes)
 def post_detail(request, post_id):
-    post_count = Post.objects.count()
-    post = get_object_or_404(Post, id=post_id)
+    posts = loaders.load_posts([post_id])
+    if not posts:
+        raise Http404
+    post = posts[0]
+    post_count = UserCounter.for_user(post.author).post_count
     form = CommentForm(request.POST or None)
-    comments = post.comments.all()
+    comments_after = request.GET.get('comments_after', '')
     context = {
         'post_count': post_count,
         'post': post,
         'form': form,
-        'comments': comments,
+        # Шаблон вызовет её, только если фрагмент не нашёлся в кэше.
+        'comment_page': partial(get_comment_page, post.pk, comments_after),
+        'comments_after': comments_after,
+        **cache.cache_context(
+            cache.post_scope(post.pk),
+            cache.profile_scope(post.author_id),
+            cache.GROUPS,
+        ),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@require_safe
+@use_replicas
+@cache.etag_versioned(lambda request, post_id: [cache.post_scope(post_id)])
+def comment_list(request, post_id):
+    """Следующая порция комментариев поста для догрузки на странице."""
+    after = request.GET.get('after', '')
+    context = {
+        'post_id': post_id,
+        'comment_page': partial(get_comment_page, post_id, after),
+        'comments_after': after,
+        **cache.cache_context(cache.post_scope(post_id)),
+    }
+    return render(request, 'includes/comment_list.html', context)
+
+
 @login_required
 def post_edit(request, post_id, is_edit=True):
     post = get_object_or_404(Post, pk=post_id)
@@ -82,6 +183,8 @@ def post_edit(request, post_id, is_edit=True):
     )
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            schedule_thumbnail(post)
         return redirect('posts:post_detail', post_id=post_id)
     context = {'form': form, 'is_edit': is_edit, 'post': post}
     return render(request, 'posts/create_post.html', context)
@@ -89,11 +192,12 @@ def post_edit(request, post_id, is_edit=True):
 
 @login_required
 def post_create(request):
-    form = PostForm(request.POST)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule_thumbnail(post)
         return redirect('posts:profile', username=request.user.username)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -111,18 +215,27 @@ def add_comment(request, post_id):
 
 
 @login_required
+@use_replicas
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, PST_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = get_timeline_page(request, request.user)
     context = {
         'page_obj': page_obj,
-        'paginator': paginator,
+        'paginator': page_obj.paginator,
     }
     return render(request, 'posts/follow.html', context)
 
 
+@use_replicas
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'page_obj': get_search_page(request, query),
+        'page_query': urlencode({'q': query}) + '&' if query else '',
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
@@ -0,0 +1,24 @@
+// Догрузка комментариев: ссылка «Показать ещё» заменяется следующей
+// порцией с /posts/<id>/comments/?after=...; без JS она открывает
+// страницу поста с этой порцией.
+document.addEventListener('click', function (event) {
+  var link = event.target.closest('a[data-fragment]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  link.classList.add('disabled');
+  fetch(link.dataset.fragment, {credentials: 'same-origin'})
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.status);
+      }
+      return response.text();
+    })
+    .then(function (html) {
+      link.closest('.comments-more').outerHTML = html;
+    })
+    .catch(function () {
+      window.location = link.href;
+    });
+});
@@ -62,7 +62,7 @@ urlpatterns = [
     path(
         'reset/done/',
         PasswordResetCompleteView.as_view(
-            template_name='users/password_reset_complete'),
+            template_name='users/password_reset_complete.html'),
         name='password_reset_complete'
     )
 ]
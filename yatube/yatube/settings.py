@@ -44,13 +44,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'posts',
+    'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
-    'core',
+    'core.apps.CoreConfig',
     'sorl.thumbnail',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
+    'core.replicas.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,7 +66,7 @@ ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -85,13 +87,65 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# SQLite под конкурентную запись (см. core.sqlite3): журнал WAL, чтобы
+# чтение не ждало записи; synchronous=NORMAL — в WAL это fsync только
+# на контрольной точке, и при сбое питания теряются лишь последние
+# транзакции, а не целостность; транзакции берут блокировку записи
+# сразу и идут по одной на процесс.
+SQLITE_OPTIONS = {
+    'pragmas': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'transaction_mode': 'IMMEDIATE',
+    'serialize_writes': True,
+}
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': SQLITE_OPTIONS,
+        # Постоянные соединения: прагмы и открытие файла — раз в минуту
+        # на поток, а не на каждый запрос.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Реплики для чтения: пути к файлам SQLite через запятую в DB_REPLICAS.
+# Локально это копии основной базы, которые обновляет
+# python manage.py sync_replicas (см. core.replicas).
+REPLICA_DATABASES = []
+for number, name in enumerate(
+        filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    REPLICA_DATABASES.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'core.sqlite3',
+        'NAME': name,
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'TEST': {'MIRROR': 'default'},
+    }
+# Таблица кэша в отдельном файле SQLite (путь в DB_CACHE): запись в кэш
+# тогда не ждёт очереди писателей основной базы. Таблицу создаёт
+# python manage.py createcachetable --database cache.
+if os.environ.get('DB_CACHE'):
+    DATABASES['cache'] = {
+        'ENGINE': 'core.sqlite3',
+        'NAME': os.environ['DB_CACHE'],
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+    }
+DATABASE_ROUTERS = [
+    'core.cache.CacheRouter',
+    'core.replicas.ReplicaRouter',
+]
+# Сколько секунд после записи пользователь читает только основную базу.
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -136,20 +190,93 @@ LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
-#  подключаем движок filebased.EmailBackend
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+# Письма ставятся в очередь задач, а задача отправляет их движком
+# filebased.EmailBackend.
+EMAIL_BACKEND = 'core.mail.QueuedEmailBackend'
+QUEUED_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 PST_ON_PAGE = 10
+# Комментариев на странице поста и в каждой догружаемой порции.
+COMMENTS_ON_PAGE = 20
+# Записей на странице лент feed.json, feed.rss и feed.atom и сколько
+# секунд клиенты могут не перезапрашивать ленту.
+FEED_PAGE_SIZE = 50
+FEED_MAX_AGE = 60
+
+# Авторы с большим числом подписчиков не раскладываются по лентам
+# при публикации, их посты подмешиваются в /follow/ при чтении.
+TIMELINE_FANOUT_LIMIT = 5000
+# Сколько последних постов автора попадает в ленту при подписке.
+TIMELINE_BACKFILL = 1000
+
+# С какого числа строк списки больших таблиц (лента, админка) берут
+# приблизительное число из статистики вместо COUNT(*), см. posts.counts.
+APPROX_COUNT_THRESHOLD = 100000
+
+# Выполнять фоновые задачи в веб-процессе после ответа на запрос;
+# с воркерами manage.py run_tasks задайте TASKS_INLINE=0.
+TASKS_INLINE = os.environ.get('TASKS_INLINE', '1') == '1'
+# Сколько секунд взятая задача скрыта от других воркеров.
+TASKS_LEASE_SECONDS = 300
+# Ширины вариантов картинки поста для srcset.
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+# Больше этого размера по длинной стороне оригинал не хранится.
+POST_IMAGE_MAX_SIZE = 2560
+
+# Доля запросов, для которых PerformanceMiddleware пишет метрики
+# в заголовок Server-Timing и в лог yatube.perf; 0 — не замерять.
+PERF_SAMPLE_RATE = float(os.environ.get('PERF_SAMPLE_RATE', 0))
+# Замерять ли в этих запросах пик памяти (tracemalloc заметно медленнее).
+PERF_TRACE_MEMORY = os.environ.get('PERF_TRACE_MEMORY', '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'yatube.perf': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Страницы и фрагменты с постами сбрасываются сигналами по версиям
+# (posts.cache), поэтому их можно хранить долго.
+POSTS_CACHE_TTL = 60 * 60 * 6
+
+# Общий для всех воркеров кэш: таблица в основной базе или, если задан
+# REDIS_URL, Redis. Перед ним в каждом процессе стоит небольшой LRU-кэш.
+# Таблицу создаёт python manage.py createcachetable.
+REDIS_URL = os.environ.get('REDIS_URL')
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'core.cache.DatabaseCache',
+        'LOCATION': 'yatube_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
 }